@@ -0,0 +1,335 @@
+import sys
+import numpy as np
+from scipy.interpolate import splrep, splev
+import const
+import ongp
+
+# raised by eos calls for points off the tables or with unphysical inputs, and by the asserts in the root finds
+# of the hm89 core relations; a model that causes one is recorded as failed (see static_batch.run_eos).
+eos_errors = ValueError, AssertionError, ongp.EOSError, ongp.UnphysicalParameterError
+
+class static_batch:
+    '''
+    solves many independent static models at once, for parameter studies where models differ only in
+    (t1 or t10, y1, y2, z1, z2, mcore, transition_pressure).
+
+    structure variables are (n_models, nz) arrays, and each iteration makes one eos call covering every zone
+    of every model that is still iterating, so that python overhead is paid once per iteration rather than
+    once per model. each model has its own convergence test (same criterion as evol.static) and drops out
+    of the eos calls once converged.
+
+    borrows the eos, model atmosphere and mesh function of an existing ongp.evol instance. only covers
+    the three_layer model type without helium rain; the temperature is integrated with the trapezoid rule
+    in ln p rather than with solve_ivp, so results agree with evol.static to roughly radius_rtol.
+    '''
+
+    def __init__(self, e):
+        self.e = e
+        self.nz = e.nz
+        self.evol_params = e.evol_params
+        if not hasattr(e, 'atm'):
+            e.initialize_atm()
+
+    def static(self, params):
+        '''
+        params is a dict like that passed to evol.static, except that any of t1 (or t10), y1, y2, z1, z2, mcore
+        and transition_pressure may be arrays of length n_models. mtot is common to all models.
+        results are set as attributes: profiles p, t, rho, r, y, z, m with shape (n_models, nz), scalars rtot,
+        t10, tint, teff, lint with shape (n_models,), and status, a list holding 'okay' or the exception raised
+        for each model.
+        '''
+        if not 'core_prho_relation' in params.keys():
+            params['core_prho_relation'] = None
+        self.core_prho_relation = params['core_prho_relation']
+
+        mtot = params['mtot']
+        if type(mtot) is str:
+            mtot = {'j':const.mjup, 's':const.msat, 'u':const.mura, 'n':const.mnep}[mtot[0]]
+        self.mtot = mtot
+
+        if ('t1' in params.keys()) and not ('t10' in params.keys()):
+            self.atm_which_t = 't1'
+            tsurf = params['t1']
+            psurf = 1e6
+        elif ('t10' in params.keys()) and not ('t1' in params.keys()):
+            self.atm_which_t = 't10'
+            tsurf = params['t10']
+            psurf = 1e7
+        else:
+            raise ValueError('must specify one and only one of t1 or t10.')
+
+        z2 = params['z2'] if 'z2' in params.keys() else params['z1']
+        y2 = params['y2'] if 'y2' in params.keys() else params['y1']
+        mcore = params['mcore'] if 'mcore' in params.keys() else 0.
+        ptrans = params['transition_pressure'] if 'transition_pressure' in params.keys() else np.inf
+        self.tsurf, self.y1, self.y2, self.z1, self.z2, self.mcore, self.ptrans = \
+            np.broadcast_arrays(*[np.array(x, dtype=float) for x in (tsurf, params['y1'], y2, params['z1'], z2, mcore, ptrans)])
+        n = self.n_models = self.tsurf.size
+        nz = self.nz
+
+        if np.any(self.z1 > 0) and not 'z_eos_option' in self.evol_params:
+            raise ValueError('nonzero z1 requires a z_eos_option.')
+        if np.any(self.z2 < self.z1):
+            raise ongp.UnphysicalParameterError('no z inversion allowed.')
+
+        # lagrangian mesh, one per model since the core boundary must sit on a zone
+        self.m = np.zeros((n, nz))
+        self.kcore = np.zeros(n, dtype=int)
+        for i in range(n):
+            assert self.mcore[i] * const.mearth < mtot, 'core mass must be less than total mass.'
+            if self.mcore[i] > 0.:
+                t = np.linspace(0, 1, nz - 1)
+                m = mtot * self.e.mesh_func(t, mcore=self.mcore[i])
+                kcore = np.where(m >= self.mcore[i] * const.mearth)[0][0]
+                self.m[i] = np.insert(m, kcore, self.mcore[i] * const.mearth)
+                self.kcore[i] = kcore + 1
+            elif self.mcore[i] == 0.:
+                m = mtot * self.e.mesh_func(np.linspace(0, 1, nz))
+                self.m[i] = m * mtot / m[-1]
+            else:
+                raise ongp.UnphysicalParameterError('bad core mass %g' % self.mcore[i])
+        self.dm = np.diff(self.m, axis=1)
+
+        k = np.arange(nz)
+        self.core = k[np.newaxis, :] < self.kcore[:, np.newaxis]
+        self.ktrans = np.full(n, -1)
+        self.set_yz()
+
+        # primitive first guess, as in evol.static
+        self.p = np.ones((n, nz)) * 1e12
+        self.t = np.ones((n, nz)) * 1e4
+        self.rho = np.zeros((n, nz))
+        self.r = np.zeros((n, nz))
+        self.grada = np.zeros((n, nz))
+        active = np.ones(n, dtype=bool)
+        self.status = ['okay'] * n
+        self.iters = np.zeros(n, dtype=int)
+        self.set_density(active, ignore_z=True)
+        self.integrate_continuity(active)
+
+        last_three_radii = np.zeros((n, 3))
+        for iteration in range(self.evol_params['max_iters_static']):
+            self.iters[active] += 1
+            self.integrate_hydrostatic(active, psurf)
+            self.locate_transition_pressure(active, iteration)
+            self.set_yz()
+            self.integrate_temperature(active)
+            self.set_density(active)
+            self.integrate_continuity(active)
+
+            rtot = self.r[:, -1]
+            self.drop(active, ~np.isfinite(rtot), ongp.HydroError, 'found infinite total radius.')
+
+            with np.errstate(divide='ignore', invalid='ignore'): # zero radii of models dropped before continuity
+                converged = np.abs(np.mean(last_three_radii / rtot[:, np.newaxis] - 1., axis=1)) < self.evol_params['radius_rtol']
+            converged &= iteration >= self.evol_params['min_iters_static']
+            last_three_radii[:, :2] = last_three_radii[:, 1:]
+            last_three_radii[:, 2] = rtot
+            active &= ~converged
+            if not np.any(active):
+                break
+        for i in np.where(active)[0]:
+            self.status[i] = ongp.ConvergenceError('exceeded max iterations {}'.format(self.evol_params['max_iters_static']))
+
+        self.rtot = self.r[:, -1]
+        self.set_atm()
+
+    def drop(self, active, bad, error, message):
+        '''
+        record error(message) as the status of each model flagged in bad that is still active, and take those
+        models out of active (in place), so that the rest of the batch carries on without them.
+        '''
+        bad = bad & active
+        for i in np.where(bad)[0]:
+            self.status[i] = error(message)
+        active &= ~bad
+
+    def run_eos(self, func, mask, active, *args):
+        '''
+        call func on the flattened (model, zone) points selected by mask. if that raises one of eos_errors,
+        func is called for each model on its own to find the ones responsible, which are recorded as failed
+        and taken out of active and mask (both in place); the result is then for the points left in mask,
+        or None if there are none.
+        '''
+        try:
+            return func(*[arg[mask] for arg in args])
+        except eos_errors as e:
+            error = e
+        bad = np.zeros(self.n_models, dtype=bool)
+        for i in np.where(np.any(mask, axis=1))[0]:
+            try:
+                func(*[arg[i][mask[i]] for arg in args])
+            except eos_errors as e:
+                bad[i] = True
+                self.status[i] = e if isinstance(e, (ongp.EOSError, ongp.UnphysicalParameterError)) else \
+                    ongp.EOSError('failed in eos call: {}'.format(e))
+        if not np.any(bad): # fails only in company; not a problem with any one model
+            raise error
+        active &= ~bad
+        mask &= ~bad[:, np.newaxis]
+        if not np.any(mask):
+            return None
+        return func(*[arg[mask] for arg in args])
+
+    def integrate_hydrostatic(self, active, psurf):
+        i = active
+        dp = const.cgrav * self.m[i, 1:] * self.dm[i] / 4. / np.pi / self.r[i, 1:] ** 4
+        p = np.zeros_like(self.p[i])
+        p[:, -1] = psurf
+        p[:, :-1] = psurf + np.cumsum(dp[:, ::-1], axis=1)[:, ::-1]
+        self.p[i] = p
+        self.drop(active, np.any(np.isnan(self.p), axis=1), ongp.EOSError, 'nans in pressure after integrate hydrostatic.')
+
+    def locate_transition_pressure(self, active, iteration):
+        # p decreases outward, so the number of zones with p >= ptrans is the first zone outside the transition
+        n_inside = np.sum(self.p >= self.ptrans[:, np.newaxis] * 1e12, axis=1)
+        found = n_inside > 0
+        self.ktrans[active & found] = n_inside[active & found]
+        missing = active & ~found & np.isfinite(self.ptrans)
+        if np.any(missing):
+            if self.mtot > 0.5 * const.msat:
+                if iteration < 2: # pressure guess still poor; rough guess as in evol.locate_transition_pressure
+                    self.ktrans[missing] = int(2. * self.nz / 3)
+                else:
+                    raise ongp.HydroError('found no molecular-metallic transition for {} models.'.format(np.sum(missing)))
+            else:
+                self.ktrans[missing] = -1
+
+    def set_yz(self):
+        k = np.arange(self.nz)[np.newaxis, :]
+        inner = (k < self.ktrans[:, np.newaxis]) & (self.ktrans[:, np.newaxis] > 0)
+        self.z = np.where(inner, self.z2[:, np.newaxis], self.z1[:, np.newaxis])
+        self.y = np.where(inner, self.y2[:, np.newaxis], self.y1[:, np.newaxis])
+        self.z[self.core] = 1.
+        self.y[self.core] = 0.
+
+    def integrate_temperature(self, active):
+        if not np.any(active):
+            return
+        env = ~self.core & active[:, np.newaxis]
+        res = self.run_eos(self.e.hhe_eos.get, env, active, np.log10(self.p), np.log10(self.t), self.y)
+        if res is None:
+            return
+        self.grada[env] = res['grada']
+        self.grada[self.core] = 0.
+        self.drop(active, np.any(np.isnan(self.grada) & env, axis=1), ongp.EOSError, 'nans in grada after eos call.')
+
+        # dlnt = grada * dlnp, trapezoid rule inward from the surface
+        i = active
+        lnp = np.log(self.p[i])
+        dlnt = 0.5 * (self.grada[i, 1:] + self.grada[i, :-1]) * np.diff(lnp, axis=1)
+        lnt = np.zeros_like(lnp)
+        lnt[:, :-1] = -np.cumsum(dlnt[:, ::-1], axis=1)[:, ::-1]
+        t = self.tsurf[i, np.newaxis] * np.exp(lnt)
+        # core is isothermal at temperature of core-mantle boundary
+        kcore = self.kcore[i]
+        t = np.where(np.arange(self.nz)[np.newaxis, :] < kcore[:, np.newaxis], t[np.arange(len(kcore)), kcore][:, np.newaxis], t)
+        self.t[i] = t
+
+    def set_density(self, active, ignore_z=False):
+        if not np.any(active):
+            return
+        core = self.core & active[:, np.newaxis]
+        if np.any(core):
+            relation = self.core_prho_relation
+            rho_guess = np.where(self.rho > 0, self.rho, 8.)
+            if relation == 'hm89 rock':
+                rho_core = self.run_eos(self.e.get_rhoz_hm89_rock, core, active, self.p, rho_guess)
+            elif relation == 'hm89 ice':
+                rho_core = self.run_eos(self.e.get_rhoz_hm89_ice, core, active, self.p, rho_guess)
+            elif relation:
+                raise ValueError("core_prho_relation must be one of 'hm89 rock' or 'hm89 ice'.")
+            else:
+                logrho_core = self.run_eos(self.e.z_eos.get_logrho, core, active, np.log10(self.p), np.log10(self.t))
+                rho_core = None if logrho_core is None else 10 ** logrho_core
+            if rho_core is not None:
+                self.rho[core] = rho_core
+        env = ~self.core & active[:, np.newaxis] # models whose core failed are out
+        if not np.any(env):
+            return
+        if ignore_z or not np.any(self.z[env] > 0.):
+            logrho_env = self.run_eos(self.e.hhe_eos.get_logrho, env, active, np.log10(self.p), np.log10(self.t), self.y)
+            rho_env = None if logrho_env is None else 10 ** logrho_env
+        else:
+            rho_env = self.run_eos(self.e.get_rho_xyz, env, active, np.log10(self.p), np.log10(self.t), self.y, self.z)
+        if rho_env is None:
+            return
+        self.rho[env] = rho_env
+        self.drop(active, np.any(np.isnan(self.rho), axis=1), ongp.EOSError, 'nans in rho after eos call.')
+
+    def integrate_continuity(self, active):
+        i = active
+        q = np.zeros_like(self.rho[i])
+        q[:, 1:] = 3. * self.dm[i] / 4 / np.pi / self.rho[i, 1:]
+        self.r[i] = np.cumsum(q, axis=1) ** (1. / 3)
+
+    def set_atm(self):
+        '''same as evol.set_atm for each model; the model atmosphere lookups are scalar root finds.'''
+        n = self.n_models
+        self.t10 = np.zeros(n)
+        self.tint = np.zeros(n)
+        self.teff = np.zeros(n)
+        self.lint = np.zeros(n)
+        with np.errstate(divide='ignore'):
+            self.surface_g = const.cgrav * self.mtot / self.rtot ** 2
+        atm_option = self.evol_params['atm_option']
+        for i in range(n):
+            if self.status[i] != 'okay':
+                self.t10[i] = self.tint[i] = self.teff[i] = self.lint[i] = np.nan
+                continue
+            try:
+                if self.atm_which_t == 't1':
+                    k10 = np.where(self.p[i] < 1e7)[0][0]
+                    tck = splrep(self.p[i, k10-2:k10+2][::-1], self.t[i, k10-2:k10+2][::-1], k=3)
+                    self.t10[i] = splev(1e7, tck)
+                else:
+                    self.t10[i] = self.tsurf[i]
+                g = self.surface_g[i]
+                if atm_option.split()[0] == 'f11_tables':
+                    if g * 1e-2 > max(self.e.atm.g_grid):
+                        g = max(self.e.atm.g_grid) * 1e2 * 0.99
+                    elif g * 1e-2 < min(self.e.atm.g_grid):
+                        raise ongp.AtmError('surface gravity too low for atm tables. value = %g, minimum = %g' % (g*1e-2, min(self.e.atm.g_grid)))
+                try:
+                    self.tint[i], self.teff[i] = self.e.atm.get_tint_teff(g * 1e-2, self.t10[i], flux_level=None)
+                except ValueError as e:
+                    raise ongp.AtmError('atm lookup failed for g=%g, t10=%g: %s' % (g*1e-2, self.t10[i], e.args[0]))
+                self.lint[i] = 4. * np.pi * self.rtot[i] ** 2 * const.sigma_sb * self.tint[i] ** 4
+            except ongp.AtmError as e:
+                self.status[i] = e
+                self.tint[i] = self.teff[i] = self.lint[i] = np.nan
+
+if __name__ == '__main__':
+    # check that a model off the eos tables fails on its own: the same batch with and without it, using a
+    # toy eos (n = 1 polytrope-like density, constant grada) whose table stops at y = 0.5.
+    class toy_hhe_eos:
+        def check(self, y):
+            if np.any(y > 0.5):
+                raise ValueError('out of bounds in toy eos')
+        def get(self, logp, logt, y):
+            self.check(y)
+            return {'grada':0.3 + 0. * logp}
+        def get_logrho(self, logp, logt, y):
+            self.check(y)
+            return np.log10((10 ** logp / 2e12) ** 0.5 + 1e-4)
+    class toy_z_eos:
+        def get_logrho(self, logp, logt):
+            return np.log10(4. + (10 ** logp / 1e13) ** 0.5)
+    class toy_atm:
+        g_grid = 1., 1e3
+        def get_tint_teff(self, g, t10, flux_level=None):
+            return t10 / 1.5, t10 / 1.4
+    class toy_evol:
+        nz = 512
+        evol_params = {'max_iters_static':100, 'min_iters_static':3, 'radius_rtol':1e-6, 'atm_option':'f11_tables', 'z_eos_option':'toy'}
+        hhe_eos, z_eos, atm = toy_hhe_eos(), toy_z_eos(), toy_atm()
+        def mesh_func(self, t, mcore=None):
+            return 1. - (1. - t) ** 5
+    batch = static_batch(toy_evol())
+    batch.static({'mtot':'jup', 't1':[150., 160., 170.], 'y1':[0.27, 0.9, 0.27], 'z1':0., 'mcore':[0., 10., 20.]})
+    rtot, status = batch.rtot, batch.status
+    batch.static({'mtot':'jup', 't1':[150., 170.], 'y1':0.27, 'z1':0., 'mcore':[0., 20.]})
+    print('status with an off-table model: {}'.format(', '.join([str(s) for s in status])))
+    okay = isinstance(status[1], ongp.EOSError) and status[0] == status[2] == 'okay' and np.array_equal(rtot[[0, 2]], batch.rtot)
+    print('other models unaffected' if okay else 'other models differ: {} vs {}'.format(rtot[[0, 2]], batch.rtot))
+    sys.exit(0 if okay else 1)
@@ -0,0 +1,65 @@
+'''
+measure memory allocated by the static iteration hot path, with and without reused work buffers
+(evol_params['reuse_work_buffers']).
+
+python has no public counter of allocation events, so this uses tracemalloc to record the peak memory
+allocated above the starting point during each iteration, and reports it both in bytes and in units of
+nz-length float arrays. memory allocated inside the eos tables' own interpolation is included in both cases.
+
+usage: python benchmark_alloc.py [nz] [iterations]
+'''
+import sys
+import time
+import tracemalloc
+import numpy as np
+import ongp
+
+default_evol_params = {'hhe_eos_option':'scvh', 'z_eos_option':'reos water', 'atm_option':'f11_tables', 'atm_planet':'jup'}
+default_static_params = {'mtot':'jup', 't1':165., 'y1':0.27, 'z1':0.02, 'z2':0.1, 'mcore':10., 'transition_pressure':1.,
+                         'model_type':'three_layer'}
+
+def one_iteration(e):
+    '''the steps of one evol.static iteration before helium rain.'''
+    e.integrate_hydrostatic()
+    e.locate_transition_pressure()
+    e.set_yz()
+    e.integrate_temperature()
+    e.set_core_density()
+    e.set_envelope_density()
+    e.integrate_continuity()
+
+def run(reuse_work_buffers, nz=1024, iterations=10, evol_params=None, static_params=None):
+    '''
+    converge a static model, then time and trace further iterations on it. returns the peak allocation per
+    iteration in bytes (array of length iterations) and the mean wall time per iteration in seconds.
+    '''
+    params = dict(default_evol_params if evol_params is None else evol_params)
+    params['nz'] = nz
+    params['reuse_work_buffers'] = reuse_work_buffers
+    e = ongp.evol(params)
+    e.static(dict(default_static_params if static_params is None else static_params))
+
+    one_iteration(e) # first call after static fills any buffers not yet used
+    t0 = time.time()
+    for i in range(iterations):
+        one_iteration(e)
+    dt = (time.time() - t0) / iterations
+
+    peak = np.zeros(iterations)
+    tracemalloc.start()
+    for i in range(iterations):
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        one_iteration(e)
+        _, peak[i] = tracemalloc.get_traced_memory()
+        peak[i] -= start
+    tracemalloc.stop()
+    return peak, dt
+
+if __name__ == '__main__':
+    nz = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print('{:>20} {:>16} {:>16} {:>16}'.format('reuse_work_buffers', 'peak bytes/iter', 'nz-arrays/iter', 'ms/iter'))
+    for reuse in False, True:
+        peak, dt = run(reuse, nz, iterations)
+        print('{:>20} {:>16.0f} {:>16.1f} {:>16.2f}'.format(str(reuse), np.median(peak), np.median(peak) / 8. / nz, dt * 1e3))
@@ -0,0 +1,309 @@
+'''
+time and check the helium rain calculation (evol.equilibrium_y_profile) on its own, without eos, atmosphere
+or phase diagram data: a synthetic phase diagram with the interface of lorenzen.hhe_phase_diagram that the
+rain calculation uses, and canned p, t, y profiles on a jupiter-mass mesh covering no rain, a helium gradient,
+and rainout to the core.
+
+each case is checked for the expected outcome, helium mass conservation and 0 <= y <= 1, and the gradient case
+for being unaffected by a model held before evol.reset. the phase diagram's tables (lorenzen.hhe_phase_diagram,
+built here from the synthetic phase diagram's splines) are checked against its splines, as is t_phase.
+outputs (y, k1 and k_shell_top) are compared against a reference file, so that a change to the rain code can
+be shown to leave its results alone; benchmark_rain_reference.npz holds those of the rain code before it was
+optimized (the baseline equilibrium_y_profile, with splrep/splev and per-zone loops) at nz=1024. wall time per
+call is reported.
+
+usage: python benchmark_rain.py [nz] [calls] [reference]
+the reference defaults to benchmark_rain_reference.npz for nz=1024, and to none otherwise. if the reference
+.npz file exists, outputs are checked against it; otherwise they're saved there.
+'''
+import sys
+import os
+import time
+import numpy as np
+from scipy.interpolate import splrep, splev
+import const
+import ongp
+import lorenzen
+from lorenzen import get_y
+
+class synthetic_phase_diagram:
+    '''
+    analytic miscibility gap with a critical point (xcrit, tcrit) at each pressure node. the helium-poor and
+    helium-rich branches approach the critical point exponentially in temperature:
+        x_lo = xcrit * exp(-(tcrit - t) / tau),
+        x_hi = 1 - (1 - xcrit) * exp(-(tcrit - t) / tau).
+    p in Mbar, t in kK, x the helium number fraction relative to h+he.
+    '''
+    def __init__(self, pvals=(1., 2., 4., 10., 24.), tcrit=(6.5, 7.9, 9., 10.5, 12.), xcrit=0.3, tau=1.):
+        self.pvals = np.array(pvals, dtype=float)
+        self.tcrit = dict(zip(self.pvals, tcrit))
+        self.xcrit = xcrit
+        self.tau = tau
+        # x_lo(t) for each node as a cubic spline, extrapolated above tcrit, as in lorenzen
+        tgrid = np.linspace(1., 15., 57)
+        self.tck_xlo = {pval:splrep(tgrid, self.get_xlo(self.tcrit[pval], tgrid), k=3) for pval in self.pvals}
+
+    def get_tcrit(self, p):
+        '''critical temperature, linear in log p between nodes.'''
+        return np.interp(np.log(p), np.log(self.pvals), [self.tcrit[pval] for pval in self.pvals])
+
+    def get_xlo(self, tcrit, t):
+        return self.xcrit * np.exp(-(tcrit - t) / self.tau)
+
+    def get_xhi(self, tcrit, t):
+        return 1. - (1. - self.xcrit) * np.exp(-(tcrit - t) / self.tau)
+
+    def miscibility_gap(self, p, t):
+        '''(x_lo, x_hi) at p, t, or 'stable' above the critical temperature; as lorenzen.hhe_phase_diagram.'''
+        if p < min(self.pvals) or p > max(self.pvals):
+            raise ValueError('p value {} outside bounds for phase diagram'.format(p))
+        tcrit = self.get_tcrit(p)
+        if t > tcrit:
+            return 'stable'
+        return self.get_xlo(tcrit, t), self.get_xhi(tcrit, t)
+
+    def simple_xhi(self, p):
+        '''helium-rich branch at half the critical temperature, for the helium-rich shell atop the core.'''
+        tcrit = self.get_tcrit(np.clip(p, min(self.pvals), max(self.pvals)))
+        return self.get_xhi(tcrit, 0.5 * tcrit)
+
+class tabulated_phase_diagram(synthetic_phase_diagram, lorenzen.hhe_phase_diagram):
+    '''
+    the synthetic phase diagram with lorenzen.hhe_phase_diagram's tables of x_lo and x_hi built from its splines,
+    so that the rain calculation takes the vectorized ymax path (see evol.get_phase_ymax), and with lorenzen's
+    table lookups (get_xlo_xhi, ymax, t_phase) and spline evaluation (miscibility_gap_profile) to compare.
+    '''
+    def __init__(self, **kwargs):
+        synthetic_phase_diagram.__init__(self, **kwargs)
+        self.p_interpolation = 'log'
+        tgrid = np.linspace(1., 15., 57)
+        self.tck_xhi = {pval:splrep(tgrid, self.get_xhi(self.tcrit[pval], tgrid), k=3) for pval in self.pvals}
+        self.t_clean = {pval:tgrid[tgrid <= self.tcrit[pval]] for pval in self.pvals} # sets table_tmin
+        self.initialize_tables()
+        self.initialize_inverse_tables()
+
+# outputs of the baseline rain code at nz=1024; see get_outputs
+default_reference = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_rain_reference.npz')
+
+# t scale of the canned profile and the expected outcome of the rain calculation
+cases = {
+    'no rain':{'t_scale':1.3, 'outcome':'none'},
+    'gradient':{'t_scale':1., 'outcome':'gradient'},
+    'rainout to core':{'t_scale':0.7, 'outcome':'core'}
+    }
+
+def make_profile(case, nz=1024, phase=None):
+    '''
+    an evol instance holding just what equilibrium_y_profile needs: a jupiter-mass model with a 10 earth-mass
+    core, p = 40 Mbar * (1 - envelope mass fraction) ** 3 + 1 bar, t = 6 kK * (p / 2 Mbar) ** 0.3 times the
+    case's t_scale, z of 0.04 and 0.02 inside and outside 1 Mbar, and y=0.27. phase is the synthetic phase
+    diagram by default.
+    '''
+    e = ongp.evol.__new__(ongp.evol)
+    e.evol_params = {}
+    e.static_params = {'adjust_shell_top_abundance':True}
+    e.phase = phase or synthetic_phase_diagram()
+    e.nz = nz
+    mcore = 10. * const.mearth
+    e.kcore = nz // 32
+    e.m = np.append(np.linspace(0, mcore, e.kcore, endpoint=False), np.linspace(mcore, const.mjup, nz - e.kcore))
+    e.dm = np.diff(e.m)
+    q = (e.m - mcore) / (const.mjup - mcore)
+    p = 40. * (1. - np.clip(q, 0, 1)) ** 3 + 1e-6 # Mbar
+    p[:e.kcore] = 40. * (1. + 0.5 * (1. - e.m[:e.kcore] / mcore))
+    e.p = p * 1e12
+    e.t = 6. * (p / 2.) ** 0.3 * cases[case]['t_scale'] * 1e3
+    e.ktrans = np.where(p < 1.)[0][0]
+    e.z = np.where(np.arange(nz) < e.ktrans, 0.04, 0.02)
+    e.z[:e.kcore] = 1.
+    e.y = np.where(np.arange(nz) < e.kcore, 0., 0.27)
+    e.mhe = np.dot(e.y[:-1], e.dm)
+    e.r = const.rjup * (e.m / const.mjup) ** (1. / 3) # not used beyond diagnostics
+    e.iters = 1
+    e.iters_rain = 1
+    e.k1 = 0
+    return e
+
+def run_case(case, nz=1024):
+    '''run the rain calculation once on a fresh profile; returns the evol instance and y.'''
+    e = make_profile(case, nz)
+    return e, e.equilibrium_y_profile(0.)
+
+def check_case(case, e, y):
+    '''list of failed checks (empty if all pass).'''
+    failures = []
+    k = e.kcore
+    if y is e.y:
+        outcome = 'none'
+    elif getattr(e, 'k_shell_top', None):
+        outcome = 'core'
+    else:
+        outcome = 'gradient'
+    if outcome != cases[case]['outcome']:
+        failures.append('outcome {}, expected {}'.format(outcome, cases[case]['outcome']))
+    if np.any(y[k:] < 0) or np.any(y[k:] > 1):
+        failures.append('y outside [0, 1]')
+    # helium mass in the convention of each part of the calculation, both conserved to round-off: the shell top
+    # is adjusted to conserve it (static_params['adjust_shell_top_abundance']), and the gradient's homogeneous
+    # interior takes up what's missing in its prefix sums, where zone k > kcore carries dm[k-1] (and zone kcore,
+    # on the core boundary, nothing).
+    if outcome == 'gradient':
+        rel_mhe_error = abs(np.dot(y[k+1:], e.dm[k:]) / e.mhe - 1.)
+        tolerance = 1e-10
+        if np.any(np.diff(y[k:]) > 0):
+            failures.append('y increases outward')
+    elif outcome == 'core':
+        rel_mhe_error = e.rel_mhe_error
+        tolerance = 1e-10
+    else:
+        rel_mhe_error = tolerance = 0.
+    if rel_mhe_error > tolerance:
+        failures.append('helium mass error {:.2e}'.format(rel_mhe_error))
+    return failures
+
+def check_tables(nz=1024, atol=1e-7, y_atol=1e-5):
+    '''
+    list of failed checks (empty if all pass) of the table path of the phase diagram against its splines:
+    get_xlo_xhi against miscibility_gap_profile over a grid of p and t reaching below the tables, to within atol,
+    and each case's rain calculation with the tabulated phase diagram against the synthetic one, to within y_atol.
+    '''
+    failures = []
+    phase = tabulated_phase_diagram()
+    p, t = np.meshgrid(np.logspace(0., np.log10(24.), 97), np.linspace(0.3, 13., 255))
+    xlo, xhi, stable = phase.get_xlo_xhi(p, t)
+    xlo_spline, xhi_spline, stable_spline = phase.miscibility_gap_profile(p, t)
+    if np.any(stable != stable_spline) or np.any(np.isnan(xlo) != np.isnan(xlo_spline)):
+        failures.append('tables and splines disagree on where the phases are stable')
+    ok = ~np.isnan(xlo_spline)
+    for name, table, spline in ('x_lo', xlo, xlo_spline), ('x_hi', xhi, xhi_spline):
+        error = np.max(np.abs(table[ok] - spline[ok]))
+        if not error <= atol:
+            failures.append('table {} differs from spline by up to {:.2e}'.format(name, error))
+    for case in cases:
+        e, y = run_case(case, nz)
+        e_table = make_profile(case, nz, phase=phase)
+        y_table = e_table.equilibrium_y_profile(0.)
+        error = np.max(np.abs(y_table - y))
+        if not error <= y_atol or e_table.k1 != e.k1:
+            failures.append('{}: y with tables differs by up to {:.2e}, k1 {} vs {}'.format(case, error, e_table.k1, e.k1))
+    return failures
+
+def check_t_phase(rtol=1e-4):
+    '''
+    list of failed checks (empty if all pass) of the tabulated phase diagram's t_phase at 1, 2, 3 and 4 Mbar,
+    for x on the tabulated x_lo branch and off it (beyond the critical point, where the splines extrapolate, and
+    colder than the tables): t must be found, and x_lo interpolated between the bracketing nodes' splines must
+    be x there to within rtol.
+    '''
+    failures = []
+    phase = tabulated_phase_diagram()
+    p, x = [a.ravel() for a in np.meshgrid([1., 2., 3., 4.], [1e-3, 0.01, 0.1, 0.25, 0.35, 0.5])]
+    t = phase.t_phase(p, x)
+    j, alpha = phase.get_p_bracket(p)
+    for n in range(len(p)):
+        if not np.isfinite(t[n]):
+            failures.append('no t_phase for p={:g} x={:g}'.format(p[n], x[n]))
+            continue
+        xlo = alpha[n] * splev(t[n], phase.tck_xlo[phase.table_p[j[n] + 1]]) + (1. - alpha[n]) * splev(t[n], phase.tck_xlo[phase.table_p[j[n]]])
+        if not abs(xlo / x[n] - 1.) <= rtol:
+            failures.append('x_lo at t_phase for p={:g} x={:g} off by {:.2e}'.format(p[n], x[n], xlo / x[n] - 1.))
+    return failures
+
+def check_reset(nz=1024):
+    '''
+    list of failed checks (empty if all pass) of the rain calculation on an instance that held another model
+    before evol.reset, against a fresh instance: nothing of the earlier model's rain calculation may carry over.
+    the earlier model is the rainout case, with the starting profiles static would have saved when continuing it.
+    '''
+    fresh, y_fresh = run_case('gradient', nz)
+    e, y = run_case('rainout to core', nz)
+    e.p_start, e.t_start, e.y_start = np.copy(e.p), np.copy(e.t), np.copy(y)
+    e.mtot, e.mcore = const.mjup, 10.
+    e.logp, e.logt = np.log10(e.p), np.log10(e.t)
+    e.reset()
+    new = make_profile('gradient', nz)
+    for name in 'm', 'dm', 'kcore', 'ktrans', 'p', 't', 'y', 'z', 'mhe', 'iters_rain':
+        setattr(e, name, getattr(new, name))
+    y = e.equilibrium_y_profile(0.)
+    failures = []
+    if e.k1 != fresh.k1:
+        failures.append('k1 {} after reset, {} fresh'.format(e.k1, fresh.k1))
+    if np.any(y != y_fresh):
+        failures.append('y after reset differs from fresh by up to {:.2e}'.format(np.max(np.abs(y - y_fresh))))
+    return failures
+
+def time_case(case, nz=1024, calls=20):
+    '''mean wall time (s) per call over calls calls on one profile, the first call excepted.'''
+    e = make_profile(case, nz)
+    e.equilibrium_y_profile(0.)
+    t0 = time.time()
+    for i in range(calls):
+        e.iters_rain = i + 2
+        e.equilibrium_y_profile(0.)
+    return (time.time() - t0) / calls
+
+def get_outputs(nz=1024):
+    '''y, k1 and k_shell_top (-1 for none) of every case, keyed by case name with spaces removed.'''
+    outputs = {}
+    for case in cases:
+        e, y = run_case(case, nz)
+        name = case.replace(' ', '_')
+        outputs[name + '_y'] = np.copy(y)
+        outputs[name + '_k1'] = e.k1
+        outputs[name + '_k_shell_top'] = getattr(e, 'k_shell_top', None) or -1
+    return outputs
+
+def compare(outputs, reference, atol=1e-6):
+    '''
+    list of differences between two sets of outputs from get_outputs. zone indices must agree exactly; y to
+    within atol, which allows for the different (local rather than spline) interpolation of the optimized code.
+    '''
+    differences = []
+    for name, value in outputs.items():
+        if not name in reference:
+            differences.append('{} missing from reference'.format(name))
+        elif np.shape(value) != np.shape(reference[name]):
+            differences.append('{} shape {} != {}'.format(name, np.shape(value), np.shape(reference[name])))
+        elif np.any(np.abs(value - reference[name]) > atol):
+            differences.append('{} max difference {:.2e}'.format(name, np.max(np.abs(value - reference[name]))))
+    return differences
+
+if __name__ == '__main__':
+    nz = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    reference = sys.argv[3] if len(sys.argv) > 3 else default_reference if nz == 1024 else None
+
+    print('{:>16} {:>10} {:>6} {:>12} {:>10}  {}'.format('case', 'outcome', 'k1', 'k_shell_top', 'ms/call', 'checks'))
+    okay = True
+    for case in cases:
+        e, y = run_case(case, nz)
+        failures = check_case(case, e, y)
+        okay &= not failures
+        walltime = time_case(case, nz, calls)
+        print('{:>16} {:>10} {:>6} {:>12} {:>10.3f}  {}'.format(case, cases[case]['outcome'], e.k1,
+            str(getattr(e, 'k_shell_top', None)), walltime * 1e3, '; '.join(failures) or 'okay'))
+
+    failures = check_tables(nz)
+    okay &= not failures
+    print('phase diagram tables against splines: {}'.format('; '.join(failures) or 'okay'))
+
+    failures = check_t_phase()
+    okay &= not failures
+    print('t_phase on and off the x_lo branch: {}'.format('; '.join(failures) or 'okay'))
+
+    failures = check_reset(nz)
+    okay &= not failures
+    print('rain after evol.reset: {}'.format('; '.join(failures) or 'same as fresh'))
+
+    if reference:
+        outputs = get_outputs(nz)
+        if os.path.exists(reference):
+            with np.load(reference) as data:
+                differences = compare(outputs, dict(data))
+            okay &= not differences
+            print('compared to {}: {}'.format(reference, '; '.join(differences) or 'identical'))
+        else:
+            np.savez(reference, **outputs)
+            print('saved reference outputs to {}'.format(reference))
+
+    sys.exit(0 if okay else 1)
@@ -0,0 +1,216 @@
+'''
+gaussian-process emulator of static models, for sampling problems (e.g., mcmc) that need the map from
+(mtot, t1, y1, z1, z2, mcore, transition_pressure) to (rtot, teff, tint, nmoi) many more times than
+static can be afforded.
+
+train on static models over a box in parameter space, then call emulator.static(params) as you would
+evol.static(params, outputs='scalars'). where the emulator's estimated relative error in any output exceeds
+threshold, or params fall outside the training box, the model is instead built with static and added to
+the training set.
+'''
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from scipy.optimize import minimize
+import const
+import ongp
+import grid
+
+input_names = 'mtot', 't1', 'y1', 'z1', 'z2', 'mcore', 'transition_pressure'
+output_names = 'rtot', 'teff', 'tint', 'nmoi'
+
+def get_mtot(mtot):
+    '''mtot in grams, allowing the same strings as evol.static.'''
+    if type(mtot) is str:
+        return {'j':const.mjup, 's':const.msat, 'u':const.mura, 'n':const.mnep}[mtot[0]]
+    return mtot
+
+class gp:
+    '''
+    gaussian process regression of one output on inputs scaled to the unit cube, with a squared-exponential
+    kernel with one length scale per input. targets are standardized, so the signal variance is 1.
+    '''
+    def __init__(self, x, y):
+        self.x = x
+        self.ymean = np.mean(y)
+        self.ystd = np.std(y) if np.std(y) > 0 else 1.
+        self.yt = (y - self.ymean) / self.ystd
+        self.log_length = np.zeros(x.shape[1]) + np.log(0.3)
+        self.log_noise = np.log(1e-6)
+        self.factor()
+
+    def kernel(self, a, b, log_length):
+        d = (a[:, None, :] - b[None, :, :]) / np.exp(log_length)
+        return np.exp(-0.5 * np.sum(d ** 2, axis=2))
+
+    def factor(self):
+        k = self.kernel(self.x, self.x, self.log_length)
+        k[np.diag_indices_from(k)] += np.exp(self.log_noise) + 1e-10
+        self.cho = cho_factor(k, lower=True)
+        self.alpha = cho_solve(self.cho, self.yt)
+
+    def neg_log_likelihood(self, theta):
+        log_length, log_noise = theta[:-1], theta[-1]
+        k = self.kernel(self.x, self.x, log_length)
+        k[np.diag_indices_from(k)] += np.exp(log_noise) + 1e-10
+        try:
+            cho = cho_factor(k, lower=True)
+        except np.linalg.LinAlgError:
+            return 1e20
+        alpha = cho_solve(cho, self.yt)
+        return 0.5 * np.dot(self.yt, alpha) + np.sum(np.log(np.diag(cho[0])))
+
+    def optimize(self):
+        '''maximum-likelihood length scales and noise.'''
+        theta = np.append(self.log_length, self.log_noise)
+        bounds = [(np.log(1e-2), np.log(1e2))] * len(self.log_length) + [(np.log(1e-12), np.log(1e-2))]
+        res = minimize(self.neg_log_likelihood, theta, method='L-BFGS-B', bounds=bounds)
+        self.log_length, self.log_noise = res.x[:-1], res.x[-1]
+        self.factor()
+
+    def predict(self, x):
+        '''mean and standard deviation of the output at each row of x.'''
+        ks = self.kernel(x, self.x, self.log_length)
+        mean = np.dot(ks, self.alpha)
+        v = solve_triangular(self.cho[0], ks.T, lower=True)
+        var = np.maximum(1. - np.sum(v ** 2, axis=0), 0.)
+        return self.ymean + self.ystd * mean, self.ystd * np.sqrt(var)
+
+class emulator:
+    def __init__(self, e, bounds, static_params=None, threshold=1e-3, refit_interval=50, verbose=False):
+        '''
+        e is the evol instance used for training and fallback solves. bounds is a dict mapping each of
+        input_names to a (low, high) pair; mtot in grams. static_params are passed to every static call
+        (e.g., y2, model_type, and any of input_names not being varied, which then need no bounds).
+        threshold is the largest estimated relative error (one sigma) in any output for which the emulator
+        is trusted. hyperparameters are refit after every refit_interval points added by fallback solves.
+        '''
+        self.e = e
+        self.static_params = {} if static_params is None else dict(static_params)
+        if 'mtot' in self.static_params:
+            self.static_params['mtot'] = get_mtot(self.static_params['mtot'])
+        self.names = [name for name in input_names if name in bounds]
+        for name in input_names:
+            if not name in bounds and not name in self.static_params:
+                raise ValueError('{} needs either bounds or a value in static_params.'.format(name))
+        self.low = np.array([bounds[name][0] for name in self.names], dtype=float)
+        self.high = np.array([bounds[name][1] for name in self.names], dtype=float)
+        self.threshold = threshold
+        self.refit_interval = refit_interval
+        self.verbose = verbose
+        self.x = np.zeros((0, len(self.names))) # training inputs, unscaled
+        self.y = np.zeros((0, len(output_names)))
+        self.added_since_fit = 0
+        self.gps = None
+        self.nsolves = 0
+        self.nemulated = 0
+
+    def scale(self, x):
+        return (np.asarray(x, dtype=float) - self.low) / (self.high - self.low)
+
+    def sample(self, npts, seed=None):
+        '''latin hypercube of npts points in the training box, shape (npts, len(self.names)).'''
+        rng = np.random.RandomState(seed)
+        u = (np.array([rng.permutation(npts) for name in self.names]).T + rng.uniform(size=(npts, len(self.names)))) / npts
+        return self.low + u * (self.high - self.low)
+
+    def train(self, npts, seed=None):
+        '''build static models at npts points of a latin hypercube (see grid.sweep), and fit.'''
+        x = self.sample(npts, seed)
+        res = grid.sweep(self.e, self.static_params, {name:x[:, i] for i, name in enumerate(self.names)},
+            outputs=output_names, verbose=self.verbose)
+        ok = res['status'] == 'okay'
+        if self.verbose:
+            print('{} of {} training models converged'.format(np.count_nonzero(ok), npts))
+        self.add_points(x[ok], np.array([res[name][ok] for name in output_names]).T)
+        self.fit()
+
+    def add_points(self, x, y):
+        self.x = np.vstack((self.x, x))
+        self.y = np.vstack((self.y, y))
+        self.added_since_fit += len(x)
+
+    def fit(self, optimize=True):
+        '''
+        one gp per output, in log of the output so that its standard deviation is a relative error.
+        with optimize=False, keep each gp's hyperparameters and just condition on the current training set.
+        '''
+        x = self.scale(self.x)
+        logy = np.log(self.y)
+        old = self.gps
+        self.gps = []
+        for i, name in enumerate(output_names):
+            this = gp(x, logy[:, i])
+            if old is not None:
+                this.log_length, this.log_noise = old[i].log_length, old[i].log_noise
+            if optimize:
+                this.optimize()
+            else:
+                this.factor()
+            self.gps.append(this)
+        if optimize:
+            self.added_since_fit = 0
+
+    def predict(self, x):
+        '''
+        emulated outputs at each row of x (inputs in the order of self.names). returns (mean, relative error),
+        each of shape (len(x), len(output_names)).
+        '''
+        x = np.atleast_2d(self.scale(x))
+        mean = np.zeros((len(x), len(output_names)))
+        err = np.zeros_like(mean)
+        for i, this in enumerate(self.gps):
+            mean[:, i], err[:, i] = this.predict(x)
+        return np.exp(mean), err
+
+    def static(self, params, outputs='scalars'):
+        '''
+        same call as evol.static(params, outputs='scalars'): sets rtot, teff, tint and nmoi as attributes of this
+        emulator, along with rel_err (dict of estimated relative errors; zero for a true solve) and emulated
+        (False if the model was built with static). a true solve raises whatever static raises.
+        '''
+        assert outputs == 'scalars', 'the emulator only provides scalar outputs.'
+        params = dict(self.static_params, **params)
+        params['mtot'] = get_mtot(params['mtot'])
+        x = np.array([params[name] for name in self.names], dtype=float)
+        inside = np.all(x >= self.low) and np.all(x <= self.high)
+        if inside and self.gps is not None:
+            mean, err = self.predict(x)
+            if np.all(err[0] <= self.threshold):
+                for i, name in enumerate(output_names):
+                    setattr(self, name, mean[0, i])
+                self.rel_err = dict(zip(output_names, err[0]))
+                self.emulated = True
+                self.nemulated += 1
+                return
+
+        if hasattr(self.e, 'mtot'):
+            self.e.reset() # start from the last model built
+        self.e.static(params, outputs='scalars')
+        self.nsolves += 1
+        y = np.array([getattr(self.e, name) for name in output_names])
+        for name, value in zip(output_names, y):
+            setattr(self, name, value)
+        self.rel_err = {name:0. for name in output_names}
+        self.emulated = False
+        if inside:
+            self.add_points(x[None, :], y[None, :])
+            self.fit(optimize=self.gps is None or self.added_since_fit >= self.refit_interval)
+
+    def save(self, path):
+        '''training set and hyperparameters, to be restored with load.'''
+        np.savez(path, names=self.names, low=self.low, high=self.high, x=self.x, y=self.y,
+            log_length=np.array([this.log_length for this in self.gps]),
+            log_noise=np.array([this.log_noise for this in self.gps]))
+
+    def load(self, path):
+        with np.load(path) as data:
+            if list(data['names']) != self.names:
+                raise ValueError('emulator in {} was trained on {}, not {}'.format(path, list(data['names']), self.names))
+            self.low, self.high = data['low'], data['high']
+            self.x, self.y = data['x'], data['y']
+            self.gps = None
+            self.fit(optimize=False)
+            for this, log_length, log_noise in zip(self.gps, data['log_length'], data['log_noise']):
+                this.log_length, this.log_noise = log_length, log_noise
+                this.factor()
+        self.added_since_fit = 0
@@ -0,0 +1,195 @@
+'''
+drivers for building many static models over a grid of parameters.
+'''
+import numpy as np
+import time
+import os
+import multiprocessing
+import ongp
+
+# exceptions recorded as the status of a failed point rather than raised. AssertionError is raised for some
+# unphysical points, e.g., by set_atm with too few zones outside of 10 bars and by the hm89 core root finds.
+point_errors = ongp.EOSError, ongp.AtmError, ongp.HydroError, ongp.UnphysicalParameterError, ongp.ConvergenceError, AssertionError
+
+def sweep(e, static_params, grid, outputs=('rtot', 'teff', 'tint', 't10', 'iters'), verbose=False):
+    '''
+    build one static model for each point of grid on the evol instance e, using continuation: points are taken
+    in the order that makes each one as close as possible to a model already converged, and each solve starts
+    from the p, t profile of that nearest converged model (see evol.reset) rather than from the primitive guess.
+
+    static_params is the dict of parameters common to every point; grid is a dict mapping parameter names
+    (e.g., 'z1', 'z2', 'mcore', 'transition_pressure') to arrays with one entry per point. distances between
+    points are measured after scaling each parameter by its range over the grid.
+
+    returns a dict mapping each grid parameter and each name in outputs to an array over the points (in the
+    order given, not the order solved), plus 'status' (the exception raised for failed points, else 'okay')
+    and 'seed' (index of the point whose profile was the first guess, -1 for none).
+    '''
+    names = list(grid)
+    x = np.array([np.asarray(grid[name], dtype=float) for name in names]).T # shape (npts, nparams)
+    npts = len(x)
+    span = np.ptp(x, axis=0)
+    span[span == 0] = 1.
+    x = x / span
+
+    res = {name:np.array(grid[name], dtype=float) for name in names}
+    for name in outputs:
+        res[name] = np.full(npts, np.nan)
+    res['status'] = np.array(['okay'] * npts, dtype=object)
+    res['seed'] = np.full(npts, -1, dtype=int)
+
+    guesses = {} # warm starts of converged points
+    solved = np.zeros(npts, dtype=bool)
+    dist = np.full(npts, np.inf) # distance from each point to the nearest converged point
+    nearest = np.full(npts, -1, dtype=int)
+    # start from the point nearest the middle of the grid
+    i = np.argmin(np.sum((x - np.mean(x, axis=0)) ** 2, axis=1))
+    for n in range(npts):
+        if n > 0:
+            todo = np.where(~solved)[0]
+            i = todo[np.argmin(dist[todo])]
+        solved[i] = True
+
+        if hasattr(e, 'mtot'):
+            e.reset()
+        if nearest[i] >= 0:
+            e.warm_start = guesses[nearest[i]]
+        elif hasattr(e, 'warm_start'):
+            del(e.warm_start) # nothing converged yet; don't start from a failed model
+        res['seed'][i] = nearest[i]
+
+        params = dict(static_params)
+        for name in names:
+            params[name] = res[name][i]
+        t0 = time.time()
+        try:
+            e.static(params)
+        except point_errors as exc:
+            res['status'][i] = exc
+            if verbose:
+                print('point {:>5n} failed: {}'.format(i, exc))
+            continue
+        for name in outputs:
+            res[name][i] = getattr(e, name)
+        if verbose:
+            print('point {:>5n} seed {:>5n} iters {:>3n} et_ms {:>8.1f}'.format(i, nearest[i], e.iters, (time.time() - t0) * 1e3))
+
+        guesses[i] = e.get_warm_start()
+        d = np.sqrt(np.sum((x - x[i]) ** 2, axis=1))
+        closer = d < dist
+        dist[closer] = d[closer]
+        nearest[closer] = i
+
+    return res
+
+# the evol instance of a run_grid worker process, built once by init_worker and reused for all of its points
+worker = {}
+
+def init_worker(evol_params, mesh_params):
+    worker['evol'] = ongp.evol(evol_params, mesh_params)
+
+def run_point(task):
+    '''build one point on this worker's evol instance; returns (index, outputs, status, message, walltime, pid).'''
+    i, params, mode, outputs = task
+    e = worker['evol']
+    if hasattr(e, 'mtot'):
+        e.reset() # keeps eos and atm; the last point's profile is the first guess for this one
+    if mode == 'evolve' and hasattr(e, 'history'):
+        del(e.history)
+    t0 = time.time()
+    values = [np.nan] * len(outputs)
+    try:
+        if mode == 'static':
+            e.static(params)
+        else:
+            e.evolve(params)
+        values = [getattr(e, name) for name in outputs]
+        status, message = 'okay', ''
+    except point_errors as exc:
+        status, message = type(exc).__name__, str(exc)
+        if hasattr(e, 'mtot'):
+            e.reset()
+        if hasattr(e, 'warm_start'): # don't seed the next point from a failed model
+            del(e.warm_start)
+    return i, values, status, message, time.time() - t0, os.getpid()
+
+def run_grid(evol_params, params, grid, mode='static', outputs=('rtot', 'teff', 'tint', 't10', 'iters'),
+             outfile=None, processes=None, mesh_params=None, chunksize=None, verbose=False):
+    '''
+    build a static (or evolve, per mode) model for each point of grid in a pool of worker processes. each worker
+    builds one evol instance from evol_params and mesh_params, loading the eos and atm tables once, and builds
+    all of its points on it (see evol.reset). params is the dict common to every point; grid is a dict mapping
+    parameter names to arrays with one entry per point. workers take contiguous runs of chunksize points, so
+    order the grid so that neighbouring points are similar.
+
+    as each point finishes, a row is appended to outfile (if given): whitespace-separated columns index, the
+    grid parameters, outputs, status (okay, or the class of the exception raised), walltime, pid and message
+    (of the exception, with whitespace replaced by underscores; - for none), under a header of column names,
+    e.g. for np.genfromtxt(outfile, names=True, dtype=None, encoding=None). rows are in order of completion.
+    the exceptions in point_errors are recorded, not raised.
+
+    returns a dict like that of sweep: each grid parameter and output as an array in the order given, plus
+    'status', 'message' (of the exception), 'walltime' and 'pid'.
+
+    for throughput that scales with the number of processes, keep each worker to one thread of numerical
+    libraries, e.g. by setting OMP_NUM_THREADS=1 in the environment before starting python.
+    '''
+    names = list(grid)
+    npts = len(grid[names[0]])
+    res = {name:np.array(grid[name], dtype=float) for name in names}
+    for name in outputs:
+        res[name] = np.full(npts, np.nan)
+    res['status'] = np.array([''] * npts, dtype=object)
+    res['message'] = np.array([''] * npts, dtype=object)
+    res['walltime'] = np.full(npts, np.nan)
+    res['pid'] = np.zeros(npts, dtype=int)
+
+    tasks = []
+    for i in range(npts):
+        these_params = dict(params)
+        for name in names:
+            these_params[name] = res[name][i]
+        tasks.append((i, these_params, mode, outputs))
+
+    processes = processes or multiprocessing.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, npts // (processes * 4))
+
+    columns = ['index'] + names + list(outputs) + ['status', 'walltime', 'pid', 'message']
+    f = open(outfile, 'w') if outfile else None
+    if f:
+        f.write(' '.join(['{:>16s}'.format(name) for name in columns]) + '\n')
+        f.flush()
+
+    t0 = time.time()
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(evol_params, {} if mesh_params is None else mesh_params))
+    try:
+        for n, (i, values, status, message, walltime, pid) in enumerate(pool.imap_unordered(run_point, tasks, chunksize)):
+            for name, value in zip(outputs, values):
+                res[name][i] = value
+            res['status'][i] = status
+            res['message'][i] = message
+            res['walltime'][i] = walltime
+            res['pid'][i] = pid
+            if f:
+                row = ['{:>16n}'.format(i)] + ['{:>16.8e}'.format(res[name][i]) for name in names + list(outputs)] + \
+                    ['{:>16s}'.format(status), '{:>16.3f}'.format(walltime), '{:>16n}'.format(pid),
+                    '{:>16s}'.format('_'.join(message.split()) or '-')]
+                f.write(' '.join(row) + '\n')
+                f.flush()
+            if verbose:
+                print('{:>6n} of {:>6n} point {:>6n} pid {:>8n} status {:>24s} et_s {:>8.2f}'.format(n + 1, npts, i, pid, status, walltime))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        if f:
+            f.close()
+
+    if verbose:
+        ok = res['status'] == 'okay'
+        print('{} of {} points okay in {:.1f} s with {} processes ({:.2f} s per point per process)'.format(
+            np.count_nonzero(ok), npts, time.time() - t0, processes, (time.time() - t0) * processes / npts))
+    return res
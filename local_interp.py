@@ -0,0 +1,80 @@
+'''
+vectorized interpolation that only looks at the data bracketing each point, for the rain calculation
+(see ongp.evol.equilibrium_y_profile), where a spline fit per evaluation costs far more than the evaluation.
+data are 1d arrays with xp strictly increasing.
+
+usage: python local_interp.py, to compare against the splrep/splev fits these replace.
+'''
+import numpy as np
+
+def get_bracket(x, xp):
+    '''index j of the interval xp[j] <= x < xp[j + 1] for each x, clipped to the first and last intervals.'''
+    return np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+
+def linear(x, xp, fp):
+    '''
+    piecewise-linear interpolation, extrapolating linearly from the first and last intervals
+    (like splev of a k=1 splrep, and unlike np.interp, which clamps).
+    '''
+    xp = np.asarray(xp, dtype=float)
+    fp = np.asarray(fp, dtype=float)
+    j = get_bracket(x, xp)
+    alpha = (np.asarray(x, dtype=float) - xp[j]) / (xp[j + 1] - xp[j])
+    return fp[j] + alpha * (fp[j + 1] - fp[j])
+
+def monotone_cubic(x, xp, fp):
+    '''
+    piecewise-cubic hermite interpolation with fritsch-carlson slopes (as scipy's PchipInterpolator), evaluated
+    from the four data points around each x: no overshoot, and exact for data that are locally linear. x outside
+    xp is extrapolated from the end interval.
+    '''
+    xp = np.asarray(xp, dtype=float)
+    fp = np.asarray(fp, dtype=float)
+    n = len(xp)
+    j = get_bracket(x, xp)
+
+    def secant(i):
+        i = np.clip(i, 0, n - 2)
+        return (fp[i + 1] - fp[i]) / (xp[i + 1] - xp[i]), xp[i + 1] - xp[i]
+
+    def slope(i):
+        # derivative at xp[i] from the secants on either side; the one-sided secant at the ends of the data
+        d0, h0 = secant(i - 1)
+        d1, h1 = secant(i)
+        w0 = 2 * h1 + h0
+        w1 = h1 + 2 * h0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d = np.where(d0 * d1 > 0, (w0 + w1) / (w0 / d0 + w1 / d1), 0.)
+        d = np.where(i == 0, d1, d)
+        return np.where(i == n - 1, d0, d)
+
+    delta, h = secant(j)
+    m0 = slope(j)
+    m1 = slope(j + 1)
+    s = (np.asarray(x, dtype=float) - xp[j]) / h
+    return fp[j] * (1 + 2 * s) * (1 - s) ** 2 + fp[j + 1] * s ** 2 * (3 - 2 * s) \
+        + h * s * (1 - s) * (m0 * (1 - s) - m1 * s)
+
+if __name__ == '__main__':
+    from scipy.interpolate import splrep, splev, PchipInterpolator
+    # a jupiter-like envelope adiabat, ordered center to surface as in ongp
+    nz = 1024
+    p = np.logspace(np.log10(4e1), np.log10(1e-6), nz) # Mbar
+    t = 20. * (p / 40.) ** 0.3 # kK
+    pvals = np.array([1., 2., 4., 10., 24.])
+
+    ti_spline = []
+    for pval in pvals:
+        k = np.argsort(abs(p - pval))[0]
+        ti_spline.append(splev(pval, splrep(p[k+3:k-3:-1], t[k+3:k-3:-1], k=3)))
+    ti = monotone_cubic(pvals, p[::-1], t[::-1])
+    print('node temperatures: max relative difference from 6-point splrep {:.2e}, from pchip {:.2e}'.format(
+        np.max(np.abs(ti / ti_spline - 1.)), np.max(np.abs(ti / PchipInterpolator(p[::-1], t[::-1])(pvals) - 1.))))
+
+    t10 = linear(10., p[::-1], t[::-1])
+    print('t at 10 Mbar: difference from k=1 splrep {:.2e}'.format(abs(t10 - splev(10., splrep(p[::-1], t[::-1], k=1)))))
+
+    y = 0.27 - 0.05 * (p > 3.)
+    pnew = p * 1.01
+    print('y remapped: max difference from k=1 splrep {:.2e}'.format(
+        np.max(np.abs(linear(pnew, p[::-1], y[::-1]) - splev(pnew, splrep(p[::-1], y[::-1], k=1))))))
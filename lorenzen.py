@@ -2,6 +2,13 @@ from scipy.optimize import brentq, minimize
 from scipy.interpolate import splrep, splev # Bspline
 import numpy as np
 import time
+import os
+import json
+import pickle
+import hashlib
+
+# bump if initialization changes, to orphan cached phase diagrams (see hhe_phase_diagram.__init__)
+cache_version = 1
 
 class hhe_phase_diagram:
     """interpolates in the Lorenzen et al. 2011 phase diagram to return maximum soluble helium fraction,
@@ -28,12 +35,23 @@ class hhe_phase_diagram:
                     t_shift_p1=False,
                     x_transform=None,
                     y_transform=None,
-                    p_interpolation='log'
+                    p_interpolation='log',
+                    cache_dir=None
                     ):
+        '''
+        if cache_dir is set, the fitted splines, critical points, cleaned curves and tables are saved there after
+        initialization, and later constructions with the same data file and options load them instead.
+        '''
 
         if not path_to_data:
-            import os
             path_to_data = os.environ['ongp_data_path']
+
+        if cache_dir:
+            options = {'order':order, 'extrapolate_to_low_pressure':extrapolate_to_low_pressure, 't_shift_p1':t_shift_p1,
+                       'x_transform':x_transform, 'y_transform':y_transform, 'p_interpolation':p_interpolation}
+            cache_file = self.get_cache_file(cache_dir, path_to_data, options)
+            if self.load_cache(cache_file):
+                return
         self.p_interpolation = p_interpolation
         self.extrapolate_to_low_pressure = extrapolate_to_low_pressure
 
@@ -104,6 +122,40 @@ class hhe_phase_diagram:
         # self.splinet = {} # dict used to look up t component of bspline curve for any p in self.pvals
 
         self.initialize_splines()
+        self.initialize_tables()
+        self.initialize_inverse_tables()
+
+        if cache_dir:
+            self.save_cache(cache_file)
+
+    def get_cache_file(self, cache_dir, path_to_data, options):
+        '''cache file named for a hash of cache_version, the contents of the data file, and the constructor options.'''
+        h = hashlib.sha1()
+        h.update('{}\n'.format(cache_version).encode())
+        with open('{}/demixHHe_Lorenzen.dat'.format(path_to_data), 'rb') as f:
+            h.update(f.read())
+        h.update(json.dumps(options, sort_keys=True, default=repr).encode())
+        return os.path.join(cache_dir, 'lorenzen_{}.pkl'.format(h.hexdigest()))
+
+    def load_cache(self, cache_file):
+        '''set all attributes from cache_file and return True if it exists and is readable; else return False.'''
+        if not os.path.exists(cache_file):
+            return False
+        try:
+            with open(cache_file, 'rb') as f:
+                state = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError): # partly written or corrupt; rebuild
+            return False
+        self.__dict__.update(state)
+        return True
+
+    def save_cache(self, cache_file):
+        if not os.path.exists(os.path.dirname(cache_file)):
+            os.makedirs(os.path.dirname(cache_file))
+        tmp = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(self.__dict__, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file) # so that a reader (e.g., another grid worker) never sees a partial file
 
     def splinex(self, pval, z):
         return splev(z, self.tck_x[pval])
@@ -272,6 +324,77 @@ class hhe_phase_diagram:
             self.t_clean[1] = t
 
 
+    def initialize_tables(self, nt=4096):
+        '''
+        tabulate x_lo and x_hi from the splines of each pressure node, for vectorized lookups in get_xlo_xhi and
+        ymax. rows are the pressure nodes themselves, so interpolating between rows in the coordinate set by
+        p_interpolation is the same p interpolation as miscibility_gap's. each row is tabulated on nt points
+        regular in u = sqrt(tcrit - t), in which both branches are nearly linear up to the critical point.
+        '''
+        self.table_p = np.array(sorted(self.tck_xlo))
+        self.table_tcrit = np.array([self.tcrit[pval] for pval in self.table_p])
+        self.table_tmin = min([min(self.t_clean[pval]) for pval in self.table_p])
+        self.table_umax = np.sqrt(self.table_tcrit - self.table_tmin)
+        self.table_xlo = np.zeros((len(self.table_p), nt))
+        self.table_xhi = np.zeros((len(self.table_p), nt))
+        for j, pval in enumerate(self.table_p):
+            t = self.tcrit[pval] - np.linspace(0., self.table_umax[j], nt) ** 2
+            self.table_xlo[j] = splev(t, self.tck_xlo[pval])
+            self.table_xhi[j] = splev(t, self.tck_xhi[pval])
+
+    def get_p_bracket(self, p):
+        '''
+        for each p (Mbar; scalar or array), index j of the pressure node below (so that the bracketing nodes are
+        table_p[j] and table_p[j+1]) and the interpolation weight alpha of the upper node. p beyond the outermost
+        nodes gives alpha outside [0, 1].
+        '''
+        p = np.asarray(p, dtype=float)
+        j = np.clip(np.searchsorted(self.table_p, p, side='right') - 1, 0, len(self.table_p) - 2)
+        plo = self.table_p[j]
+        phi = self.table_p[j + 1]
+        if self.p_interpolation == 'linear':
+            alpha = (p - plo) / (phi - plo)
+        elif self.p_interpolation == 'log':
+            alpha = (np.log10(p) - np.log10(plo)) / (np.log10(phi) - np.log10(plo))
+        return j, alpha
+
+    def get_xlo_xhi(self, p, t):
+        '''
+        table lookup of the helium number fractions of the helium-poor and helium-rich phases at arrays p (Mbar)
+        and t (kK). returns (xlo, xhi, stable): stable is True where t is above the critical temperature of either
+        bracketing node, as in miscibility_gap, and xlo, xhi are nan there and wherever p is outside the nodes.
+        below the tables (t < table_tmin) the splines are evaluated instead, extrapolating as miscibility_gap does.
+        '''
+        p, t = np.broadcast_arrays(np.asarray(p, dtype=float), np.asarray(t, dtype=float))
+        j, alpha = self.get_p_bracket(p)
+        inside = (alpha >= 0.) & (alpha <= 1.)
+        stable = inside & (((alpha < 1.) & (t > self.table_tcrit[j])) | ((alpha > 0.) & (t > self.table_tcrit[j + 1])))
+
+        res = [0., 0.]
+        for jj, weight in (j, 1. - alpha), (j + 1, alpha):
+            # linear in u on this node's regular grid
+            nt = self.table_xlo.shape[1]
+            u = np.sqrt(np.maximum(self.table_tcrit[jj] - t, 0.)) / self.table_umax[jj] * (nt - 1)
+            u = np.minimum(u, nt - 1.)
+            i = np.minimum(u.astype(int), nt - 2)
+            beta = u - i
+            for n, table in enumerate((self.table_xlo, self.table_xhi)):
+                res[n] = res[n] + weight * ((1. - beta) * table[jj, i] + beta * table[jj, i + 1])
+        xlo, xhi = [np.where(stable | ~inside, np.nan, x) for x in res]
+        cold = inside & (t < self.table_tmin)
+        if np.any(cold):
+            xlo[cold], xhi[cold] = self.miscibility_gap_profile(p[cold], t[cold])[:2]
+        return xlo, xhi, stable
+
+    def ymax(self, p, t, z, t_offset=0.):
+        '''
+        maximum soluble helium mass fraction for arrays p (Mbar), t (kK) and z, i.e., that of the helium-poor
+        phase, with the phase diagram shifted by t_offset (kK; positive means more demixing) as in
+        evol.equilibrium_y_profile. 1 where stable; nan where p is outside the pressure nodes.
+        '''
+        xlo, xhi, stable = self.get_xlo_xhi(p, np.asarray(t) - t_offset)
+        return np.where(stable, 1., get_y(z, xlo))
+
     def miscibility_gap(self, p, t):
         '''for a given pressure and temperature, return the helium number fraction of the
         helium-poor and helium-rich phases.
@@ -374,85 +497,115 @@ class hhe_phase_diagram:
 
         return xlo, xhi
 
+    def miscibility_gap_profile(self, p, t):
+        '''
+        miscibility_gap for arrays p (Mbar) and t (kK), e.g. over a whole profile. returns arrays (xlo, xhi, stable):
+        stable is True where t exceeds the critical temperature of either bracketing pressure node, and xlo, xhi
+        (helium number fractions of the helium-poor and helium-rich phases) are nan there and wherever p is
+        outside the nodes. pressure nodes are bracketed once for all points with searchsorted (see get_p_bracket),
+        and each node's splines are evaluated once for all points that use it. unlike miscibility_gap, a p that
+        falls exactly on a node uses that node alone.
+        '''
+        p, t = np.broadcast_arrays(np.asarray(p, dtype=float), np.asarray(t, dtype=float))
+        j, alpha = self.get_p_bracket(p)
+        inside = (alpha >= 0.) & (alpha <= 1.)
+        stable = inside & (((alpha < 1.) & (t > self.table_tcrit[j])) | ((alpha > 0.) & (t > self.table_tcrit[j + 1])))
+        ok = inside & ~stable
+        xlo = np.zeros(p.shape)
+        xhi = np.zeros(p.shape)
+        for n, pval in enumerate(self.table_p):
+            for these, weight in (ok & (j == n), 1. - alpha), (ok & (j + 1 == n), alpha):
+                if np.any(these):
+                    xlo[these] += weight[these] * splev(t[these], self.tck_xlo[pval])
+                    xhi[these] += weight[these] * splev(t[these], self.tck_xhi[pval])
+        xlo[~ok] = np.nan
+        xhi[~ok] = np.nan
+        return xlo, xhi, stable
+
     def t_phase(self, p, x):
         '''for a given pressure and helium-poor number fraction, return the phase boundary temperature.
 
         args
-        p: pressure in Mbar = 1e12 dyne cm^-2
-        x: helium number fraction (dimensionless)
+        p: pressure in Mbar = 1e12 dyne cm^-2 (scalar or array)
+        x: helium number fraction (dimensionless; scalar or array)
         )
         returns
-        t_phase: phase boundary temperature (kK)
+        t_phase: phase boundary temperature (kK), i.e., the t at which x_lo, interpolated in p as in
+        miscibility_gap, equals x. looked up in the inverse tables made by initialize_inverse_tables where x is
+        on the tabulated x_lo branch; elsewhere (x beyond the critical point or colder than the tables) found by
+        minimizing the residual on the extrapolated splines, as t_phase_spline. nan where p is outside the
+        pressure nodes or that fails.
         '''
-        if p == 1.:
-            p += 1e-10
-
-        if p < min(self.pvals):
-            return 'failed'
-            raise ValueError('p value {} outside bounds for phase diagram'.format(p))
-        elif p > max(self.pvals):
-            return 'failed'
-            raise ValueError('p value {} outside bounds for phase diagram'.format(p))
-
-        plo = self.pvals[self.pvals < p][-1]
-        phi = self.pvals[self.pvals > p][0]
-        assert p > plo
-        assert p < phi
-
-        # for reference: this is how miscibility_gap gets xlo, xhi
-                # xlo_plo = splev(t, self.tck_xlo[plo])
-                # xhi_plo = splev(t, self.tck_xhi[plo])
-                # xlo_phi = splev(t, self.tck_xlo[phi])
-                # xhi_phi = splev(t, self.tck_xhi[phi])
-        # then interpolates (linear in log10p) between plo results and phi results
-        if False:
-            zmin_plo = zmin_phi = 0.
-            from scipy.optimize import brentq
-            try:
-                zlo_plo = brentq(lambda z: self.splinex(plo, z) - x, zmin_plo, self.zcrit[plo])
-                zlo_phi = brentq(lambda z: self.splinex(phi, z) - x, zmin_phi, self.zcrit[phi])
-            except ValueError as e:
-                print('plo={}, phi={}, x={}'.format(plo, phi, x))
-                raise
-                return 'failed'
-
-            tlo_plo = self.splinet(plo, zlo_plo)
-            tlo_phi = self.splinet(phi, zlo_phi)
-            # print(tlo_plo, tlo_phi)
-
-            # 'plo = {} got z = {} and t_plo = {}'.format(plo, zlo_plo, tlo_plo)
-            # 'plo = {} got z = {} and t_plo = {}'.format(plo, zlo_plo, tlo_plo)
-
-            if self.p_interpolation == 'linear':
-                alpha = (p - plo) / (phi - plo) # linear in P doesn't work as well
-            elif self.p_interpolation == 'log':
-                alpha = (np.log10(p) - np.log10(plo)) / (np.log10(phi) - np.log10(plo))
-            t_phase = alpha * tlo_phi + (1. - alpha) * tlo_plo
-
-            return t_phase
-        else:
-            t_plo = splev(x, self.tck_xlo_inv[plo])
-            t_phi = splev(x, self.tck_xlo_inv[phi])
-            alpha = (np.log10(p) - np.log10(plo)) / (np.log10(phi) - np.log10(plo))
-            minimize_me = lambda t: (alpha * splev(t, self.tck_xlo[phi]) + (1. - alpha) * splev(t, self.tck_xlo[plo]) - x) ** 2
-            from scipy.optimize import minimize
-            sol = minimize(minimize_me, 6)
-            assert sol.success
-            t_phase = sol.x[0]
-            return t_phase
+        scalar = np.ndim(p) == 0 and np.ndim(x) == 0
+        p, x = np.broadcast_arrays(np.asarray(p, dtype=float), np.asarray(x, dtype=float))
+        j, alpha = self.get_p_bracket(p)
+        nalpha = len(self.inv_alpha)
+        nx = self.inv_t.shape[2]
+        a = np.clip(alpha, 0., 1.) * (nalpha - 1)
+        ia = np.minimum(a.astype(int), nalpha - 2)
+        w = a - ia
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logx = np.log(x)
+        t = 0.
+        ok = (alpha >= 0.) & (alpha <= 1.)
+        for iaa, weight in (ia, 1. - w), (ia + 1, w):
+            logx_lo = self.inv_logx_range[j, iaa, 0]
+            logx_hi = self.inv_logx_range[j, iaa, 1]
+            u = (logx - logx_lo) / (logx_hi - logx_lo) * (nx - 1)
+            ok &= (u >= 0.) & (u <= nx - 1.)
+            u = np.clip(np.nan_to_num(u), 0., nx - 1.)
+            i = np.minimum(u.astype(int), nx - 2)
+            beta = u - i
+            t = t + weight * ((1. - beta) * self.inv_t[j, iaa, i] + beta * self.inv_t[j, iaa, i + 1])
+        t = np.where(ok, t, np.nan)
+        inside = (alpha >= 0.) & (alpha <= 1.)
+        for n in np.where((inside & ~ok).ravel())[0]:
+            t.flat[n] = self.t_phase_spline(j.flat[n], alpha.flat[n], x.flat[n])
+        return float(t) if scalar else t
+
+    def t_phase_spline(self, j, alpha, x):
+        '''
+        t at which x_lo, weighted alpha toward pressure node j+1 from node j, equals x, by minimizing the
+        squared relative residual on the (extrapolated) splines from t = 6 kK; nan if that fails. relative so
+        that small x (e.g., colder than the tables) converges as well as large.
+        '''
+        tck_plo = self.tck_xlo[self.table_p[j]]
+        tck_phi = self.tck_xlo[self.table_p[j+1]]
+        minimize_me = lambda t: ((alpha * splev(t, tck_phi) + (1. - alpha) * splev(t, tck_plo)) / x - 1.) ** 2
+        sol = minimize(minimize_me, 6)
+        return sol.x[0] if sol.success else np.nan
 
+    def initialize_inverse_tables(self, nalpha=65, nx=1025, nt=4096):
+        '''
+        tabulate the inverse of the x_lo branch for t_phase: for each pair of adjacent pressure nodes and each of
+        nalpha interpolation weights between them, t as a function of log x on nx regular points spanning the
+        branch from the lowest tabulated t up to the lower of the two critical temperatures. the blended x_lo is
+        monotone in t there, so each row is a direct (np.interp) inversion of nt samples of it.
+        '''
+        nint = len(self.table_p) - 1
+        self.inv_alpha = np.linspace(0., 1., nalpha)
+        self.inv_logx_range = np.zeros((nint, nalpha, 2))
+        self.inv_t = np.zeros((nint, nalpha, nx))
+        for j in range(nint):
+            tcrit = min(self.table_tcrit[j], self.table_tcrit[j+1])
+            t = tcrit - np.linspace(np.sqrt(tcrit - self.table_tmin), 0., nt) ** 2 # increasing, dense near tcrit
+            xlo_plo = splev(t, self.tck_xlo[self.table_p[j]])
+            xlo_phi = splev(t, self.tck_xlo[self.table_p[j+1]])
+            for ia, alpha in enumerate(self.inv_alpha):
+                x = alpha * xlo_phi + (1. - alpha) * xlo_plo
+                # guard against non-monotone or non-positive extrapolation at the cold end
+                x = np.maximum.accumulate(np.maximum(x, 1e-10))
+                logx = np.log(x)
+                self.inv_logx_range[j, ia] = logx[0], logx[-1]
+                self.inv_t[j, ia] = np.interp(np.linspace(logx[0], logx[-1], nx), logx, t)
 
     def get_tcrit(self, p):
-        plo = self.pvals[self.pvals < p][-1]
-        phi = self.pvals[self.pvals > p][0]
-        assert p > plo
-        assert p < phi
-
-        if self.p_interpolation == 'linear':
-            alpha = (p - plo) / (phi - plo) # linear in P doesn't work as well
-        elif self.p_interpolation == 'log':
-            alpha = (np.log10(p) - np.log10(plo)) / (np.log10(phi) - np.log10(plo))
-        return alpha * self.tcrit[phi] + (1. - alpha) * self.tcrit[plo]
+        '''critical temperature (kK) at p (Mbar; scalar or array), interpolated between pressure nodes; nan outside them.'''
+        scalar = np.ndim(p) == 0
+        j, alpha = self.get_p_bracket(p)
+        tcrit = alpha * self.table_tcrit[j+1] + (1. - alpha) * self.table_tcrit[j]
+        tcrit = np.where((alpha >= 0.) & (alpha <= 1.), tcrit, np.nan)
+        return float(tcrit) if scalar else tcrit
 
     def show_splines(self, show_data=True, ax=None, label_curves=True, **kwargs):
         import matplotlib.pyplot as plt
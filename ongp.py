@@ -2,6 +2,7 @@ import numpy as np
 from scipy.interpolate import RegularGridInterpolator, interp1d, splrep, splev
 from scipy.integrate import trapz, cumtrapz
 import const
+import local_interp
 import pickle
 import time
 import os
@@ -87,6 +88,8 @@ class evol:
                 params['x_transform'] = None
             if not 'y_transform' in params.keys():
                 params['y_transform'] = None
+            if not 'phase_cache_dir' in params.keys():
+                params['phase_cache_dir'] = None # if set, initialized phase diagrams are cached here
 
             if params['hhe_phase_diagram'] == 'lorenzen':
                 import lorenzen
@@ -95,7 +98,8 @@ class evol:
                                         params['path_to_data'],
                                         extrapolate_to_low_pressure=params['extrapolate_phase_diagram_to_low_pressure'],
                                         t_shift_p1=params['t_shift_p1'],
-                                        p_interpolation=params['phase_p_interpolation']
+                                        p_interpolation=params['phase_p_interpolation'],
+                                        cache_dir=params['phase_cache_dir']
                                         )
             elif params['hhe_phase_diagram'] == 'schoettler':
                 import schoettler
@@ -123,7 +127,12 @@ class evol:
             'y1_rtol':1e-4,
             'max_iters_static':30,
             'min_iters_static':3,
-            'max_iters_static_before_rain':3
+            'max_iters_static_before_rain':3,
+            'eos_dirty_tol':None, # if set, only re-evaluate the eos in zones whose inputs moved by more than this
+            'rain_pt_tol':None, # if set, recompute y in the rain loop only once p, t have moved by more than this; see rain_update_due
+            'reuse_work_buffers':True, # scratch arrays for the static iteration persist in self.work; see workspace
+            'static_cache_dir':None, # if set, converged static models are cached here; see static_cache.py
+            'static_cache_max_mb':1e3
         }
         # overwrite with any passed by user
         for key, value in params.items():
@@ -138,7 +147,15 @@ class evol:
             'width_surface_mesh_boost':1e-2,
             'amplitude_core_mesh_boost':1e1,
             'width_core_mesh_boost':1e-1,
-            'fmean_core_bdy_mesh_boost':3e-1
+            'fmean_core_bdy_mesh_boost':3e-1,
+            # adaptive rezoning between evolve steps; see self.rezone. interval 0 means never rezone.
+            'rezone_interval':0,
+            'rezone_weight_mass':1.,
+            'rezone_weight_lnp':1.,
+            'rezone_weight_lnt':1.,
+            'rezone_weight_y':1.,
+            'rezone_weight_z':1.,
+            'rezone_max_zone_weight':10.
             }
         # overwrite with any passed by user
         for key, value in mesh_params.items():
@@ -156,6 +173,21 @@ class evol:
         self.t = np.zeros(self.nz)
         self.y = np.zeros(self.nz)
         self.z = np.zeros(self.nz)
+        # log10 of p, t, rho; kept in step with the linear arrays wherever those are set, so eos calls needn't take logs
+        self.logp = np.zeros(self.nz)
+        self.logt = np.zeros(self.nz)
+        self.logrho = np.zeros(self.nz)
+
+        # per-zone eos inputs and results from the last evaluation, for incremental eos calls (eos_dirty_tol)
+        self.eos_cache = {}
+        self.work = workspace(self.evol_params['reuse_work_buffers'])
+        # lazily computed derived quantities; see derived_groups. profile_version counts changes to the model.
+        self.profile_version = 0
+        self.derived = {}
+        self.derived_version = {}
+        if self.evol_params['static_cache_dir']:
+            import static_cache
+            self.model_cache = static_cache.static_cache(self.evol_params['static_cache_dir'], self.evol_params['static_cache_max_mb'])
 
 
     # mesh function defining mass enclosed within a given zone number
@@ -197,9 +229,149 @@ class evol:
         else:
             raise ValueError('mesh type %s not recognized.' % self.mesh_params['mesh_func_type'])
 
-    def get_rho_z(self, logp, logt):
+    def rezone(self):
+        '''
+        redistribute the envelope zones according to local gradients in ln p, ln t, y and z, and remap
+        the current profile onto the new mesh. meant to be called between evolve steps, so that zones
+        follow ktrans, the helium gradient region and the shell top as they move.
+
+        the new mesh equidistributes a monitor whose increment across each existing zone is
+            w_mass * dm / m_env + sum_i w_i * |dx_i| / sum(|dx_i|),  x_i = ln p, ln t, y, z,
+        so each term commands a share of the zones proportional to its weight, and terms with no
+        variation (e.g., y in a homogeneous envelope) drop out. no single zone may carry more than
+        rezone_max_zone_weight times the mean increment, so that discontinuities don't swallow the mesh.
+
+        the core mesh and the core-mantle zone are left alone. y and z are remapped conservatively, so that
+        np.dot(self.y[:-1], self.dm) -- and thus the helium mass self.mhe -- is unchanged to round-off.
+        '''
+        assert self.mesh_params['rezone_weight_mass'] > 0, 'rezone_weight_mass must be positive.'
+        k0 = self.kcore # node k0 and the surface node are fixed
+        m_old = np.copy(self.m)
+        m_env = m_old[k0:]
+        dm_env = np.diff(m_env)
+
+        w_lnp = self.mesh_params['rezone_weight_lnp']
+        for attempt in range(10):
+            ds = self.mesh_params['rezone_weight_mass'] * dm_env / np.sum(dm_env)
+            for w, x in ((w_lnp, np.log(self.p[k0:])),
+                        (self.mesh_params['rezone_weight_lnt'], np.log(self.t[k0:])),
+                        (self.mesh_params['rezone_weight_y'], self.y[k0:]),
+                        (self.mesh_params['rezone_weight_z'], self.z[k0:])):
+                dx = np.abs(np.diff(x))
+                if w > 0 and np.sum(dx) > 0:
+                    ds += w * dx / np.sum(dx)
+            ds = np.minimum(ds, self.mesh_params['rezone_max_zone_weight'] * np.mean(ds))
+            s = np.insert(np.cumsum(ds), 0, 0.)
+            m_env_new = np.interp(np.linspace(0., s[-1], len(s)), s, m_env)
+            # set_atm needs at least 5 zones outside of 10 bars; lean harder on ln p until that's true.
+            logp_new = np.interp(m_env_new, m_env, self.logp[k0:])
+            if len(logp_new[logp_new < 7.]) >= 5:
+                break
+            w_lnp *= 2.
+        else:
+            raise HydroError('rezone failed to place 5 zones outside of 10 bars.')
+
+        # composition: conservative remap of zone values y[k] (k < nz - 1), which go with dm[k]
+        for name in 'y', 'z':
+            x = getattr(self, name)
+            cumulative = np.insert(np.cumsum(x[k0:-1] * dm_env), 0, 0.)
+            x[k0:-1] = np.diff(np.interp(m_env_new, m_env, cumulative)) / np.diff(m_env_new)
+
+        # structure: interpolate node values in mass
+        for name in 'p', 't', 'rho':
+            x = getattr(self, name)
+            logx = getattr(self, 'log' + name)
+            logx[k0:] = np.interp(m_env_new, m_env, logx[k0:])
+            x[k0:] = 10 ** logx[k0:]
+        self.r[k0:] = np.interp(m_env_new, m_env, self.r[k0:] ** 3) ** (1. / 3)
+        remapped = []
+        for name in 'entropy', 'previous_entropy', 'grada', 'gradt', 'chirho', 'chit', 'chiy', 'grady', 'brunt_b', 'ymax':
+            x = getattr(self, name, None)
+            if x is None or any(x is other for other in remapped): # previous_entropy is often the same array as entropy
+                continue
+            x[k0:] = np.interp(m_env_new, m_env, x[k0:])
+            remapped.append(x)
+
+        self.m[k0:] = m_env_new
+        self.dm = np.diff(self.m)
+        self.profile_version += 1
+
+        # zone indices that persist between static calls
+        for name in 'k1', 'k_shell_top':
+            k = getattr(self, name, None)
+            if k:
+                setattr(self, name, int(np.argmin(np.abs(self.m - m_old[k]))))
+
+    def reset(self):
+        '''
+        forget the composition, core mass and mesh of the current model so that static can build a model with
+        different parameters on this instance; static otherwise sets these only once. the eos and model
+        atmosphere are kept, and the current p, t profile is kept as the first guess for the next static call.
+        the helium rain state (starting profiles, ymax nodes, k1 and the p, t of the last y update) goes too, so
+        that the next model's rain calculation is the same as on a fresh instance.
+        '''
+        if hasattr(self, 'kcore'):
+            self.warm_start = self.get_warm_start()
+        for attr in 'mtot', 'y1', 'y2', 'z1', 'z2', 'mcore', 'kcore', 'teq', 'isothermal_above_teq', \
+            'p_start', 't_start', 'y_start', 'ymax_nodes', 'k1', 'rain_pt_ref':
+            if hasattr(self, attr):
+                delattr(self, attr)
+
+    def get_warm_start(self):
+        '''the current p, t profile and mesh, in the form taken by apply_warm_start.'''
+        return {
+            'm':np.copy(self.m),
+            'mtot':self.mtot,
+            'mcore':self.mcore * const.mearth,
+            'kcore':self.kcore,
+            'logp':np.copy(self.logp),
+            'logt':np.copy(self.logt)
+            }
+
+    def apply_warm_start(self, guess):
+        '''
+        set p, t from a profile saved by get_warm_start, remapped onto the current mesh: core and envelope
+        separately in fractional core mass and fractional envelope mass if both models have a core, otherwise
+        in fractional total mass.
+        '''
+        if self.kcore > 0 and guess['kcore'] > 0:
+            mcore = self.mcore * const.mearth
+            q = np.concatenate((self.m[:self.kcore] / mcore, 1. + (self.m[self.kcore:] - mcore) / (self.mtot - mcore)))
+            k = guess['kcore']
+            q_guess = np.concatenate((guess['m'][:k] / guess['mcore'], 1. + (guess['m'][k:] - guess['mcore']) / (guess['mtot'] - guess['mcore'])))
+        else:
+            q = self.m / self.mtot
+            q_guess = guess['m'] / guess['mtot']
+        self.logp[:] = np.interp(q, q_guess, guess['logp'])
+        self.logt[:] = np.interp(q, q_guess, guess['logt'])
+        self.p[:] = 10 ** self.logp
+        self.t[:] = 10 ** self.logt
+
+    def initialize_atm(self):
+        '''set self.atm to the model atmosphere given by evol_params['atm_option'].'''
+        if self.evol_params['atm_option'] == 'f11_tables':
+            import f11_atm; reload(f11_atm)
+            if 'force_teq' in list(self.evol_params) and self.evol_params['force_teq']:
+                self.atm = f11_atm.atm(self.evol_params['path_to_data'], self.evol_params['atm_planet'],
+                    force_teq=self.evol_params['force_teq'])
+            else:
+                self.atm = f11_atm.atm(self.evol_params['path_to_data'], self.evol_params['atm_planet'])
+        elif self.evol_params['atm_option'] == 'f11_fit':
+            import f11_atm_fit; reload(f11_atm_fit)
+            self.atm = f11_atm_fit.atm(self.evol_params['atm_planet'])
+        elif self.evol_params['atm_option'] == 'thorngren':
+            import thorngren_atm; reload(thorngren_atm)
+            self.atm = thorngren_atm.atm()
+        elif self.evol_params['atm_option'] == 'fortney':
+            import fortney_atm; reload(fortney_atm)
+            self.atm = fortney_atm.atm()
+        else:
+            raise ValueError('atm option {} not recognized.'.format(self.evol_params['atm_option']))
+
+    def get_rho_z(self, logp, logt, out=None):
         '''helper function to get rho of just the z component. different from self.z_eos.get_logrho because
-        this does the switching to aneos water at low T if using reos water as the z eos.'''
+        this does the switching to aneos water at low T if using reos water as the z eos.
+        result is written to out if given.'''
 
         assert self.evol_params['z_eos_option'], 'cannot calculate rho_z with no z eos specified.'
 
@@ -207,34 +379,42 @@ class evol:
         if hasattr(self, 'z_eos_low_t'):
             # extend down to T < 1000 K using different low-t z eos.
             # for this, mask to find the low-T part.
-            logp_high_t = logp[logt >= 3.]
-            logt_high_t = logt[logt >= 3.]
+            high_t = logt >= 3.
+            logp_high_t = logp[high_t]
+            logt_high_t = logt[high_t]
 
-            logp_low_t = logp[logt < 3.]
-            logt_low_t = logt[logt < 3.]
+            logp_low_t = logp[~high_t]
+            logt_low_t = logt[~high_t]
 
+            # assign by mask rather than concatenating, so that points needn't be sorted in t
+            rho_z = np.empty_like(logp) if out is None else out
             try:
-                rho_z_low_t = 10 ** self.z_eos_low_t.get_logrho(logp_low_t, logt_low_t)
+                rho_z[~high_t] = self.z_eos_low_t.get_logrho(logp_low_t, logt_low_t)
             except:
                 raise EOSError('off low-t eos tables.')
 
             try:
-                rho_z_high_t = 10 ** self.z_eos.get_logrho(logp_high_t, logt_high_t)
+                rho_z[high_t] = self.z_eos.get_logrho(logp_high_t, logt_high_t)
             except:
                 raise EOSError('off high-t eos tables.')
 
-            rho_z = np.concatenate((rho_z_high_t, rho_z_low_t))
-
         else:
             try:
-                rho_z = 10 ** self.z_eos.get_logrho(logp, logt)
+                logrho_z = self.z_eos.get_logrho(logp, logt)
             except ValueError:
                 raise EOSError('off z_eos tables.')
+            if out is None:
+                return 10 ** logrho_z
+            rho_z = out
+            rho_z[:] = logrho_z
 
-        return rho_z
+        return np.power(10., rho_z, out=rho_z)
 
-    def get_rho_xyz(self, logp, logt, y, z):
+    def get_rho_xyz(self, logp, logt, y, z, out=None):
         # only meant to be called when Z is non-zero and Y is not 0 or 1.
+        # result is written to out if given; self.rho_hhe and self.rho_z are scratch arrays from self.work.
+        # the end-member densities self.rho_h, self.rho_he and self.rho_z are kept, along with the rest of the
+        # h-he eos result, in self.rho_components; see get_rho_components and mix_rho.
         if np.any(np.isnan(logp)):
             raise EOSError('have %i nans in logp' % len(logp[np.isnan(logp)]))
         elif np.any(np.isnan(logt)):
@@ -247,15 +427,47 @@ class evol:
             raise UnphysicalParameterError('one or more bad z')
         elif np.any(z > 1.):
             raise UnphysicalParameterError('one or more bad z')
-        try:
-            self.rho_hhe = 10 ** self.hhe_eos.get_logrho(logp, logt, y)
-        except ValueError as e:
-            if 'out of bounds' in e.args[0]:
-                raise EOSError('out of bounds in hhe_eos')
-            else:
-                raise
-        self.rho_z = self.get_rho_z(logp, logt)
-        rhoinv = (1. - z) / self.rho_hhe + z / self.rho_z
+        n = len(logp)
+        hhe_res = self.get_hhe_for_density(logp, logt, y)
+        self.rho_hhe = self.work.get('rho_hhe', n)
+        np.power(10., hhe_res['logrho'], out=self.rho_hhe)
+        self.rho_h = hhe_res.get('rho_h')
+        self.rho_he = hhe_res.get('rho_he')
+        self.rho_z = self.get_rho_z(logp, logt, out=self.work.get('rho_z', n))
+        self.rho_components = {'logp':self.work.get('rho_components_logp', n), 'logt':self.work.get('rho_components_logt', n),
+                               'y':self.work.get('rho_components_y', n), 'hhe':hhe_res, 'rho_z':self.rho_z}
+        self.rho_components['logp'][:] = logp
+        self.rho_components['logt'][:] = logt
+        self.rho_components['y'][:] = y
+        # rhoinv = (1 - z) / rho_hhe + z / rho_z, without temporaries
+        x = self.work.get('rho_xyz_x', n)
+        np.subtract(1., z, out=x)
+        np.divide(x, self.rho_hhe, out=x)
+        rhoinv = np.empty(n) if out is None else out
+        np.divide(z, self.rho_z, out=rhoinv)
+        np.add(rhoinv, x, out=rhoinv)
+        return np.reciprocal(rhoinv, out=rhoinv)
+
+    def get_rho_components(self, logp, logt, y):
+        '''
+        the h-he eos result and rho_z from the last call to get_rho_xyz, if it was made at exactly these logp, logt
+        and y (as for the envelope of a model that hasn't changed since its last density update); else None.
+        '''
+        comp = getattr(self, 'rho_components', None)
+        if comp is None or len(comp['logp']) != len(logp):
+            return None
+        if np.array_equal(comp['logp'], logp) and np.array_equal(comp['logt'], logt) and np.array_equal(comp['y'], y):
+            return comp
+        return None
+
+    def mix_rho(self, rho_h, rho_he, y, rho_z=None, z=None):
+        '''
+        density of a mixture from end-member densities at the same p, t, by the additive volume rule:
+        1 / rho = (1 - z) * ((1 - y) / rho_h + y / rho_he) + z / rho_z. without rho_z and z, pure h-he.
+        '''
+        rhoinv = (1. - y) / rho_h + y / rho_he
+        if z is not None:
+            rhoinv = (1. - z) * rhoinv + z / rho_z
         return rhoinv ** -1
 
     def zfunc(self, rf):
@@ -265,11 +477,16 @@ class evol:
         term2 = (1. - self.z2) * exp2 / (1. + exp2)
         return self.z1 + term1 + term2
 
-    def static(self, params):
+    def static(self, params, outputs='full'):
 
         '''
         build a single hydrostatic model.
+        with outputs='scalars', skip everything not needed for the scalars rtot, t10, tint, teff, lint, ysurf,
+        mz, bulk_z and nmoi (entropy, derivatives, profile snapshots), e.g. for likelihood evaluations.
+        params may include radius_rtol and y1_rtol to override evol_params for this model only; looser
+        tolerances are often fine when the result only has to beat the noise in a likelihood.
         '''
+        assert outputs in ('full', 'scalars'), "outputs must be one of 'full', 'scalars'"
 
         if not 'phase_t_offset' in params.keys():
             params['phase_t_offset'] = 0.
@@ -298,11 +515,29 @@ class evol:
         else:
             raise ValueError('must specify one and only one of t1 or t10.')
 
+        # models continuing from this instance with helium rain are always solved; see static_cache.usable
+        cache_key = None
+        if hasattr(self, 'model_cache') and self.model_cache.usable(self):
+            cache_key = self.model_cache.get_key(self, params, outputs)
+            if self.model_cache.load(cache_key, self):
+                # the rest of what static would have set up
+                if hasattr(self, 'warm_start'):
+                    del(self.warm_start)
+                if 'isothermal_above_teq' in list(params) and params['isothermal_above_teq']:
+                    self.isothermal_above_teq = True
+                if not hasattr(self, 'atm'):
+                    self.initialize_atm()
+                return
+
+        radius_rtol = params['radius_rtol'] if 'radius_rtol' in params else self.evol_params['radius_rtol']
+        y1_rtol = params['y1_rtol'] if 'y1_rtol' in params else self.evol_params['y1_rtol']
+
         self.iters = 0
+        self.force_full_eos = set() # see self.needs_full_eos_pass
+        self.eos_stale = False
 
         if not hasattr(self, 'mtot'):
             '''initialize model: mesh, atm, etc'''
-            assert not hasattr(self, 'atm')
             assert not hasattr(self, 'y1')
             assert not hasattr(self, 'y2')
             assert not hasattr(self, 'z1')
@@ -326,24 +561,8 @@ class evol:
             # initialize model atmospheres
             if 'teq' in params.keys():
                 self.teq = params['teq']
-            if self.evol_params['atm_option'] == 'f11_tables':
-                import f11_atm; reload(f11_atm)
-                if 'force_teq' in list(self.evol_params) and self.evol_params['force_teq']:
-                    self.atm = f11_atm.atm(self.evol_params['path_to_data'], self.evol_params['atm_planet'],
-                        force_teq=self.evol_params['force_teq'])
-                else:
-                    self.atm = f11_atm.atm(self.evol_params['path_to_data'], self.evol_params['atm_planet'])
-            elif self.evol_params['atm_option'] == 'f11_fit':
-                import f11_atm_fit; reload(f11_atm_fit)
-                self.atm = f11_atm_fit.atm(self.evol_params['atm_planet'])
-            elif self.evol_params['atm_option'] == 'thorngren':
-                import thorngren_atm; reload(thorngren_atm)
-                self.atm = thorngren_atm.atm()
-            elif self.evol_params['atm_option'] == 'fortney':
-                import fortney_atm; reload(fortney_atm)
-                self.atm = fortney_atm.atm()
-            else:
-                raise ValueError('atm option {} not recognized.'.format(self.evol_params['atm_option']))
+            if not hasattr(self, 'atm'): # kept through self.reset
+                self.initialize_atm()
 
             if 'isothermal_above_teq' in list(params) and params['isothermal_above_teq']:
                 self.isothermal_above_teq = True
@@ -365,10 +584,6 @@ class evol:
             else:
                 self.y2 = None
 
-            self.mz_env = None
-            self.mz = None
-            self.bulk_z = None
-
             # initialize lagrangian mesh.
             if not 'mcore' in params.keys(): params['mcore'] = 0.
             mcore = params['mcore']
@@ -490,9 +705,16 @@ class evol:
             self.k_shell_top = None # until a shell is found by equilibrium_y_profile
 
             self.grada = np.zeros_like(self.m)
-            # first guess, values chosen just so that densities will be calculable
-            self.p[:] = 1e12
-            self.t[:] = 1e4
+            if hasattr(self, 'warm_start'):
+                # first guess from a previous model; see self.reset
+                self.apply_warm_start(self.warm_start)
+                del(self.warm_start)
+            else:
+                # first guess, values chosen just so that densities will be calculable
+                self.p[:] = 1e12
+                self.t[:] = 1e4
+                self.logp[:] = 12.
+                self.logt[:] = 4.
 
             # get density everywhere based on primitive guesses
             self.set_core_density()
@@ -501,6 +723,7 @@ class evol:
         else:
             # self.y[:] = 0.
             # self.y[self.kcore:] = self.y1
+            # in either outputs mode, since equilibrium_y_profile starts from this y profile
             self.p_start = np.copy(self.p)
             self.t_start = np.copy(self.t)
             self.y_start = np.copy(self.y)
@@ -514,6 +737,7 @@ class evol:
         last_three_radii = 0, 0, 0
         for iteration in range(self.evol_params['max_iters_static']):
             self.iters += 1
+            self.eos_stale = False
             self.integrate_hydrostatic() # integrate momentum equation to get pressure
             self.locate_transition_pressure() # find point that should be discontinuous in y and z, if any
             # set y and z profile assuming three-layer homogeneous. if doing helium rain (self.phase is set),
@@ -540,8 +764,8 @@ class evol:
             # hydrostatic model is judged to be converged when the radius has changed by a relative amount less than
             # radius_rtol over both of the last two iterations.
             # if np.all(np.abs((last_three_radii / self.r[-1] - 1.)) < self.evol_params['radius_rtol']):
-            if np.all(np.abs(np.mean((last_three_radii / self.r[-1] - 1.))) < self.evol_params['radius_rtol']):
-                if iteration >= self.evol_params['min_iters_static']:
+            if np.all(np.abs(np.mean((last_three_radii / self.r[-1] - 1.))) < radius_rtol):
+                if iteration >= self.evol_params['min_iters_static'] and not self.needs_full_eos_pass():
                     last_three_radii = last_three_radii[1], last_three_radii[2], self.r[-1]
                     break
             # else:
@@ -554,9 +778,10 @@ class evol:
         else:
             raise ConvergenceError('{} exceeded max iterations {}'.format(iteration, self.evol_params['max_iters_static']))
 
-        self.t_before_he = np.copy(self.t)
-        self.y_before_he = np.copy(self.y)
-        self.p_before_he = np.copy(self.p)
+        if outputs == 'full':
+            self.t_before_he = np.copy(self.t)
+            self.y_before_he = np.copy(self.y)
+            self.p_before_he = np.copy(self.p)
 
         last_three_y1 = 0, 0, 0
         # repeat hydro iterations, now including the phase diagram calculation (if helium rain)
@@ -569,8 +794,10 @@ class evol:
             #     self.set_envelope_density()
             #     self.integrate_continuity()
             self.k1 = 0
+            self.force_full_eos = set()
             for iteration in range(self.evol_params['max_iters_static']):
                 self.iters_rain = iteration + 1
+                self.eos_stale = False
 
                 self.integrate_hydrostatic()
                 self.locate_transition_pressure() # find point that should be discontinuous in y and z, if any
@@ -578,7 +805,7 @@ class evol:
                 # self.integrate_temperature()
                 self.k_gradient_bot = None
 
-                if iteration % 2 == 0:
+                if self.rain_update_due(iteration):
                     self.y = self.equilibrium_y_profile(params['phase_t_offset'],
                             verbosity=params['rainout_verbosity'],
                             allow_y_inversions=params['allow_y_inversions'])
@@ -624,7 +851,6 @@ class evol:
                 self.set_core_density() # z eos call, fast (not many zones)
                 self.set_envelope_density() # full-on eos call; could try skipping and using rho from last eos call (integrate_temperature)
                 self.integrate_continuity() # just an integral, super fast
-                self.set_derivatives_etc()
                 if 'debug_iterations' in params.keys() and params['debug_iterations']:
                     if type(params['debug_iterations']) is str: # focus one step
                         step = int(params['debug_iterations'].split()[1])
@@ -640,11 +866,12 @@ class evol:
                         qtys = self.iters, self.iters_rain, self.r[-1], self.y[-1], self.k1, self.p[self.k1]*1e-12, et*1e3, \
                             np.abs(np.mean((last_three_radii / self.r[-1] - 1.))), self.evol_params['radius_rtol'], np.abs(np.mean((last_three_y1 / self.y[-1] - 1.))), self.evol_params['y1_rtol']
                         print('iter={:>2n} he_iter={:>2n} rtot={:.5e} y1={:>.5f} k1={} p[k1]={:.5f}, et={:5.2f} dr={:10.5e} (rtol={:10.5e}) dy1={:10.5e} (rtol={:10.5e})'.format(*qtys))
-                if np.all(np.abs(np.mean((last_three_radii / self.r[-1] - 1.))) < self.evol_params['radius_rtol']):
-                    if np.all(np.abs(np.mean((last_three_y1 / self.y[-1] - 1.))) < self.evol_params['y1_rtol']) or self.y[-1] < 1e-3:
+                if np.all(np.abs(np.mean((last_three_radii / self.r[-1] - 1.))) < radius_rtol):
+                    if np.all(np.abs(np.mean((last_three_y1 / self.y[-1] - 1.))) < y1_rtol) or self.y[-1] < 1e-3:
                         # y[-1] < 1e-3 is to allow y1 very close to zero to go ahead. even if fractional change is large, absolute
                         # values are so small that we don't care for this model.
-                        break
+                        if not self.needs_full_eos_pass():
+                            break
 
                 if not np.isfinite(self.r[-1]):
                     # with open('output/found_infinite_radius.dat', 'w') as f:
@@ -669,11 +896,15 @@ class evol:
         # finally, calculate lots of auxiliary quantities of interest
         self.rtot = self.r[-1]
         self.set_atm() # make sure t10 is set; use (t10, g) to get (tint, teff) from model atmosphere
-        self.set_entropy() # set entropy profile (necessary for an evolutionary calculation)
-        self.set_derivatives_etc() # calculate thermo derivatives, seismology quantities, g, etc.
+        if outputs == 'full':
+            self.set_entropy() # set entropy profile (necessary for an evolutionary calculation)
+        # thermo derivatives, seismology quantities, g, mz, etc. are computed if and when they're accessed; see derived_groups
         if hasattr(self, 't10M'):
             del(self.t10M)
 
+        if cache_key is not None:
+            self.model_cache.save(cache_key, self, profiles=outputs == 'full')
+
         return
 
     # these implement the analytic p(rho) relations for "rock" and "ice" mixtures from Hubbard & Marley 1989
@@ -684,18 +915,51 @@ class evol:
         return rho ** 3.719 * np.exp(-2.756 - 0.271 * rho + 0.00701 * rho ** 2.) # Mbar
 
     def get_rhoz_hm89_rock(self, p, rho_now):
-        from scipy.optimize import root
-        zero_me = lambda rho: self.p_of_rho_hm89_rock(rho) - p * 1e-12
-        res = root(zero_me, rho_now)
-        assert res['success'], 'failed root find in get_rhoz_hm89_rock'
-        return res.x
+        rho, success = self.invert_hm89(p, rho_now, 4.406, -6.579, -0.176, 0.00202)
+        assert success, 'failed root find in get_rhoz_hm89_rock'
+        return rho
 
     def get_rhoz_hm89_ice(self, p, rho_now):
-        from scipy.optimize import root
-        zero_me = lambda rho: self.p_of_rho_hm89_ice(rho) - p * 1e-12
-        res = root(zero_me, rho_now)
-        assert res['success'], 'failed root find in get_rhoz_hm89_ice'
-        return res.x
+        rho, success = self.invert_hm89(p, rho_now, 3.719, -2.756, -0.271, 0.00701)
+        assert success, 'failed root find in get_rhoz_hm89_ice'
+        return rho
+
+    def invert_hm89(self, p, rho_guess, a, b, c, d, rtol=1e-12, max_iters=100):
+        '''
+        solve p(rho) = rho ** a * exp(b + c * rho + d * rho ** 2) (Mbar) for rho, zone by zone.
+        the zones are independent, so rather than handing the whole core to a multidimensional root find,
+        do a safeguarded newton iteration on ln rho for all zones at once. ln p is monotone increasing in
+        ln rho for both the rock and ice coefficients, so each zone's root is bracketed between rho = 1e-3
+        and 1e3, and any newton step leaving the current bracket is replaced by bisection.
+        p is in dyne cm^-2 as elsewhere; returns (rho, success).
+        '''
+        lnp = np.log(np.atleast_1d(p) * 1e-12)
+        lnp_of_lnrho = lambda x: a * x + b + c * np.exp(x) + d * np.exp(2. * x)
+        dlnp_dlnrho = lambda x: a + c * np.exp(x) + 2. * d * np.exp(2. * x)
+
+        lo = np.full(lnp.shape, np.log(1e-3))
+        hi = np.full(lnp.shape, np.log(1e3))
+        if np.any(lnp_of_lnrho(lo) > lnp) or np.any(lnp_of_lnrho(hi) < lnp):
+            return np.nan * lnp, False
+        x = np.log(np.clip(np.broadcast_to(rho_guess, lnp.shape), 1e-3, 1e3))
+        for i in range(max_iters):
+            f = lnp_of_lnrho(x) - lnp
+            lo = np.where(f < 0, x, lo)
+            hi = np.where(f > 0, x, hi)
+            x_new = x - f / dlnp_dlnrho(x)
+            outside = (x_new <= lo) | (x_new >= hi)
+            x_new[outside] = 0.5 * (lo[outside] + hi[outside])
+            done = np.all(np.abs(x_new - x) < rtol)
+            x = x_new
+            if done:
+                break
+        else:
+            return np.exp(x), False
+
+        rho = np.exp(x)
+        if np.ndim(p) == 0:
+            return rho[0], True
+        return rho, True
 
     def equilibrium_y_profile(self, phase_t_offset, verbosity=0, show_timing=False, allow_y_inversions=False):
         '''uses the existing p-t profile to find the thermodynamic equilibrium y profile, which
@@ -714,45 +978,39 @@ class evol:
         # these combine to
         #   Y = (1 - Z) / (1 + (1 - Yp) / Yp).
 
-        from schoettler import get_xp, get_y # get_xp(z, y); get_y(z, xp)
+        from lorenzen import get_xp, get_y # get_xp(z, y); get_y(z, xp)
 
         if verbosity > 0: print('iters {}, iters rain {:2n}, rtot {:.5e}, y1 {:.4f} '.format(self.iters, self.iters_rain, self.r[-1], self.y[-1]))
 
         ymax = {}
-        for pval in self.phase.pvals:
-            # start by checking just nodes (p==0.5, 1, 1.5, 2, 4, 10...).
-            # if not allow_y_inversions, then the minimum ymax reached by the planet P-T profile
-            # on any of the known phase curves will establish the envelope abundance.
-            # that will probably be 2 Mbar, or 4 Mbar if model goes to low y1 (high phase_t_offset).
-
-            # k = np.where(p < pval)[0][0]-1 # e.g., 2.001 Mbar
-            k = np.argsort(abs(p - pval))[0] # e.g., 2.001 Mbar or 1.998 Mbar
-            if k < self.kcore: continue
-            try:
-                # interpolate to get t value corresponding to pval, e.g., 2.0000000000 Mbar
-                ti = splev(pval, splrep(p[k+3:k-3:-1], t[k+3:k-3:-1], k=3))
-            except:
-                # print('failed to get model {} Mbar temperature'.format(pval))
-                # print(k, self.kcore)
-                # print(p[k+3:k-3:-1])
-                # print(t[k+3:k-3:-1])
-                # raise
-                continue
-
-            xlo = splev(ti - phase_t_offset*1e-3, self.phase.tck_xlo[pval])
-            ylo = get_y(self.z[k], xlo)
-            if ylo < 0:
-                ylo = 1e-6
-            elif ylo > 1:
-                # print('got bad ymax {} for {} Mbar'.format(ylo, pval))
-                continue
-            ymax[pval] = {'k':k, 'y':ylo}
+        # start by checking just nodes (p==0.5, 1, 1.5, 2, 4, 10...).
+        # if not allow_y_inversions, then the minimum ymax reached by the planet P-T profile
+        # on any of the known phase curves will establish the envelope abundance.
+        # that will probably be 2 Mbar, or 4 Mbar if model goes to low y1 (high phase_t_offset).
+        # only nodes between the core boundary and the surface; model t there from the neighbouring zones.
+        pvals = np.array(self.phase.pvals, dtype=float)
+        pvals = pvals[(pvals <= p[self.kcore]) & (pvals > p[-1])]
+        # nearest zone to each node, e.g., 2.001 Mbar or 1.998 Mbar
+        j = local_interp.get_bracket(pvals, p[::-1])
+        j += pvals - p[::-1][j] > p[::-1][j + 1] - pvals
+        ks = self.nz - 1 - j
+        ts = local_interp.monotone_cubic(pvals, p[::-1], t[::-1])
+        nodes = [(pval, k, ti) for pval, k, ti in zip(pvals, ks, ts) if k >= self.kcore]
+
+        if nodes:
+            pvals, ks, ts = [np.array(column) for column in zip(*nodes)]
+            for pval, k, ylo in zip(pvals, ks, self.get_phase_ymax(pvals, ts - phase_t_offset*1e-3, self.z[ks])):
+                if ylo < 0:
+                    ylo = 1e-6
+                elif ylo > 1:
+                    # print('got bad ymax {} for {} Mbar'.format(ylo, pval))
+                    continue
+                ymax[pval] = {'k':k, 'y':ylo}
 
         if 10 not in list(ymax):
             if not hasattr(self, 't10M'):
-                self.t10M = splev(10, splrep(p[self.kcore:][::-1], t[self.kcore:][::-1], k=1))
-            xlo = splev(self.t10M - phase_t_offset*1e-3, self.phase.tck_xlo[10])
-            ylo = get_y(self.z[-1], xlo)
+                self.t10M = local_interp.linear(10., p[self.kcore:][::-1], t[self.kcore:][::-1])
+            ylo = self.get_phase_ymax(np.array([10.]), np.array([self.t10M - phase_t_offset*1e-3]), np.array([self.z[-1]]))[0]
             if ylo < 0 or ylo > 1:
                 pass
             else:
@@ -773,7 +1031,7 @@ class evol:
 
         if hasattr(self, 'p_start'):
             # get this static model's starting y vector, interpolated onto current pressures
-            ystart = splev(self.p, splrep(self.p_start[::-1], self.y_start[::-1], k=1))
+            ystart = local_interp.linear(self.p, self.p_start[::-1], self.y_start[::-1])
         else:
             ystart = self.y
 
@@ -786,8 +1044,9 @@ class evol:
 
         if verbosity > 1:
             print(ps, ys)
-        fymax = lambda p: splev(p, splrep(ps, ys, k=1), ext=0)
-        self.tck_ymax = splrep(ps, ys, k=1)
+        order = np.argsort(ps)
+        self.ymax_nodes = ps[order], ys[order]
+        fymax = lambda p: local_interp.linear(p, *self.ymax_nodes)
 
         if allow_y_inversions:
             # gradient loop starts at first zone with y > ymax as given by fymax (linear p-y).
@@ -837,64 +1096,72 @@ class evol:
 
         # self.k_shell_top = None # leave alone; may exist already even if the current iteration doesn't enter shell loop
         yout = np.zeros_like(self.y)
-        for k in np.arange(k1, self.kcore, -1): # inward from first point below phase curve
-            t1 = time.time()
-            if k == k1:
-                yout[k] = fymax(p[k])
-                if allow_y_inversions: # not necessarily hugging one of the phase curves; set simply
-                    yout[k:] = yout[k]
-                else:
-                    # abundance should be hugging phase curve (usually 2 Mbar). since p[k] possibly
-                    # much larger than pval of relevant phase curve, yout[k] may change discontinuously
-                    # in a way that the whole envelope shouldn't.
-                    # thus, set envelope abundance by evaluating ymax for p==pval exactly.
-                    pval = -1
-                    for pval in sorted(list(ymax))[::-1]: # high to low
-                        if p[k-1] > pval:
-                            break
-                    # print('k1', 'yout', 'pval', 'p[k-2:k+2]', k1, yout[k], pval, p[k-2:k+2])
-                    assert pval > 0
-                    assert (p[k] > pval and p[k+1] < pval) or (p[k-1] > pval and p[k] < pval)
-                    yout[k] = fymax(pval) # EXPERIMENTING 11/11/2019
-                    # envelope will have identical y_xy to zone k=k1, which means it generally has
-                    # a different y value because z may be discontinuous at k=k1.
-                    # y / yp = 1 - z
-                    yp = yout[k] / (1. - self.z[k]) # and yout[k] = fymax(p[k]) as above
-                    yenv = yp * (1. - self.z[k+1]) # assuming all zones outside have z=self.z1=self.z[k+1]
-                    yout[k+1:] = yenv
-                    # yout[k+1:] = yout[k]
-                    # print('p[k]={}, fymax(p[k])={}, fymax({:n})={}'.format(p[k], fymax(p[k]), pval, fymax(pval)))
-
-                    # print('noinv: fymax(pval)={}, fymax(p[k+1])={}, fymax(p[k])={}'.format(fymax(pval), fymax(p[k+1]), fymax(p[k])))
-                    # print('noinv: p[k+1]={} < pval={} < p[k]={}'.format(p[k+1], pval, p[k]))
-                    # assert False
+        if k1 > self.kcore:
+            k = k1
+            yout[k] = fymax(p[k])
+            if allow_y_inversions: # not necessarily hugging one of the phase curves; set simply
+                yout[k:] = yout[k]
             else:
-                if fymax(p[k]) < yout[k]:
-                    yout[k] = fymax(p[k])
-                else:
-                    break
-
-            # difference between initial he mass and current proposed he mass above and including this zone
-            # must be deposited into the deeper interior.
-            he_mass_missing_above = self.mhe - np.dot(yout[k:], self.dm[k-1:])
-            enclosed_envelope_mass = np.sum(self.dm[self.kcore:k-1]) # was previously :k
-            if not enclosed_envelope_mass > 0: # at core boundary
+                # abundance should be hugging phase curve (usually 2 Mbar). since p[k] possibly
+                # much larger than pval of relevant phase curve, yout[k] may change discontinuously
+                # in a way that the whole envelope shouldn't.
+                # thus, set envelope abundance by evaluating ymax for p==pval exactly.
+                pval = -1
+                for pval in sorted(list(ymax))[::-1]: # high to low
+                    if p[k-1] > pval:
+                        break
+                assert pval > 0
+                assert (p[k] > pval and p[k+1] < pval) or (p[k-1] > pval and p[k] < pval)
+                yout[k] = fymax(pval) # EXPERIMENTING 11/11/2019
+                # envelope will have identical y_xy to zone k=k1, which means it generally has
+                # a different y value because z may be discontinuous at k=k1.
+                # y / yp = 1 - z
+                yp = yout[k] / (1. - self.z[k]) # and yout[k] = fymax(p[k]) as above
+                yenv = yp * (1. - self.z[k+1]) # assuming all zones outside have z=self.z1=self.z[k+1]
+                yout[k+1:] = yenv
+
+            # moving inward from k1, each zone k takes y = ymax(p[k]) as long as that is less than the y of the
+            # homogeneous region beneath, which holds whatever helium is missing from zones k and above:
+            #   y_interior[k] = (mhe - sum(yout[k:] * dm[k-1:])) / sum(dm[kcore:k-1]).
+            # with ymax evaluated for every candidate zone at once, both sums are prefix sums, and the zone where
+            # the gradient stops is the first (moving inward) that fails one of the tests below.
+            ks = np.arange(k1, self.kcore, -1)
+            ygrad = np.empty(len(ks))
+            ygrad[0] = yout[k1]
+            ygrad[1:] = fymax(p[ks[1:]])
+            he_mass_above = np.dot(yout[k1:], self.dm[k1-1:]) + np.cumsum(np.append(0., ygrad[1:] * self.dm[ks[1:]-1]))
+            cumulative_mass = np.append(0., np.cumsum(self.dm))
+            enclosed_envelope_mass = cumulative_mass[ks-1] - cumulative_mass[self.kcore]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                y_interior = (self.mhe - he_mass_above) / enclosed_envelope_mass
+            gradient_ends = np.zeros(len(ks), dtype=bool)
+            gradient_ends[1:] = ~(ygrad[1:] < y_interior[:-1]) # ymax no longer below the homogeneous region beneath
+            stop = gradient_ends | ~(enclosed_envelope_mass > 0) | (y_interior > 1) | (y_interior < 0)
+            i = np.argmax(stop) # at the latest kcore+1, where the enclosed envelope mass vanishes
+            k = ks[i]
+            yout[k+1:k1] = ygrad[1:i][::-1]
+
+            if verbosity > 2:
+                for j in range(i):
+                    print('demix  (i={:n} ir={:n} k={:n} p={:.4f} t={:.4f} yout={:.4f}  yint={:.4f})'.format(self.iters, self.iters_rain, ks[j], p[ks[j]], t[ks[j]], ygrad[j], y_interior[j]))
+
+            if gradient_ends[i]:
+                yout[self.kcore:k+1] = y_interior[i-1]
+            elif not enclosed_envelope_mass[i] > 0: # at core boundary
+                yout[k] = ygrad[i]
                 if verbosity > 1:
                     print('i={:n} ir={:n} rainout to core because gradient reaches core.'.format(self.iters, self.iters_rain))
-                    # print(yout)
                 rainout_to_core = True
                 yout[self.kcore:k] = 0.
                 # double-check that we have overall "missing" helium, to be made up for in
                 # outward shell iterations
                 assert np.dot(yout[self.kcore:], self.dm[self.kcore-1:]) < self.mhe
                 kbot = k
-                break
-            y_interior = he_mass_missing_above / enclosed_envelope_mass
-            # if verbosity > 1: print('grdient(i={:n} ir={:n} k={:n} p={:.4f} t={:.4f} yout={:.4f}  yint={:.4f})'.format(self.iters, self.iters_rain, k, p[k], t[k], yout[k], y_interior))
-            if y_interior > 1:
+            elif y_interior[i] > 1:
                 # inner homogeneneous region of envelope would need Y > 1 to conserve global helium mass. thus undissolved droplets on core.
                 # set the rest of the envelope to Y = 0.95, then do outward iterations to find how large of a shell is needed to conserve
                 # the global helium mass.
+                yout[k] = ygrad[i]
                 if verbosity > 1: print('rainout to core because would need Y > 1 in inner homog region')
                 rainout_to_core = True
                 yout[self.kcore:k] = 0.
@@ -905,15 +1172,9 @@ class evol:
                 else:
                     assert np.dot(yout[self.kcore:], self.dm[self.kcore-1:]) < self.mhe
                 kbot = k
-                break
-            elif y_interior < 0:
-                print('NOPE   (i={:n} ir={:n} k={:n} p={:.4f} t={:.4f} yout={:.4f}  yint={:.4f})'.format(self.iters, self.iters_rain, k, p[k], t[k], yout[k], y_interior))
+            else: # y_interior[i] < 0
+                print('NOPE   (i={:n} ir={:n} k={:n} p={:.4f} t={:.4f} yout={:.4f}  yint={:.4f})'.format(self.iters, self.iters_rain, k, p[k], t[k], ygrad[i], y_interior[i]))
                 raise ValueError('got negative interior y')
-            else:
-                # all good; uniformly distribute all helium that has rained out from above into deeper interior
-                # if verbosity > 2: print('{:>5n} {:>8.4f} {:>10.6f} {:>10.6f}'.format(k, p[k], yout[k], y_interior))
-                if verbosity > 2: print('demix  (i={:n} ir={:n} k={:n} p={:.4f} t={:.4f} yout={:.4f}  yint={:.4f})'.format(self.iters, self.iters_rain, k, p[k], t[k], yout[k], y_interior))
-                yout[self.kcore:k] = y_interior
 
         # done with gradient zone; store k1 for next time around so that we can judge extent of homogeneous envelope
         self.k1 = k1
@@ -924,91 +1185,86 @@ class evol:
         if rainout_to_core:
             # gradient extends down to kbot, below which the rest of the envelope is already set Y=0.95.
             # since proposed envelope mhe < initial mhe, must grow the He-rich shell to conserve total mass.
-            if verbosity > 2: print('%5s %5s %10s %10s %10s' % ('k', 'kcore', 'dm_k', 'mhe_tent', 'mhe'))
-            for k in np.arange(self.kcore, self.nz):
-            # for k in np.arange(kbot, self.nz):
-                # yout[k] = 0.95 # in the future, obtain value from ymax_rhs(p, t)
-
-                # gap = self.phase.miscibility_gap(p[k], 8.)
-                # since ymax is nearly independent of temperature there anyway, let's use a simple
-                # function for ymax(p).
-                yout[k] = get_y(self.z[k], self.phase.simple_xhi(p[k]))
-                # if type(gap) is str:
-                #     assert gap == 'stable'
-                #     if verbosity > 1: print('warmer than critical temperature at k={} p={:.4f} t-dt={:.1f}'.format(k, p[k], t[k] - phase_t_offset*1e-3))
-                #     yout[k] = -1
-                # elif type(gap) is tuple:
-                #     xplo, xphi = gap
-                #     yout[k] = get_y(self.z[k], xphi)
-
-                tentative_total_he_mass = np.dot(yout[self.kcore:-1], self.dm[self.kcore:])
-                if verbosity > 2: print('%5i %5i %10.4e %10.4e %10.4e' % (k, self.kcore, self.dm[k-1], tentative_total_he_mass, self.mhe))
-                if tentative_total_he_mass >= self.mhe:
-                    # if verbosity > 1: print('tentative he mass, initial total he mass', tentative_total_he_mass, self.mhe)
-
-                    if 'adjust_shell_top_mass' in list(self.static_params):
-                        if self.static_params['adjust_shell_top_mass']:
-                            # experimental: move this mass coordinate to satisfy global he conservation
-                            if 'adjust_shell_top_abundance' in list(self.static_params):
-                                assert not self.static_params['adjust_shell_top_abundance'] # user must choose one or the other
-                            delta = tentative_total_he_mass - self.mhe # > 0
-                            dm_in = self.dm[k] + delta / (yout[k+1] - yout[k])
-                            dm_out = (self.dm[k] + self.dm[k+1]) - dm_in
-                            # print('delta {:10e}'.format(tentative_total_he_mass-self.mhe))
-                            # print('{:10e} {:10e} {:10e} {:10e}'.format(self.dm[k], self.dm[k+1], self.dm[k]+self.dm[k+1], yout[k]*self.dm[k]+yout[k+1]*self.dm[k+1]))
-                            # print('{:10e} {:10e} {:10e} {:10e}'.format(dm_in, dm_out, dm_in+dm_out, yout[k]*dm_in+yout[k+1]*dm_out))
-                            # assert False
-                            self.dm[k] = dm_in
-                            self.dm[k+1] = dm_out
-                            self.m[k] = self.m[k-1] + self.dm[k]
-                            self.m[k+1] = self.m[k] + self.dm[k+1]
-
-                    if 'adjust_shell_top_abundance' in list(self.static_params):
-                        if self.static_params['adjust_shell_top_abundance']:
-                            # conserve He exactly by setting an intermediate abundance at shell top zone
-                            if 'adjust_shell_top_mass' in list(self.static_params):
-                                assert not self.static_params['adjust_shell_top_mass'] # user must choose one or the other
-
-                            ##### self.mhe = np.dot(self.y[:-1], self.dm) # initial total he mass
-                            mhe_missing = self.mhe - np.dot(yout[self.kcore:-1], self.dm[self.kcore:])
-                            yout[k] += mhe_missing / self.dm[k]
-                            if yout[k] > yout[k-1] and k > self.kcore:
-                                # recently, this happens because shell top coincides with z1-z2 transition.
-                                if k == self.ktrans:
-                                    raise UnphysicalParameterError('z jump coincides with shell top')
-                                else:
-                                    pass # print diagnostics and let it truly crash
-                                print('surprise in adjust shell top abundance. k={} kcore={} ktrans={}'.format(k, self.kcore, self.ktrans))
-                                self.rel_mhe_error = abs(self.mhe - np.dot(yout[self.kcore:-1], self.dm[self.kcore:])) / self.mhe
-                                print('z', self.z[k-2:k+3])
-                                print('yout', yout[k-2:k+3], self.rel_mhe_error)
-                                # "intermediate" zone came out with Y > Y of shell-top zone.
-                                # current zone is thus the new shell top; next zone out gets intermediate abundance.
-                                gap = self.phase.miscibility_gap(p[k], 8.)
-                                assert type(gap) is tuple
-                                xplo, xphi = gap
-                                mhe_k_1 = yout[k] * self.dm[k-1] # tentative helium mass in this zone
-                                yout[k] = get_y(self.z[k], xphi)
-                                mhe_k_2 = yout[k] * self.dm[k-1] # proposed helium mass in this zone at "shell" abundance (rhs phase)
-                                mhe_kp1 = yout[k+1] * self.dm[k] # helium mass in next zone out
-                                self.rel_mhe_error = abs(self.mhe - np.dot(yout[self.kcore:-1], self.dm[self.kcore:])) / self.mhe
-                                print('yout', yout[k-2:k+3], self.rel_mhe_error)
-                                yout[k+1] = (mhe_kp1 + mhe_k_1 - mhe_k_2) / self.dm[k]
-                                self.rel_mhe_error = abs(self.mhe - np.dot(yout[self.kcore:-1], self.dm[self.kcore:])) / self.mhe
-                                print('yout', yout[k-2:k+3], self.rel_mhe_error)
-
-                                tentative_total_he_mass = np.dot(yout[self.kcore:-1], self.dm[self.kcore:])
-                                self.rel_mhe_error = abs(self.mhe - tentative_total_he_mass) / self.mhe
-                                print(self.rel_mhe_error)
-                                assert False
-
-
-                    tentative_total_he_mass = np.dot(yout[self.kcore:-1], self.dm[self.kcore:])
-                    self.rel_mhe_error = abs(self.mhe - tentative_total_he_mass) / self.mhe
-                    # if verbosity > 1: print('satisfied he mass conservation to a relative precision of %f' % self.rel_mhe_error)
-
-                    self.k_shell_top = k
-                    break
+            # the shell grows outward from kcore, each zone taking the helium-rich phase's abundance, until the
+            # total helium mass sum(yout[kcore:-1] * dm[kcore:]) reaches mhe. since ymax is nearly independent of
+            # temperature there anyway, use a simple function for ymax(p), evaluated for every zone at once; the
+            # total for each possible shell top is then a prefix sum of the helium each zone gains.
+            yshell = get_y(self.z[self.kcore:], self.phase.simple_xhi(p[self.kcore:]))
+            gain = np.zeros_like(yshell) # the last zone isn't in the sum
+            gain[:-1] = (yshell[:-1] - yout[self.kcore:-1]) * self.dm[self.kcore:]
+            total_he_mass = np.dot(yout[self.kcore:-1], self.dm[self.kcore:]) + np.cumsum(gain)
+            if np.all(gain >= 0): # total_he_mass is sorted
+                i = np.searchsorted(total_he_mass, self.mhe)
+            elif np.any(total_he_mass >= self.mhe): # shell reaches out into gradient zones with more helium than the shell
+                i = np.argmax(total_he_mass >= self.mhe)
+            else:
+                i = len(yshell)
+            yout[self.kcore:self.kcore+i+1] = yshell[:i+1]
+
+            if verbosity > 2:
+                print('%5s %5s %10s %10s %10s' % ('k', 'kcore', 'dm_k', 'mhe_tent', 'mhe'))
+                for j in range(min(i + 1, len(yshell))):
+                    print('%5i %5i %10.4e %10.4e %10.4e' % (self.kcore + j, self.kcore, self.dm[self.kcore+j-1], total_he_mass[j], self.mhe))
+
+            if i < len(yshell):
+                k = self.kcore + i
+                tentative_total_he_mass = total_he_mass[i]
+
+                if 'adjust_shell_top_mass' in list(self.static_params):
+                    if self.static_params['adjust_shell_top_mass']:
+                        # experimental: move this mass coordinate to satisfy global he conservation
+                        if 'adjust_shell_top_abundance' in list(self.static_params):
+                            assert not self.static_params['adjust_shell_top_abundance'] # user must choose one or the other
+                        delta = tentative_total_he_mass - self.mhe # > 0
+                        dm_in = self.dm[k] + delta / (yout[k+1] - yout[k])
+                        dm_out = (self.dm[k] + self.dm[k+1]) - dm_in
+                        tentative_total_he_mass += yout[k] * (dm_in - self.dm[k]) + yout[k+1] * (dm_out - self.dm[k+1])
+                        self.dm[k] = dm_in
+                        self.dm[k+1] = dm_out
+                        self.m[k] = self.m[k-1] + self.dm[k]
+                        self.m[k+1] = self.m[k] + self.dm[k+1]
+
+                if 'adjust_shell_top_abundance' in list(self.static_params):
+                    if self.static_params['adjust_shell_top_abundance']:
+                        # conserve He exactly by setting an intermediate abundance at shell top zone
+                        if 'adjust_shell_top_mass' in list(self.static_params):
+                            assert not self.static_params['adjust_shell_top_mass'] # user must choose one or the other
+
+                        mhe_missing = self.mhe - tentative_total_he_mass
+                        yout[k] += mhe_missing / self.dm[k]
+                        tentative_total_he_mass += mhe_missing
+                        if yout[k] > yout[k-1] and k > self.kcore:
+                            # recently, this happens because shell top coincides with z1-z2 transition.
+                            if k == self.ktrans:
+                                raise UnphysicalParameterError('z jump coincides with shell top')
+                            else:
+                                pass # print diagnostics and let it truly crash
+                            print('surprise in adjust shell top abundance. k={} kcore={} ktrans={}'.format(k, self.kcore, self.ktrans))
+                            self.rel_mhe_error = abs(self.mhe - np.dot(yout[self.kcore:-1], self.dm[self.kcore:])) / self.mhe
+                            print('z', self.z[k-2:k+3])
+                            print('yout', yout[k-2:k+3], self.rel_mhe_error)
+                            # "intermediate" zone came out with Y > Y of shell-top zone.
+                            # current zone is thus the new shell top; next zone out gets intermediate abundance.
+                            gap = self.phase.miscibility_gap(p[k], 8.)
+                            assert type(gap) is tuple
+                            xplo, xphi = gap
+                            mhe_k_1 = yout[k] * self.dm[k-1] # tentative helium mass in this zone
+                            yout[k] = get_y(self.z[k], xphi)
+                            mhe_k_2 = yout[k] * self.dm[k-1] # proposed helium mass in this zone at "shell" abundance (rhs phase)
+                            mhe_kp1 = yout[k+1] * self.dm[k] # helium mass in next zone out
+                            self.rel_mhe_error = abs(self.mhe - np.dot(yout[self.kcore:-1], self.dm[self.kcore:])) / self.mhe
+                            print('yout', yout[k-2:k+3], self.rel_mhe_error)
+                            yout[k+1] = (mhe_kp1 + mhe_k_1 - mhe_k_2) / self.dm[k]
+                            self.rel_mhe_error = abs(self.mhe - np.dot(yout[self.kcore:-1], self.dm[self.kcore:])) / self.mhe
+                            print('yout', yout[k-2:k+3], self.rel_mhe_error)
+
+                            tentative_total_he_mass = np.dot(yout[self.kcore:-1], self.dm[self.kcore:])
+                            self.rel_mhe_error = abs(self.mhe - tentative_total_he_mass) / self.mhe
+                            print(self.rel_mhe_error)
+                            assert False
+
+                self.rel_mhe_error = abs(self.mhe - tentative_total_he_mass) / self.mhe
+                self.k_shell_top = k
 
         if rainout_to_core: assert self.k_shell_top
         # self.nz_gradient = len(np.where(np.diff(yout) < 0)[0])
@@ -1019,10 +1275,27 @@ class evol:
         if verbosity > 1:
             import pickle
             with open('he{:04n}.pkl'.format(self.iters_rain), 'wb') as f:
-                pickle.dump({'p':p, 't':t, 'y':self.y, 'yout':yout, 'tck_ymax':self.tck_ymax, 'k1':k1}, f)
+                pickle.dump({'p':p, 't':t, 'y':self.y, 'yout':yout, 'tck_ymax':splrep(*self.ymax_nodes, k=1), 'k1':k1}, f)
 
         return yout
 
+    def get_phase_ymax(self, p, t, z):
+        '''
+        maximum soluble y at arrays of p (Mbar), t (kK) and z, where each p is a node of the phase diagram.
+        uses the phase diagram's vectorized tables if it has them. above a node's critical temperature, and for
+        phase diagrams without tables, the node's x_lo spline is evaluated (extrapolated) instead.
+        '''
+        from lorenzen import get_y
+        if hasattr(self.phase, 'ymax'):
+            y = self.phase.ymax(p, t, z)
+            spline = ~(y < 1.)
+        else:
+            y = np.zeros_like(t)
+            spline = np.ones(len(t), dtype=bool)
+        for i in np.where(spline)[0]:
+            y[i] = get_y(z[i], splev(t[i], self.phase.tck_xlo[p[i]]))
+        return y
+
     def set_core_density(self):
         if self.kcore == 0:
             return
@@ -1031,30 +1304,158 @@ class evol:
             if self.static_params['core_prho_relation'] == 'hm89 rock':
                 self.rho[:self.kcore] = 8 # just initial guess for root find
                 self.rho[:self.kcore] = self.get_rhoz_hm89_rock(self.p[:self.kcore], self.rho[:self.kcore])
+                self.logrho[:self.kcore] = np.log10(self.rho[:self.kcore])
             elif self.static_params['core_prho_relation'] == 'hm89 ice':
                 self.rho[:self.kcore] = 8
                 self.rho[:self.kcore] = self.get_rhoz_hm89_ice(self.p[:self.kcore], self.rho[:self.kcore])
+                self.logrho[:self.kcore] = np.log10(self.rho[:self.kcore])
             else:
                 raise ValueError("core_prho_relation must be one of 'hm89 rock' or 'hm89 ice'.")
         else:
             assert self.evol_params['z_eos_option'], 'cannot calculate rho_z if no z_eos_option specified'
-            self.rho[:self.kcore] = 10 ** self.z_eos.get_logrho(np.log10(self.p[:self.kcore]), np.log10(self.t[:self.kcore]))
+            self.logrho[:self.kcore] = self.z_eos.get_logrho(self.logp[:self.kcore], self.logt[:self.kcore])
+            np.power(10., self.logrho[:self.kcore], out=self.rho[:self.kcore])
 
     def set_envelope_density(self, ignore_z=False):
-        if ignore_z or self.z[-1] == 0.: # XY envelope
-            self.rho[self.kcore:] = 10 ** self.hhe_eos.get_logrho(np.log10(self.p[self.kcore:]), np.log10(self.t[self.kcore:]), self.y[self.kcore:])
+        if self.evol_params['eos_dirty_tol']:
+            self.set_envelope_density_incremental(ignore_z)
+        elif ignore_z or self.z[-1] == 0.: # XY envelope
+            self.logrho[self.kcore:] = self.hhe_eos.get_logrho(self.logp[self.kcore:], self.logt[self.kcore:], self.y[self.kcore:])
+            np.power(10., self.logrho[self.kcore:], out=self.rho[self.kcore:])
         else: # XYZ envelope
-            self.rho[self.kcore:] = self.get_rho_xyz(np.log10(self.p[self.kcore:]), np.log10(self.t[self.kcore:]), self.y[self.kcore:], self.z[self.kcore:])
+            self.get_rho_xyz(self.logp[self.kcore:], self.logt[self.kcore:], self.y[self.kcore:], self.z[self.kcore:], out=self.rho[self.kcore:])
+            np.log10(self.rho[self.kcore:], out=self.logrho[self.kcore:])
         self.rho_check_nans()
 
+    def set_envelope_density_incremental(self, ignore_z=False):
+        '''
+        same as set_envelope_density, but only calls the eos in zones whose inputs moved by more than
+        evol_params['eos_dirty_tol'] since they were last evaluated. elsewhere the stored h-he density is
+        corrected to first order using the stored partials rhop, rhot and chiy, and the stored rho_z is reused.
+        '''
+        logp = self.logp[self.kcore:]
+        logt = self.logt[self.kcore:]
+        y = self.y[self.kcore:]
+        if np.any(y <= 0.) or np.any(y >= 1.):
+            raise UnphysicalParameterError('one or more bad y')
+        res = self.get_eos_incremental('hhe', self.get_hhe_for_density, ('logrho', 'rhop', 'rhot', 'chiy'), logp, logt, y)
+        logrho_hhe = res['logrho'] \
+            + res['rhop'] * (logp - res['logp']) \
+            + res['rhot'] * (logt - res['logt']) \
+            + res['chiy'] * np.log10(y / res['y'])
+        if ignore_z or self.z[-1] == 0.: # XY envelope
+            self.logrho[self.kcore:] = logrho_hhe
+            self.rho[self.kcore:] = 10 ** logrho_hhe
+        else: # XYZ envelope
+            z = self.z[self.kcore:]
+            if np.any(z < 0.) or np.any(z > 1.):
+                raise UnphysicalParameterError('one or more bad z')
+            rho_z = self.get_eos_incremental('z', lambda logp, logt, y: {'rho_z':self.get_rho_z(logp, logt)}, ('rho_z',), logp, logt)['rho_z']
+            self.rho[self.kcore:] = ((1. - z) / 10 ** logrho_hhe + z / rho_z) ** -1
+            self.logrho[self.kcore:] = np.log10(self.rho[self.kcore:])
+
+    def get_hhe_for_density(self, logp, logt, y):
+        try:
+            return self.hhe_eos.get(logp, logt, y)
+        except ValueError as e:
+            if 'out of bounds' in e.args[0]:
+                raise EOSError('out of bounds in hhe_eos')
+            else:
+                raise
+
+    def get_eos_incremental(self, label, eos_func, names, logp, logt, y=None):
+        '''
+        evaluate eos_func(logp, logt, y) only in the zones whose inputs differ by more than evol_params['eos_dirty_tol']
+        from those of their last evaluation (stored in self.eos_cache[label]), and return the cache: a dict holding,
+        for every zone, the quantities in names along with the inputs 'logp', 'logt', 'y' at which they were evaluated.
+        clean zones keep the inputs of their last evaluation, so that the error of reusing them never accumulates
+        beyond the tolerance. every zone is evaluated if the cache is missing or of the wrong length, or if
+        label is in self.force_full_eos, which it's then removed from.
+        '''
+        tol = self.evol_params['eos_dirty_tol']
+        if y is None:
+            y = np.zeros_like(logp)
+        cache = self.eos_cache.get(label)
+        if label in self.force_full_eos or cache is None or len(cache['logp']) != len(logp):
+            self.force_full_eos.discard(label)
+            dirty = np.ones(len(logp), dtype=bool)
+            cache = self.eos_cache[label] = {}
+            for name in ('logp', 'logt', 'y') + tuple(names):
+                cache[name] = np.zeros(len(logp))
+        else:
+            dirty = np.abs(logp - cache['logp']) > tol
+            dirty |= np.abs(logt - cache['logt']) > tol
+            dirty |= np.abs(y - cache['y']) > tol
+            dirty |= np.isnan(logp) | np.isnan(logt) # let the eos complain about these
+
+        if not np.all(dirty):
+            self.eos_stale = True
+        if np.any(dirty):
+            res = eos_func(logp[dirty], logt[dirty], y[dirty])
+            for name in names:
+                cache[name][dirty] = res[name]
+            cache['logp'][dirty] = logp[dirty]
+            cache['logt'][dirty] = logt[dirty]
+            cache['y'][dirty] = y[dirty]
+
+        return cache
+
+    def rain_update_due(self, iteration):
+        '''
+        whether rain iteration number iteration (from zero) should recompute the equilibrium y profile.
+        with evol_params['rain_pt_tol'] None, every other iteration does. otherwise the first iteration does, and
+        later ones only if log p or log t has changed by more than the tolerance in any zone of the demixing
+        region (core out to a few zones past the lowest-pressure phase curve, or to k1 if further out) since
+        the y profile was last computed; else the previous y profile is kept.
+        '''
+        tol = self.evol_params['rain_pt_tol']
+        if tol is None:
+            return iteration % 2 == 0
+        logp = np.log10(self.p)
+        logt = np.log10(self.t)
+        if iteration > 0 and hasattr(self, 'rain_pt_ref'):
+            outer = np.where(self.p * 1e-12 > min(self.phase.pvals))[0]
+            ktop = min(self.nz, max(outer[-1] + 4 if len(outer) else self.nz, self.k1 + 1))
+            ref_logp, ref_logt = self.rain_pt_ref
+            if np.all(np.abs(logp[self.kcore:ktop] - ref_logp[self.kcore:ktop]) <= tol) \
+                and np.all(np.abs(logt[self.kcore:ktop] - ref_logt[self.kcore:ktop]) <= tol):
+                return False
+        self.rain_pt_ref = logp, logt
+        return True
+
+    def needs_full_eos_pass(self):
+        '''
+        in incremental eos mode, a model is only accepted as converged once an iteration has evaluated the eos
+        in every zone. returns True (and forces the next evaluation of each cached eos to do so) if the last
+        iteration reused any zones.
+        '''
+        if not self.evol_params['eos_dirty_tol'] or not self.eos_stale:
+            return False
+        self.force_full_eos = set(self.eos_cache)
+        return True
+
     def integrate_continuity(self):
-        q = np.zeros_like(self.rho)
+        # r = (cumsum 3 dm / 4 / pi / rho) ** (1 / 3), evaluated in place
+        q = self.work.get('continuity_q', self.nz)
         q[0] = 0.
-        q[1:] = 3. * self.dm / 4 / np.pi / self.rho[1:]
-        self.r = np.cumsum(q) ** (1. / 3)
+        np.multiply(3., self.dm, out=q[1:])
+        q[1:] /= 4
+        q[1:] /= np.pi
+        q[1:] /= self.rho[1:]
+        np.cumsum(q, out=self.r)
+        np.power(self.r, 1. / 3, out=self.r)
+        self.profile_version += 1
 
     def integrate_hydrostatic(self):
-        dp = const.cgrav * self.m[1:] * self.dm / 4. / np.pi / self.r[1:] ** 4
+        # dp = G * m * dm / 4 / pi / r ** 4, evaluated in place
+        dp = self.work.get('hydrostatic_dp', self.nz - 1)
+        r4 = self.work.get('hydrostatic_r4', self.nz - 1)
+        np.multiply(const.cgrav, self.m[1:], out=dp)
+        dp *= self.dm
+        dp /= 4.
+        dp /= np.pi
+        np.power(self.r[1:], 4, out=r4)
+        dp /= r4
         if self.atm_which_t == 't1':
             psurf = 1e6
         elif self.atm_which_t == 't10':
@@ -1062,7 +1463,9 @@ class evol:
         else:
             raise ValueError('atm_which_t option %s not recognized.' % self.atm_which_t)
         self.p[-1] = psurf
-        self.p[:-1] = psurf + np.cumsum(dp[::-1])[::-1]
+        np.cumsum(dp[::-1], out=self.p[-2::-1]) # i.e., p[:-1] = cumsum(dp[::-1])[::-1]
+        self.p[:-1] += psurf
+        np.log10(self.p, out=self.logp)
 
         if np.any(np.isnan(self.p)):
             raise EOSError('%i nans in pressure after integrate hydrostatic on static iteration %i.' % (len(self.p[np.isnan(self.p)]), self.iters))
@@ -1086,13 +1489,13 @@ class evol:
         if 'switch_z_grada' in self.static_params and self.static_params['switch_z_grada']:
             # raise NotImplementedError('need to reimplement switch_z_grada in integrate_temperature.')
             assert self.static_params['model_type'] == 'three_layer', 'switch_z_grada assumes three-layer'
-            res_z = self.z_eos.get(np.log10(self.p[self.kcore:self.ktrans]), np.log10(self.t[self.kcore:self.ktrans]))
+            res_z = self.z_eos.get(self.logp[self.kcore:self.ktrans], self.logt[self.kcore:self.ktrans])
             self.grada[self.kcore:self.ktrans] = res_z['grada']
             self.chit[self.kcore:self.ktrans] = res_z['chit']
             self.chirho[self.kcore:self.ktrans] = res_z['chirho']
 
             try:
-                res_hhe = self.hhe_eos.get(np.log10(self.p[self.ktrans:]), np.log10(self.t[self.ktrans:]), self.y[self.ktrans:])
+                res_hhe = self.hhe_eos.get(self.logp[self.ktrans:], self.logt[self.ktrans:], self.y[self.ktrans:])
             except ValueError:
                 raise EOSError('failed in eos call. p[-1]={:g} t[-1]={:g}'.format(self.p[-1], self.t[-1]))
             self.grada[self.ktrans:] = res_hhe['grada']
@@ -1102,7 +1505,11 @@ class evol:
 
         else: # ignore Z for the sake of calculating grada, chit, chirho
             try:
-                res_hhe = self.hhe_eos.get(np.log10(self.p[self.kcore:]), np.log10(self.t[self.kcore:]), self.y[self.kcore:])
+                if self.evol_params['eos_dirty_tol']: # reuse grada etc. in zones whose p, t, y have barely moved
+                    res_hhe = self.get_eos_incremental('grada', self.hhe_eos.get, ('grada', 'chit', 'chirho', 'chiy'),
+                        self.logp[self.kcore:], self.logt[self.kcore:], self.y[self.kcore:])
+                else:
+                    res_hhe = self.hhe_eos.get(self.logp[self.kcore:], self.logt[self.kcore:], self.y[self.kcore:])
             except ValueError:
                 raise EOSError('failed in eos call. p[-1]={:g} t[-1]={:g}'.format(self.p[-1], self.t[-1]))
             self.grada[self.kcore:] = res_hhe['grada']
@@ -1112,7 +1519,7 @@ class evol:
 
         self.grada_check_nans()
         if adiabatic:
-            self.gradt = np.copy(self.grada) # may be modified later if include_he_immiscibility and rrho_where_have_helium_gradient
+            np.copyto(self.gradt, self.grada) # may be modified later if include_he_immiscibility and rrho_where_have_helium_gradient
         else:
             # leave alone; potentially set as superadiabatic in static
             pass
@@ -1146,6 +1553,7 @@ class evol:
                     self.t[k_atm:] = self.teq
 
         self.t[:self.kcore] = self.t[self.kcore] # core is isothermal at temperature of core-mantle boundary
+        np.log10(self.t, out=self.logt)
 
         if np.any(np.isnan(self.t)):
             raise EOSError('%i nans in temperature after integrate gradt on static iteration %i.' % (len(self.t[np.isnan(self.t)]), self.iters))
@@ -1247,8 +1655,6 @@ class evol:
             self.y[self.kcore:self.ktrans] = self.y2
             self.y[self.ktrans:] = self.y1
 
-        self.envelope_mean_y = np.dot(self.dm[self.kcore:], self.y[self.kcore:-1]) / np.sum(self.dm[self.kcore:])
-
 
     def grada_check_nans(self):
         # a nan might appear in grada if a p, t point is just outside the original tables.
@@ -1293,6 +1699,7 @@ class evol:
                 self.rho[k_first_nan:k_last_nan+1] = (self.r[k_first_nan:k_last_nan+1] - self.r[k_first_nan]) \
                                                         / (self.r[k_last_nan+1] - self.r[k_first_nan]) \
                                                         * (first_good_rho - last_good_rho) + last_good_rho
+                self.logrho[k_first_nan:k_last_nan+1] = np.log10(self.rho[k_first_nan:k_last_nan+1])
             else:
                 # with open('rho_nans.dat', 'w') as fw:
                 #     for k, val in enumerate(self.rho):
@@ -1369,164 +1776,171 @@ class evol:
             else:
                 raise AtmError('unspecified atm error for g=%g, t10=%g: %s' % (self.surface_g*1e-2, self.t10, e.args[0]))
 
-    def set_derivatives_etc(self):
-        return
-        self.rtot = self.r[-1]
-        self.r[0] = 1. # 1 cm central radius to keep these things at least calculable at center zone
-        self.g = const.cgrav * self.m / self.r ** 2
-        self.g[0] = self.g[1] # hack so that we don't get infs in, e.g., pressure scale height. won't effect anything
+    # derived quantities are not set by static. each group is computed the first time one of its names is
+    # looked up after the model last changed (see __getattr__), and kept until the model changes again.
+    derived_groups = {
+        'thermo':('gamma1', 'gamma3', 'cp', 'cv', 'gradt_direct', 'dlogrho_dlogy', 'dlogrho_dlogz', 'dlogz_dlogp',
+            'dlogrho_dlogt_const_p', 'rho_h_component', 'rho_he_component', 'rho_z_component',
+            'chirho_full', 'chit_full', 'grada_full'),
+        'seismology':('g', 'dlogp_dlogrho', 'csound', 'lamb_s12', 'delta_nu', 'delta_nu_env', 'homology_v',
+            'brunt_n2_direct', 'brunt_n2_unno_direct', 'brunt_n2_unno', 'brunt_b_mhm', 'brunt_n2_mhm', 'brunt_n2_thermal',
+            'brunt_n2', 'pressure_scale_height', 'mf', 'rf'),
+        'integrals':('mz_env_outer', 'mz_env_inner', 'mz_env', 'mz_core', 'mz', 'bulk_z', 'ysurf', 'envelope_mean_y', 'nmoi')
+        }
 
-        hhe_res_env = self.hhe_eos.get(np.log10(self.p[self.kcore:]), np.log10(self.t[self.kcore:]), self.y[self.kcore:])
+    def __getattr__(self, name):
+        # only called when normal attribute lookup fails
+        for group, names in evol.derived_groups.items():
+            if name in names and 'derived' in self.__dict__: # not the case, e.g., while unpickling
+                self.get_derived_group(group)
+                if name in self.derived:
+                    return self.derived[name]
+                break
+        raise AttributeError("'evol' object has no attribute '{}'".format(name))
 
-        # this is a structure derivative, not a thermodynamic one. wherever the profile is a perfect adiabat, this is also gamma1.
-        self.dlogp_dlogrho = np.diff(np.log(self.p)) / np.diff(np.log(self.rho))
+    def get_derived_group(self, group):
+        '''
+        compute the named group of derived quantities unless it is current. an AttributeError raised in the
+        computation is re-raised as a RuntimeError, since __getattr__ would otherwise report it as the
+        derived quantity itself being missing.
+        '''
+        if self.derived_version.get(group) != self.profile_version:
+            try:
+                res = getattr(self, 'get_{}_quantities'.format(group))()
+            except AttributeError as e:
+                raise RuntimeError('failed to compute {} quantities: {}'.format(group, e))
+            self.derived.update(res)
+            self.derived_version[group] = self.profile_version
+
+    def is_derived(self, name):
+        '''whether name is a derived quantity (see derived_groups).'''
+        return any(name in names for names in evol.derived_groups.values())
+
+    def is_available(self, name):
+        '''
+        whether name can be looked up without computing anything: a derived quantity whose group is current,
+        or any other attribute that is set. unlike hasattr, never starts the computation of derived quantities.
+        '''
+        for group, names in evol.derived_groups.items():
+            if name in names:
+                return self.__dict__.get('derived_version', {}).get(group) == self.profile_version and name in self.derived
+        return name in self.__dict__
+
+    def set_derived(self, name, value):
+        '''set a derived quantity directly (e.g., from a cache); good until the model next changes.'''
+        for group, names in evol.derived_groups.items():
+            if name in names:
+                self.derived[name] = value
+                self.derived_version[group] = self.profile_version
+                return
+        raise ValueError('{} is not a derived quantity.'.format(name))
 
-        self.gamma1 = np.zeros_like(self.p)
-        self.gamma3 = np.zeros_like(self.p)
-        self.csound = np.zeros_like(self.p)
-        self.gradt_direct = np.zeros_like(self.p)
-        self.cp = np.zeros_like(self.p)
-        self.cv = np.zeros_like(self.p)
+    def set_derivatives_etc(self):
+        '''compute every group of derived quantities now, rather than when first accessed.'''
+        for group in evol.derived_groups:
+            self.get_derived_group(group)
 
+    def get_thermo_quantities(self):
+        '''
+        thermodynamic derivatives. the z contribution is ignored in the envelope except in dlogrho_dlogt_const_p.
+        chirho_full, chit_full and grada_full are chirho, chit and grada with the core part, which the static
+        iterations leave alone, filled in from the z eos.
+        '''
+        res = {}
+        # the last density update of a converged xyz envelope was made at this same logp, logt and y; reuse it if so
+        components = self.get_rho_components(self.logp[self.kcore:], self.logt[self.kcore:], self.y[self.kcore:])
+        if components:
+            hhe_res_env = components['hhe']
+        else:
+            hhe_res_env = self.hhe_eos.get(self.logp[self.kcore:], self.logt[self.kcore:], self.y[self.kcore:])
+
+        res['gamma1'] = gamma1 = np.zeros_like(self.p)
+        res['gamma3'] = np.zeros_like(self.p)
+        res['cp'] = np.zeros_like(self.p)
+        res['cv'] = np.zeros_like(self.p)
         if self.kcore > 0 and self.evol_params['z_eos_option']: # compute gamma1 in core
-            self.gamma1[:self.kcore] = self.z_eos.get_gamma1(np.log10(self.p[:self.kcore]), np.log10(self.t[:self.kcore]))
-        self.gamma1[self.kcore:] = hhe_res_env['gamma1']
-        self.gamma3[self.kcore:] = hhe_res_env['gamma3']
-        self.csound = np.sqrt(self.p / self.rho * self.gamma1)
-        self.lamb_s12 = 2. * self.csound ** 2 / self.r ** 2 # lamb freq. squared for l=1
-        self.cp[self.kcore:] = hhe_res_env['cp']
-        self.cv[self.kcore:] = hhe_res_env['cv']
-
-        # ignoring the envelope z component here
-        self.chirho[self.kcore:] = hhe_res_env['chirho']
-        self.chit[self.kcore:] = hhe_res_env['chit']
-        self.gradt_direct[:self.kcore] = 0.
-        self.gradt_direct[self.kcore+1:] = np.diff(np.log(self.t[self.kcore:])) / np.diff(np.log(self.p[self.kcore:]))
-
-        self.dlogrho_dlogy = np.zeros_like(self.p)
+            gamma1[:self.kcore] = self.z_eos.get_gamma1(self.logp[:self.kcore], self.logt[:self.kcore])
+        gamma1[self.kcore:] = hhe_res_env['gamma1']
+        res['gamma3'][self.kcore:] = hhe_res_env['gamma3']
+        res['cp'][self.kcore:] = hhe_res_env['cp']
+        res['cv'][self.kcore:] = hhe_res_env['cv']
+
+        res['gradt_direct'] = np.zeros_like(self.p)
+        res['gradt_direct'][self.kcore+1:] = np.diff(np.log(self.t[self.kcore:])) / np.diff(np.log(self.p[self.kcore:]))
+
+        res['dlogrho_dlogy'] = np.zeros_like(self.p)
         try:
-            self.dlogrho_dlogy[self.kcore:] = hhe_res_env['chiy']
+            res['dlogrho_dlogy'][self.kcore:] = hhe_res_env['chiy']
         except:
             pass
 
-        self.delta_nu = (2. * trapz(self.csound ** -1, x=self.r)) ** -1 * 1e6 # the large frequency separation in uHz
-        self.delta_nu_env = (2. * trapz(self.csound[self.kcore:] ** -1, x=self.r[self.kcore:])) ** -1 * 1e6
-
-        dlnp_dlnr = np.diff(np.log(self.p)) / np.diff(np.log(self.r))
-        dlnrho_dlnr = np.diff(np.log(self.rho)) / np.diff(np.log(self.r))
-
+        chirho = res['chirho_full'] = np.copy(self.chirho)
+        chit = res['chit_full'] = np.copy(self.chit)
+        grada = res['grada_full'] = np.copy(self.grada)
         if self.kcore > 0:
             try:
-                self.chirho[:self.kcore] = self.z_eos.get_chirho(np.log10(self.p[:self.kcore]), np.log10(self.t[:self.kcore]))
-                self.chit[:self.kcore] = self.z_eos.get_chit(np.log10(self.p[:self.kcore]), np.log10(self.t[:self.kcore]))
-                self.grada[:self.kcore] = (1. - self.chirho[:self.kcore] / self.gamma1[:self.kcore]) / self.chit[:self.kcore] # e.g., Unno's equations 13.85, 13.86
+                chirho[:self.kcore] = self.z_eos.get_chirho(self.logp[:self.kcore], self.logt[:self.kcore])
+                chit[:self.kcore] = self.z_eos.get_chit(self.logp[:self.kcore], self.logt[:self.kcore])
+                grada[:self.kcore] = (1. - chirho[:self.kcore] / gamma1[:self.kcore]) / chit[:self.kcore] # e.g., Unno's equations 13.85, 13.86
             except AttributeError:
                 print("warning: z_eos_option '%s' does not provide methods for get_chirho and get_chit." % self.evol_params['z_eos_option'])
                 print('cannot calculate things like grada in core and so this model may not be suited for eigenmode calculations.')
                 pass
 
-        self.brunt_n2_direct = np.zeros_like(self.p)
-        self.brunt_n2_direct[1:] = self.g[1:] / self.r[1:] * (dlnp_dlnr / self.gamma1[1:] - dlnrho_dlnr)
-
-        # other forms of the BV frequency
-        self.homology_v = const.cgrav * self.m * self.rho / self.r / self.p
-        self.brunt_n2_unno_direct = np.zeros_like(self.p)
-        self.brunt_n2_unno_direct[self.kcore+1:] = self.g[self.kcore+1:] * self.homology_v[self.kcore+1:] / self.r[self.kcore+1:] * \
-            (self.dlogp_dlogrho[self.kcore:] ** -1. - self.gamma1[self.kcore+1:] ** -1.) # Unno 13.102
-
-        rho_z = np.zeros_like(self.p)
+        # end-member densities, kept for the composition term of the brunt frequency (see get_seismology_quantities).
+        # rho_z is only needed in the envelope; the core has y == 0, and rhot is set separately there.
+        rho_z = res['rho_z_component'] = np.zeros_like(self.p)
         rho_hhe = np.zeros_like(self.p)
-        if np.any(self.z > 0.) and self.evol_params['z_eos_option']:
-            rho_z[self.z > 0.] = self.get_rho_z(np.log10(self.p[self.z > 0.]), np.log10(self.t[self.z > 0.]))
+        if components:
+            rho_z[self.kcore:] = components['rho_z']
+        elif np.any(self.z[self.kcore:] > 0.) and self.evol_params['z_eos_option']:
+            rho_z[self.kcore:] = self.get_rho_z(self.logp[self.kcore:], self.logt[self.kcore:])
         rho_hhe[self.kcore:] = 10 ** hhe_res_env['logrho']
-        self.dlogrho_dlogz = np.zeros_like(self.p)
+        if 'rho_h' in hhe_res_env and 'rho_he' in hhe_res_env:
+            res['rho_h_component'] = np.zeros_like(self.p)
+            res['rho_he_component'] = np.zeros_like(self.p)
+            res['rho_h_component'][self.kcore:] = hhe_res_env['rho_h']
+            res['rho_he_component'][self.kcore:] = hhe_res_env['rho_he']
+        else: # eos doesn't report its end members
+            res['rho_h_component'] = res['rho_he_component'] = None
+        res['dlogrho_dlogz'] = np.zeros_like(self.p)
         # dlogrho_dlogz is only calculable where all of X, Y, and Z are non-zero.
-        self.dlogrho_dlogz[self.z * self.y > 0.] = -1. * self.rho[self.z * self.y > 0.] * self.z[self.z * self.y > 0.] * (rho_z[self.z * self.y > 0.] ** -1 - rho_hhe[self.z * self.y > 0.] ** -1)
-        self.dlogz_dlogp = np.zeros_like(self.p)
-        self.dlogz_dlogp[1:] = np.diff(np.log(self.z + 1e-20)) / np.diff(np.log(self.p)) # fudge doesn't change answer, just avoids inf if z==0
-
-
-        # this is the form of brunt_n2 that makes use of grad, grada, and the composition term brunt B.
-        self.brunt_n2_unno = np.zeros_like(self.p)
-        # in core, explicitly ignore the Y gradient.
-        self.brunt_n2_unno[:self.kcore+1] = self.g[:self.kcore+1] * self.homology_v[:self.kcore+1] / self.r[:self.kcore+1] * \
-            (self.chit[:self.kcore+1] / self.chirho[:self.kcore+1] * (self.grada[:self.kcore+1] - self.gradt[:self.kcore+1]) + \
-            self.dlogrho_dlogz[:self.kcore+1] * self.dlogz_dlogp[:self.kcore+1])
-        # in envelope, Y gradient is crucial.
-        self.brunt_n2_unno[self.kcore:] = self.g[self.kcore:] * self.homology_v[self.kcore:] / self.r[self.kcore:] * \
-            (self.chit[self.kcore:] / self.chirho[self.kcore:] * (self.grada[self.kcore:] - self.gradt[self.kcore:]) + \
-            self.dlogrho_dlogy[self.kcore:] * self.grady[self.kcore:])
-
-        # akin to mike montgomery's form for brunt_B, which is how mesa does it by default (Paxton+2013)
-        rho_this_pt_next_comp = np.zeros_like(self.p)
-        if np.all(self.z[self.kcore:-1] > 0.):
-            rho_this_pt_next_comp[self.kcore+1:] = self.get_rho_xyz(np.log10(self.p[self.kcore+1:]), np.log10(self.t[self.kcore+1:]), self.y[self.kcore:-1], self.z[self.kcore:-1])
-        else:
-            rho_this_pt_next_comp[self.kcore+1:] = 10 ** self.hhe_eos.get_logrho(np.log10(self.p[self.kcore+1:]), np.log10(self.t[self.kcore+1:]), self.y[self.kcore:-1])
-        # core-mantle point must be treated separately since next cell down is pure Z, and get_rho_xyz is not designed for pure Z.
-        # call z_eos.get_logrho directly instead.
-        if self.kcore > 0:
-            if self.evol_params['z_eos_option']:
-                rho_this_pt_next_comp[self.kcore] = 10 ** self.z_eos.get_logrho(np.log10(self.p[self.kcore]), np.log10(self.t[self.kcore]))
-            elif self.static_params['core_prho_relation']:
-                if self.static_params['core_prho_relation'] == 'hm89 rock':
-                    rho_this_pt_next_comp[self.kcore] = self.get_rhoz_hm89_rock(self.p[self.kcore], self.rho[self.kcore])
-                elif self.static_params['core_prho_relation'] == 'hm89 ice':
-                    rho_this_pt_next_comp[self.kcore] = self.get_rhoz_hm89_ice(self.p[self.kcore], self.rho[self.kcore])
-                else:
-                    raise ValueError ('if using core_prho_relation, only options are hm89 rock and hm89 ice.')
-            else:
-                raise ValueError('cannot include a core unless either z_eos_option or  are set.')
-        # within core, composition is assumed constant so rho_this_pt_next_comp is identical to rho.
-        if self.static_params['erase_z_discontinuity_from_brunt']:
-            rho_this_pt_next_comp[:self.kcore+1] = self.rho[:self.kcore+1]
-        else:
-            rho_this_pt_next_comp[:self.kcore] = self.rho[:self.kcore]
-
-        self.brunt_b_mhm = np.zeros_like(self.p)
-        self.brunt_b_mhm[:-1] = (np.log(rho_this_pt_next_comp[1:]) - np.log(self.rho[:-1])) / (np.log(self.rho[1:]) - np.log(self.rho[:-1])) / self.chit[:-1]
-        # self.brunt_b_mhm[:-1] = (np.log(rho_this_pt_next_comp[:-1]) - np.log(self.rho[:-1])) / (np.log(self.rho[:-1]) - np.log(self.rho[1:])) / self.chit[:-1]
-        self.brunt_n2_mhm = self.g ** 2 * self.rho / self.p * self.chit / self.chirho * (self.grada - self.gradt + self.brunt_b_mhm)
-        self.brunt_n2_mhm[0] = 0. # had nan previously, probably from brunt_b
-
-        # self.brunt_b = self.brunt_b_mhm
-        # self.brunt_n2 = self.brunt_n2_mhm
-        self.brunt_n2_thermal = self.g ** 2 * self.rho / self.p * self.chit / self.chirho * (self.grada - self.gradt)
-
-        self.brunt_n2 = self.brunt_n2_unno
+        xyz = self.z * self.y > 0.
+        res['dlogrho_dlogz'][xyz] = -1. * self.rho[xyz] * self.z[xyz] * (rho_z[xyz] ** -1 - rho_hhe[xyz] ** -1)
+        res['dlogz_dlogp'] = np.zeros_like(self.p)
+        res['dlogz_dlogp'][1:] = np.diff(np.log(self.z + 1e-20)) / np.diff(np.log(self.p)) # fudge doesn't change answer, just avoids inf if z==0
 
         # this is the thermo derivative rho_t in scvh parlance. necessary for gyre, which calls this minus delta.
         # dlogrho_dlogt_const_p = chit / chirho = -delta = -rho_t
-        self.dlogrho_dlogt_const_p = np.zeros_like(self.p)
-        # print 'at time of calculating rho_t for final static model, log core temperature is %f' % np.log10(self.t[0])
+        rhot = res['dlogrho_dlogt_const_p'] = np.zeros_like(self.p)
         if self.kcore > 0 and self.evol_params['z_eos_option']:
-            self.dlogrho_dlogt_const_p[:self.kcore] = self.z_eos.get_dlogrho_dlogt_const_p(np.log10(self.p[:self.kcore]), np.log10(self.t[:self.kcore]))
+            rhot[:self.kcore] = self.z_eos.get_dlogrho_dlogt_const_p(self.logp[:self.kcore], self.logt[:self.kcore])
         if hasattr(self, 'z_eos_low_t') and self.t[-1] < 1e3: # must be calculated separately for low T and high T part of the envelope
-            k_t_boundary = np.where(np.log10(self.t) > 3.)[0][-1]
+            k_t_boundary = np.where(self.logt > 3.)[0][-1]
             try:
                 if self.z1 > 0.: # use eq. (16) in ms.pdf for this derivative from additive volume mixture
-                    self.dlogrho_dlogt_const_p[self.kcore:k_t_boundary+1] = \
+                    rhot[self.kcore:k_t_boundary+1] = \
                             self.rho[self.kcore:k_t_boundary+1] \
                             * (self.z[self.kcore:k_t_boundary+1] / rho_z[self.kcore:k_t_boundary+1] \
-                                * self.z_eos.get_dlogrho_dlogt_const_p(np.log10(self.p[self.kcore:k_t_boundary+1]), \
-                                                                        np.log10(self.t[self.kcore:k_t_boundary+1])) \
+                                * self.z_eos.get_dlogrho_dlogt_const_p(self.logp[self.kcore:k_t_boundary+1], \
+                                                                        self.logt[self.kcore:k_t_boundary+1]) \
                             + (1. - self.z[self.kcore:k_t_boundary+1]) / rho_hhe[self.kcore:k_t_boundary+1] \
                                 * hhe_res_env['rhot'][:k_t_boundary+1-self.kcore]) # this funny slice is because res[...] only runs kcore to surface
                 else: # pure H/He
-                    self.dlogrho_dlogt_const_p[self.kcore:k_t_boundary+1] = hhe_res_env['rhot'][:k_t_boundary+1-self.kcore]
+                    rhot[self.kcore:k_t_boundary+1] = hhe_res_env['rhot'][:k_t_boundary+1-self.kcore]
             except:
                 print('failed in dlogrho_dlogt_const_p for hi-T part of envelope')
                 raise
             try:
                 if self.z1 > 0.:
-                    self.dlogrho_dlogt_const_p[k_t_boundary+1:] = self.rho[k_t_boundary+1:] \
+                    rhot[k_t_boundary+1:] = self.rho[k_t_boundary+1:] \
                                                     * (self.z[k_t_boundary+1:] / rho_z[k_t_boundary+1:] \
-                                                    * self.z_eos_low_t.get_dlogrho_dlogt_const_p(np.log10(self.p[k_t_boundary+1:]), \
-                                                                                                np.log10(self.t[k_t_boundary+1:])) \
+                                                    * self.z_eos_low_t.get_dlogrho_dlogt_const_p(self.logp[k_t_boundary+1:], \
+                                                                                                self.logt[k_t_boundary+1:]) \
                                                     + (1. - self.z[k_t_boundary+1:]) / rho_hhe[k_t_boundary+1:] \
                                                         * hhe_res_env['rhot'][k_t_boundary+1-self.kcore:])
                 else:
-                    self.dlogrho_dlogt_const_p[k_t_boundary+1:] = hhe_res_env['rhot'][k_t_boundary+1-self.kcore:]
+                    rhot[k_t_boundary+1:] = hhe_res_env['rhot'][k_t_boundary+1-self.kcore:]
             except:
                 print('failed in dlogrho_dlogt_const_p for lo-T part of envelope')
                 raise
@@ -1534,63 +1948,150 @@ class evol:
         else: # no need to sweat low vs. high t (only an REOS-H2O limitation)
             if self.evol_params['z_eos_option']:
                 if self.z1 == 0.:
-                    self.dlogrho_dlogt_const_p[self.kcore:] = hhe_res_env['rhot']
+                    rhot[self.kcore:] = hhe_res_env['rhot']
                 else:
-                    self.dlogrho_dlogt_const_p[self.kcore:] = self.rho[self.kcore:] * \
+                    rhot[self.kcore:] = self.rho[self.kcore:] * \
                         (self.z[self.kcore:] / rho_z[self.kcore:] \
-                        * self.z_eos.get_dlogrho_dlogt_const_p(np.log10(self.p[self.kcore:]), np.log10(self.t[self.kcore:])) \
+                        * self.z_eos.get_dlogrho_dlogt_const_p(self.logp[self.kcore:], self.logt[self.kcore:]) \
                         + (1. - self.z[self.kcore:]) / rho_hhe[self.kcore:] \
                         * hhe_res_env['rhot'])
             else:
                 assert np.all(self.z[self.kcore:] == 0.), 'consistency check failed: z_eos_option is None, but have non-zero z in envelope'
-                self.dlogrho_dlogt_const_p[self.kcore:] = res['rhot']
+                rhot[self.kcore:] = hhe_res_env['rhot']
+
+        return res
+
+    def get_seismology_quantities(self):
+        '''gravity, sound speed, large frequency separation, and the several forms of the brunt frequency.'''
+        res = {}
+        rtot = self.r[-1]
+        r = np.copy(self.r)
+        r[0] = 1. # 1 cm central radius to keep these things at least calculable at center zone
+        res['g'] = g = const.cgrav * self.m / r ** 2
+        g[0] = g[1] # hack so that we don't get infs in, e.g., pressure scale height. won't effect anything
+
+        # this is a structure derivative, not a thermodynamic one. wherever the profile is a perfect adiabat, this is also gamma1.
+        res['dlogp_dlogrho'] = dlogp_dlogrho = np.diff(np.log(self.p)) / np.diff(np.log(self.rho))
+
+        gamma1 = self.gamma1 # computes thermo quantities if necessary
+        chirho, chit, grada = self.chirho_full, self.chit_full, self.grada_full # with the core filled in
+        res['csound'] = csound = np.sqrt(self.p / self.rho * gamma1)
+        res['lamb_s12'] = 2. * csound ** 2 / r ** 2 # lamb freq. squared for l=1
+
+        res['delta_nu'] = (2. * trapz(csound ** -1, x=r)) ** -1 * 1e6 # the large frequency separation in uHz
+        res['delta_nu_env'] = (2. * trapz(csound[self.kcore:] ** -1, x=r[self.kcore:])) ** -1 * 1e6
+
+        dlnp_dlnr = np.diff(np.log(self.p)) / np.diff(np.log(r))
+        dlnrho_dlnr = np.diff(np.log(self.rho)) / np.diff(np.log(r))
 
+        res['brunt_n2_direct'] = np.zeros_like(self.p)
+        res['brunt_n2_direct'][1:] = g[1:] / r[1:] * (dlnp_dlnr / gamma1[1:] - dlnrho_dlnr)
+
+        # other forms of the BV frequency
+        res['homology_v'] = homology_v = const.cgrav * self.m * self.rho / r / self.p
+        res['brunt_n2_unno_direct'] = np.zeros_like(self.p)
+        res['brunt_n2_unno_direct'][self.kcore+1:] = g[self.kcore+1:] * homology_v[self.kcore+1:] / r[self.kcore+1:] * \
+            (dlogp_dlogrho[self.kcore:] ** -1. - gamma1[self.kcore+1:] ** -1.) # Unno 13.102
+
+        # this is the form of brunt_n2 that makes use of grad, grada, and the composition term brunt B.
+        brunt_n2_unno = res['brunt_n2_unno'] = np.zeros_like(self.p)
+        # in core, explicitly ignore the Y gradient.
+        brunt_n2_unno[:self.kcore+1] = g[:self.kcore+1] * homology_v[:self.kcore+1] / r[:self.kcore+1] * \
+            (chit[:self.kcore+1] / chirho[:self.kcore+1] * (grada[:self.kcore+1] - self.gradt[:self.kcore+1]) + \
+            self.dlogrho_dlogz[:self.kcore+1] * self.dlogz_dlogp[:self.kcore+1])
+        # in envelope, Y gradient is crucial.
+        brunt_n2_unno[self.kcore:] = g[self.kcore:] * homology_v[self.kcore:] / r[self.kcore:] * \
+            (chit[self.kcore:] / chirho[self.kcore:] * (grada[self.kcore:] - self.gradt[self.kcore:]) + \
+            self.dlogrho_dlogy[self.kcore:] * self.grady[self.kcore:])
+
+        # akin to mike montgomery's form for brunt_B, which is how mesa does it by default (Paxton+2013)
+        rho_this_pt_next_comp = np.zeros_like(self.p)
+        xyz = np.all(self.z[self.kcore:-1] > 0.)
+        if self.rho_h_component is not None: # end members don't depend on composition: just mix them with the next zone's y, z
+            k = slice(self.kcore + 1, None)
+            rho_this_pt_next_comp[k] = self.mix_rho(self.rho_h_component[k], self.rho_he_component[k], self.y[self.kcore:-1],
+                self.rho_z_component[k] if xyz else None, self.z[self.kcore:-1] if xyz else None)
+        elif xyz:
+            self.get_rho_xyz(self.logp[self.kcore+1:], self.logt[self.kcore+1:], self.y[self.kcore:-1], self.z[self.kcore:-1], out=rho_this_pt_next_comp[self.kcore+1:])
+        else:
+            rho_this_pt_next_comp[self.kcore+1:] = 10 ** self.hhe_eos.get_logrho(self.logp[self.kcore+1:], self.logt[self.kcore+1:], self.y[self.kcore:-1])
+        # core-mantle point must be treated separately since next cell down is pure Z, and get_rho_xyz is not designed for pure Z.
+        # call z_eos.get_logrho directly instead.
+        if self.kcore > 0:
+            if self.evol_params['z_eos_option']:
+                rho_this_pt_next_comp[self.kcore] = 10 ** self.z_eos.get_logrho(self.logp[self.kcore], self.logt[self.kcore])
+            elif self.static_params['core_prho_relation']:
+                if self.static_params['core_prho_relation'] == 'hm89 rock':
+                    rho_this_pt_next_comp[self.kcore] = self.get_rhoz_hm89_rock(self.p[self.kcore], self.rho[self.kcore])
+                elif self.static_params['core_prho_relation'] == 'hm89 ice':
+                    rho_this_pt_next_comp[self.kcore] = self.get_rhoz_hm89_ice(self.p[self.kcore], self.rho[self.kcore])
+                else:
+                    raise ValueError ('if using core_prho_relation, only options are hm89 rock and hm89 ice.')
+            else:
+                raise ValueError('cannot include a core unless either z_eos_option or  are set.')
+        # within core, composition is assumed constant so rho_this_pt_next_comp is identical to rho.
+        if self.static_params['erase_z_discontinuity_from_brunt']:
+            rho_this_pt_next_comp[:self.kcore+1] = self.rho[:self.kcore+1]
+        else:
+            rho_this_pt_next_comp[:self.kcore] = self.rho[:self.kcore]
+
+        res['brunt_b_mhm'] = brunt_b_mhm = np.zeros_like(self.p)
+        brunt_b_mhm[:-1] = (np.log(rho_this_pt_next_comp[1:]) - np.log(self.rho[:-1])) / (np.log(self.rho[1:]) - np.log(self.rho[:-1])) / chit[:-1]
+        res['brunt_n2_mhm'] = g ** 2 * self.rho / self.p * chit / chirho * (grada - self.gradt + brunt_b_mhm)
+        res['brunt_n2_mhm'][0] = 0. # had nan previously, probably from brunt_b
+
+        res['brunt_n2_thermal'] = g ** 2 * self.rho / self.p * chit / chirho * (grada - self.gradt)
+
+        res['brunt_n2'] = brunt_n2_unno
+
+        res['pressure_scale_height'] = self.p / self.rho / g
+        res['mf'] = self.m / self.mtot
+        res['rf'] = self.r / rtot
+
+        return res
+
+    def get_integrals_quantities(self):
+        '''heavy-element masses, bulk z, surface and mean envelope y, and normalized moment of inertia.'''
+        res = {}
         if self.static_params['model_type'] == 'three_layer': # two-layer envelope in terms of Z
             if hasattr(self, 'z2') and self.z2:
                 assert self.ktrans > 0, 'self.z2 is set but self.ktrans is <= 0. if not setting transition_pressure, then leave z2 unset.'
-                self.mz_env_outer = np.sum(self.dm[self.ktrans:]) * self.z[self.ktrans + 1]
-                self.mz_env_inner = np.sum(self.dm[self.kcore:self.ktrans]) * self.z[self.ktrans - 1]
-                self.mz_env = self.mz_env_outer + self.mz_env_inner
-                self.mz_core = np.dot(self.z[:self.kcore], self.dm[:self.kcore])
-                self.mz = self.mz_env_outer + self.mz_env_inner + self.mz_core
+                res['mz_env_outer'] = np.sum(self.dm[self.ktrans:]) * self.z[self.ktrans + 1]
+                res['mz_env_inner'] = np.sum(self.dm[self.kcore:self.ktrans]) * self.z[self.ktrans - 1]
+                res['mz_env'] = res['mz_env_outer'] + res['mz_env_inner']
+                res['mz_core'] = np.dot(self.z[:self.kcore], self.dm[:self.kcore])
+                res['mz'] = res['mz_env'] + res['mz_core']
             else:
-                self.mz_env = np.sum(self.dm[self.kcore:] * self.z[self.kcore+1])
-                self.mz_core = np.dot(self.z[:self.kcore], self.dm[:self.kcore])
-                self.mz = self.mz_env + self.mz_core
-        elif self.static_params['model_type'] in ('sigmoid', 'cosine'): # no inner or outer envelope to speak of
-            self.mz_core = 0
-            # print(len(self.z), len(self.dm))
-            self.mz_env = self.mz = np.dot(self.z[:-1], self.dm)
-        elif self.static_params['model_type'] in ('sig2', 'sig2_yz'): # no inner or outer envelope to speak of
-            self.mz_core = 0
-            # print(len(self.z), len(self.dm))
-            self.mz_env = self.mz = np.dot(self.z[:-1], self.dm)
+                res['mz_env'] = np.sum(self.dm[self.kcore:] * self.z[self.kcore+1])
+                res['mz_core'] = np.dot(self.z[:self.kcore], self.dm[:self.kcore])
+                res['mz'] = res['mz_env'] + res['mz_core']
+        elif self.static_params['model_type'] in ('sigmoid', 'cosine', 'sig2', 'sig2_yz'): # no inner or outer envelope to speak of
+            res['mz_core'] = 0
+            res['mz_env'] = res['mz'] = np.dot(self.z[:-1], self.dm)
         else:
             # Z uniform in envelope, Z=1 in core.
-            self.mz_env = self.z[-1] * (self.mtot - self.mcore * const.mearth)
-            self.mz = self.mz_env + self.mcore * const.mearth
+            res['mz_env'] = self.z[-1] * (self.mtot - self.mcore * const.mearth)
+            res['mz'] = res['mz_env'] + self.mcore * const.mearth
 
-        self.bulk_z = self.mz / self.mtot
-        self.ysurf = self.y[-1]
-        self.envelope_mean_y = np.dot(self.dm[self.kcore:], self.y[self.kcore:-1]) / np.sum(self.dm[self.kcore:])
+        res['bulk_z'] = res['mz'] / self.mtot
+        res['ysurf'] = self.y[-1]
+        res['envelope_mean_y'] = np.dot(self.dm[self.kcore:], self.y[self.kcore:-1]) / np.sum(self.dm[self.kcore:])
 
         # axial moment of inertia if spherical, in units of mtot * rtot ** 2. moi of a thin spherical shell is 2 / 3 * m * r ** 2
-        self.nmoi = 2. / 3 * trapz(self.r ** 2, x=self.m) / self.mtot / self.rtot ** 2
+        res['nmoi'] = 2. / 3 * trapz(self.r ** 2, x=self.m) / self.mtot / self.r[-1] ** 2
 
-        self.pressure_scale_height = self.p / self.rho / self.g
-        self.mf = self.m / self.mtot
-        self.rf = self.r / self.rtot
+        return res
 
     def set_entropy(self):
         # set entropy in envelope (ignore z contribution in envelope)
         self.entropy = np.zeros_like(self.p)
-        self.entropy[self.kcore:] = 10 ** self.hhe_eos.get_logs(np.log10(self.p[self.kcore:]), np.log10(self.t[self.kcore:]), self.y[self.kcore:]) * const.mp / const.kb
+        self.entropy[self.kcore:] = 10 ** self.hhe_eos.get_logs(self.logp[self.kcore:], self.logt[self.kcore:], self.y[self.kcore:]) * const.mp / const.kb
         # experimenting with including entropy of core material (don't bother with aneos, it's not a column).
         if self.static_params['include_core_entropy']:
             if not self.evol_params['z_eos_option'] == 'reos water':
                 raise NotImplementedError("including entropy of the core is only possible if z_eos_option == 'reos water'.")
             else:
-                self.entropy[:self.kcore] = 10 ** self.z_eos.get_logs(np.log10(self.p[:self.kcore]), np.log10(self.t[:self.kcore])) * const.mp / const.kb
+                self.entropy[:self.kcore] = 10 ** self.z_eos.get_logs(self.logp[:self.kcore], self.logt[:self.kcore]) * const.mp / const.kb
 
 
 
@@ -1616,6 +2117,8 @@ class evol:
             params['start_t'] = 2e3
         if not 'which_t' in params.keys():
             params['which_t'] = 't1'
+        if not 'predictor_order' in params.keys():
+            params['predictor_order'] = 0 # 1 or 2 to seed each static model by extrapolating from the last 2 or 3; see predict_static_guess
 
         try:
             stdout_interval = params['stdout_interval']
@@ -1677,6 +2180,8 @@ class evol:
 
         previous_t = start_t
         self.previous_entropy = self.entropy
+        self.accepted_profiles = []
+        self.remember_accepted_profile(start_t)
 
         while not done:
             if 'fixed_delta_t' in list(params):
@@ -1692,6 +2197,9 @@ class evol:
                 params[which_t] = previous_t - delta_t
                 other_t = {'t1':'t10', 't10':'t1'}[params['which_t']]
                 params.pop(other_t, None) # so that static doesn't get passed both t1 and t10
+                if params['predictor_order'] > 0:
+                    # after a retry y has been reset to y1 on purpose; leave it that way
+                    self.predict_static_guess(params[which_t], params['predictor_order'], predict_y=retries == 0)
 
                 try:
                     self.static(params) # pass the full evolve params; many won't be used
@@ -1753,12 +2261,14 @@ class evol:
                             from lorenzen import get_xp
                             # are we anywhere *close* to rainout for initial y1?
                             min_abs_t_minus_tphase = 100.
-                            for pval in (1, 2, 4):
-                                kp = np.where(self.p*1e-12 < pval)[0][0] - 1
-                                tphase = self.phase.t_phase(pval, get_xp(self.z1, self.y1))
-                                t_minus_tphase = tphase + params['phase_t_offset']*1e-3 - self.t[kp]*1e-3 # effective tphase minus true t in kK
-                                min_abs_t_minus_tphase = min(min_abs_t_minus_tphase, abs(t_minus_tphase))
-                                # print('kp={} p={} t={} tphase={} offset={} delta_t={}'.format(kp, self.p[kp]*1e-12, self.t[kp]*1e-3, tphase, params['phase_t_offset']*1e-3, t_minus_tphase))
+                            pvals = np.array([1., 2., 4.])
+                            kp = np.array([np.where(self.p*1e-12 < pval)[0][0] - 1 for pval in pvals])
+                            tphase = self.phase.t_phase(pvals, get_xp(self.z1, self.y1))
+                            t_minus_tphase = tphase + params['phase_t_offset']*1e-3 - self.t[kp]*1e-3 # effective tphase minus true t in kK
+                            for value in np.abs(t_minus_tphase):
+                                min_abs_t_minus_tphase = min(min_abs_t_minus_tphase, value)
+                            if np.any(np.isnan(t_minus_tphase)): # phase boundary not found; take the small steps
+                                min_abs_t_minus_tphase = 0.
                             cut1 = 0.8
                             cut2 = 0.2
                             small_delta_t = 0.3
@@ -1878,12 +2388,18 @@ class evol:
                 if not hasattr(self, 'profiles'): self.profiles = {}
                 if self.step in list(self.profiles):
                     assert done, 'step {} already in self.profiles; not expected'.format(self.step)
-                self.profiles[self.step] = self.get_profile()
+                # derived quantities to compute for each profile, e.g., ('g', 'gamma1', 'csound', 'brunt_n2')
+                derived = params['full_profiles_derived'] if 'full_profiles_derived' in list(params) else ()
+                self.profiles[self.step] = self.get_profile(derived)
             self.walltime = time.time() - start_time
             self.delta_y1 = prev_y1 - self.y[-1] if prev_y1 > 0 else 0
             self.append_history()
 
             self.previous_entropy = self.entropy
+            self.remember_accepted_profile(params[which_t])
+
+            if self.mesh_params['rezone_interval'] > 0 and self.step % self.mesh_params['rezone_interval'] == 0 and not done:
+                self.rezone()
 
             # realtime output
             if self.status != 'okay': limit = 'fail'
@@ -1898,10 +2414,66 @@ class evol:
                     self.y[-1], mhe_rerr, self.walltime
                 print(stdout_format.format(*stdout_data))
 
+    def remember_accepted_profile(self, t_surf):
+        '''keep the last three accepted models, labeled by the stepping variable (t1 or t10), for predict_static_guess.'''
+        self.accepted_profiles.append({
+            'tsurf':t_surf,
+            'm':np.copy(self.m),
+            'logp':np.copy(self.logp),
+            'logt':np.copy(self.logt),
+            'r':np.copy(self.r),
+            'y':np.copy(self.y)
+            })
+        self.accepted_profiles = self.accepted_profiles[-3:]
+
+    def predict_static_guess(self, t_surf, order, predict_y=True):
+        '''
+        set p, t, r (and y if predict_y) to a polynomial extrapolation in the stepping variable, to t_surf,
+        through the last order + 1 accepted models, each taken as a function of mass coordinate. the static
+        iterations then start from there rather than from the last accepted model. does nothing if fewer models
+        are available, or if the extrapolated profile is unusable (non-finite p, t or r, or non-monotone r).
+        '''
+        profiles = self.accepted_profiles[-(order + 1):]
+        if len(profiles) < 2:
+            return
+        tvals = np.array([prof['tsurf'] for prof in profiles])
+        # lagrange weights for evaluating the interpolating polynomial at t_surf
+        weights = np.ones(len(profiles))
+        for i in range(len(profiles)):
+            for j in range(len(profiles)):
+                if j != i:
+                    weights[i] *= (t_surf - tvals[j]) / (tvals[i] - tvals[j])
+
+        predicted = {}
+        for name in 'logp', 'logt', 'r', 'y':
+            predicted[name] = np.zeros(self.nz)
+            for weight, prof in zip(weights, profiles):
+                if np.array_equal(prof['m'], self.m):
+                    x = prof[name]
+                else: # mesh has been rezoned since this model was accepted
+                    x = np.interp(self.m, prof['m'], prof[name])
+                predicted[name] += weight * x
+
+        if not all(np.all(np.isfinite(predicted[name])) for name in predicted):
+            return
+        if np.any(np.diff(predicted['r']) <= 0):
+            return
+
+        self.logp[:] = predicted['logp']
+        self.logt[:] = predicted['logt']
+        self.p[:] = 10 ** self.logp
+        self.t[:] = 10 ** self.logt
+        self.r[:] = predicted['r']
+        if predict_y: # where extrapolated y is unphysical, keep y of the last model
+            y = predicted['y'][self.kcore:]
+            ok = (y > 0.) & (y < 1.)
+            self.y[self.kcore:][ok] = y[ok]
+
     def append_history(self):
             history_qtys = {
                 'step': self.step,
                 'iters': self.iters,
+                'iters_rain': self.iters_rain if hasattr(self, 'phase') else 0,
                 'age': self.age_gyr,
                 'dt_yr': self.dt_yr,
                 'radius': self.rtot,
@@ -1935,13 +2507,17 @@ class evol:
             for key, qty in history_qtys.items():
                 if not key in list(self.history):
                     # initialize ndarray for this column
-                    if key in ('step', 'iters', 'nz_gradient', 'nz_shell', 'kcore', 'ktrans', 'k_shell_top', 'k_gradient_bot', 'k_gradient_top'):
+                    if key in ('step', 'iters', 'iters_rain', 'nz_gradient', 'nz_shell', 'kcore', 'ktrans', 'k_shell_top', 'k_gradient_bot', 'k_gradient_top'):
                         self.history[key] = np.array([], dtype=int)
                     else:
                         self.history[key] = np.array([])
                 self.history[key] = np.append(self.history[key], qty)
 
-    def get_profile(self):
+    def get_profile(self, derived=()):
+        '''
+        copies of the model's profiles. derived quantities (see derived_groups) are only included if named in
+        derived, which computes them if necessary, or if they've already been computed for this model.
+        '''
         import copy
         profile = {}
         profile['k'] = np.arange(self.nz)
@@ -1956,12 +2532,16 @@ class evol:
         profile['m'] = np.copy(self.m)
         for qty in 'g', 'dlogp_dlogrho', 'gamma1', 'csound', 'brunt_n2', 'chirho', 'chit', 'gradt', 'grada', \
             'cp', 'cv', 'rf', 'mf', 'grady', 'brunt_b', 'ymax', 'dy', 'delta_s', 'eps_grav', 'tds', 'luminosity':
+            if self.is_derived(qty) and not qty in derived and not self.is_available(qty):
+                continue
+            # chirho, chit and grada with the core filled in, if the thermo quantities are current
+            source = qty + '_full' if self.is_available(qty + '_full') else qty
             try:
-                profile[qty] = np.copy(getattr(self, qty))
+                profile[qty] = np.copy(getattr(self, source))
             except AttributeError:
                 pass
-        if hasattr(self, 'tck_ymax'):
-            profile['tck_ymax'] = copy.copy(self.tck_ymax)
+        if hasattr(self, 'ymax_nodes'):
+            profile['tck_ymax'] = splrep(*self.ymax_nodes, k=1)
         # if self.step > 0:
         #     profile['delta_s'] = np.copy(self.delta_s)
         #     profile['eps_grav'] = np.copy(self.eps_grav)
@@ -1977,7 +2557,7 @@ class evol:
     def dump_profile(self, prefix):
         assert type(prefix) is str, 'output_prefix needs to be a string.'
         with open('{}{}.profile' % (prefix, self.step), 'w') as f:
-            pickle.dump(self.get_profile(), f, 0) # 0 means dump as text
+            pickle.dump(self.get_profile(evol.derived_groups['thermo'] + evol.derived_groups['seismology']), f, 0) # 0 means dump as text
         print('wrote profile data to {}{}.profile'.format(prefix, self.step))
 
     def smooth(self, array, std):
@@ -2005,6 +2585,8 @@ class evol:
                     erase_z_discontinuity_from_brunt=False,
                     omit_brunt_composition_term=False):
 
+        self.set_derivatives_etc()
+
         # try to be smart about output filenames
         if '.profile' in outfile and '.gyre' in outfile:
             print('please pass save_profile an output path with either .gyre or .profile extensions, or neither. not both. please.')
@@ -2073,7 +2655,7 @@ class evol:
                 for k in np.arange(self.nz):
                     if k == 0: continue
                     f.write(line_format % (k, self.r[k], w[k], dummy_luminosity, self.p[k], self.t[k], self.rho[k], \
-                                           self.gradt[k], brunt_n2_for_gyre_model[k], self.gamma1[k], self.grada[k], -1. * self.dlogrho_dlogt_const_p[k], \
+                                           self.gradt[k], brunt_n2_for_gyre_model[k], self.gamma1[k], self.grada_full[k], -1. * self.dlogrho_dlogt_const_p[k], \
                                            dummy_kappa, dummy_kappa_t, dummy_kappa_rho,
                                            dummy_epsilon, dummy_epsilon_t, dummy_epsilon_rho,
                                            omega))
@@ -2101,6 +2683,8 @@ class evol:
             # write vectors
             vector_names = 'p', 't', 'rho', 'y', 'z', 'entropy', 'r', 'm', 'g', 'gamma1', \
                 'csound', 'lamb_s12', 'brunt_n2', 'brunt_n2_direct', 'brunt_b', 'chirho', 'chit', 'gradt', 'grada', 'gradt_direct', 'rf', 'mf'
+            # columns written from the versions with the core filled in
+            vector_sources = {'chirho':'chirho_full', 'chit':'chit_full', 'grada':'grada_full'}
             n_vectors = len(vector_names)
             vector_header_fmt = '%20s ' * n_vectors
             f.write(vector_header_fmt % vector_names)
@@ -2108,7 +2692,7 @@ class evol:
             for k in np.arange(self.nz):
                 for name in vector_names:
                     try:
-                        f.write('%20.10g ' % getattr(self, name)[k])
+                        f.write('%20.10g ' % getattr(self, vector_sources.get(name, name))[k])
                     except:
                         print(k, name)
                 f.write('\n')
@@ -2116,6 +2700,25 @@ class evol:
 
             print('wrote %i zones to %s' % (k, outfile))
 
+class workspace:
+    '''
+    named scratch arrays for the static iteration. get returns the same array every time it's asked for
+    a given name and length, so the steady-state iteration allocates next to nothing; the contents are only
+    good until the next get of that name and length. with enabled=False every get returns a fresh array,
+    which reproduces the allocation behavior of the code before buffers were reused (see benchmark_alloc.py).
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.buffers = {}
+
+    def get(self, name, n):
+        if not self.enabled:
+            return np.empty(n)
+        key = (name, n)
+        if not key in self.buffers:
+            self.buffers[key] = np.empty(n)
+        return self.buffers[key]
+
 class EOSError(Exception):
     pass
 
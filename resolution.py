@@ -0,0 +1,228 @@
+'''
+resolution convergence tests: run the same static or evolve case over a ladder of nz and a set of mesh_params
+variants, extrapolate the key scalars to infinite resolution, and recommend the cheapest setting whose errors
+are within given tolerances.
+
+the recommendation is saved as json holding the evol_params and mesh_params to pass to ongp.evol; see load_config.
+compare_rezone checks evolve with adaptive rezoning (mesh_params['rezone_interval']; see ongp.evol.rezone) at
+half the nz of a fixed-mesh reference against the fixed mesh at the same half nz.
+
+usage: python resolution.py [outfile], or python resolution.py rezone [nz]
+'''
+import sys
+import time
+import json
+import numpy as np
+from scipy.optimize import brentq
+import ongp
+
+default_nz_ladder = 256, 384, 512, 768, 1024, 1536, 2048
+default_nz = 1024 # ongp.evol's default, against which time saved is reported
+# relative tolerances on the final model's scalars. age only applies to evolve.
+default_tolerances = {'rtot':1e-4, 'teff':1e-4, 'y1':1e-4, 'age':1e-3}
+
+default_evol_params = {'hhe_eos_option':'scvh', 'z_eos_option':'reos water', 'atm_option':'f11_tables', 'atm_planet':'jup'}
+default_static_params = {'mtot':'jup', 't1':165., 'y1':0.27, 'z1':0.02, 'z2':0.1, 'mcore':10., 'transition_pressure':1.,
+                         'model_type':'three_layer'}
+
+default_evolve_params = {'mtot':'jup', 'y1':0.27, 'z1':0.02, 'z2':0.1, 'mcore':10., 'transition_pressure':1.,
+                         'model_type':'three_layer', 'start_t':1e3, 'end_t':165., 'stdout_interval':0}
+
+def run_case(evol_params, mesh_params, params, mode='static'):
+    '''build one model from scratch; return its scalars and the wall time in seconds.'''
+    e = ongp.evol(dict(evol_params), dict(mesh_params))
+    t0 = time.time()
+    if mode == 'static':
+        e.static(dict(params))
+    elif mode == 'evolve':
+        e.evolve(dict(params))
+    else:
+        raise ValueError("mode must be one of 'static' or 'evolve'.")
+    res = {'walltime':time.time() - t0, 'rtot':e.rtot, 'teff':e.teff, 'y1':e.y[-1]}
+    if mode == 'evolve':
+        res['age'] = e.age_gyr
+    return res
+
+def richardson(nz, values):
+    '''
+    extrapolate values(nz) to nz -> infinity assuming error ~ c * nz ** -order, from the three largest nz.
+    the order is found from the ratio of successive differences; if that fails (e.g., the values aren't
+    monotone in nz), order 1 is assumed and the two largest nz are used. returns (extrapolated value, order).
+    '''
+    nz = np.asarray(nz, dtype=float)
+    values = np.asarray(values, dtype=float)
+    ok = np.isfinite(values)
+    nz, values = nz[ok], values[ok]
+    if len(nz) < 2:
+        return np.nan, np.nan
+    i = np.argsort(nz)
+    h = 1. / nz[i]
+    f = values[i]
+    if len(nz) >= 3:
+        h1, h2, h3 = h[-3:]
+        f1, f2, f3 = f[-3:]
+        if f2 != f3 and (f1 - f2) / (f2 - f3) > 0:
+            ratio = (f1 - f2) / (f2 - f3)
+            func = lambda p: (h1 ** p - h2 ** p) / (h2 ** p - h3 ** p) - ratio
+            try:
+                order = brentq(func, 0.1, 10.)
+                return f3 - (f2 - f3) * h3 ** order / (h2 ** order - h3 ** order), order
+            except ValueError: # no root in range
+                pass
+    # first order from the two largest nz
+    h2, h3 = h[-2:]
+    f2, f3 = f[-2:]
+    return f3 - (f2 - f3) * h3 / (h2 - h3), 1.
+
+def converge(evol_params, params, mode='static', nz_ladder=default_nz_ladder, mesh_variants=({},),
+             tolerances=None, outfile=None, verbose=True):
+    '''
+    run params (as for static or evolve, per mode) at every nz in nz_ladder for each mesh_params dict in
+    mesh_variants (each updating ongp.evol's default mesh). each scalar named in tolerances is extrapolated
+    in nz separately for each variant, and errors of every run are measured relative to the extrapolation
+    for the first variant.
+
+    the recommended setting is the run of least wall time whose errors all fall within tolerances. if outfile
+    is given, it is written there as json (see load_config) along with its errors and the wall time saved
+    relative to nz=default_nz with the first mesh variant (run in addition if not already in the ladder).
+
+    returns a dict with 'runs' (one dict per run: nz, mesh_params, status, walltime, scalars and errors),
+    'extrapolated' and 'order' (dicts per scalar, lists over mesh_variants), 'recommended' (the chosen run,
+    or None if none meets the tolerances), and 'time_saved' (seconds per run relative to the default).
+    '''
+    if tolerances is None:
+        tolerances = {key:value for key, value in default_tolerances.items() if mode == 'evolve' or key != 'age'}
+    names = list(tolerances)
+    nz_ladder = sorted(nz_ladder)
+
+    runs = []
+    for j, mesh_params in enumerate(mesh_variants):
+        ladder = nz_ladder if j > 0 or default_nz in nz_ladder else sorted(list(nz_ladder) + [default_nz])
+        for nz in ladder:
+            these_evol_params = dict(evol_params)
+            these_evol_params['nz'] = nz
+            run = {'nz':nz, 'variant':j, 'mesh_params':dict(mesh_params), 'status':'okay', 'walltime':np.nan,
+                   'in_ladder':nz in nz_ladder}
+            try:
+                run.update(run_case(these_evol_params, mesh_params, params, mode))
+            except (ongp.EOSError, ongp.AtmError, ongp.HydroError, ongp.UnphysicalParameterError, ongp.ConvergenceError, ValueError) as e:
+                run['status'] = e
+            runs.append(run)
+            if verbose:
+                print('variant {:>3n} nz {:>6n} status {:>6s} et_s {:>8.2f} '.format(j, nz, str(run['status'])[:6], run['walltime']) + \
+                    ' '.join(['{} {:.8g}'.format(name, run.get(name, np.nan)) for name in names]))
+
+    extrapolated = {name:[] for name in names}
+    order = {name:[] for name in names}
+    for j in range(len(mesh_variants)):
+        these = [run for run in runs if run['variant'] == j and run['status'] == 'okay']
+        for name in names:
+            value, p = richardson([run['nz'] for run in these], [run[name] for run in these])
+            extrapolated[name].append(value)
+            order[name].append(p)
+
+    for run in runs:
+        run['errors'] = {}
+        run['meets_tolerances'] = run['status'] == 'okay'
+        for name in names:
+            ref = extrapolated[name][0]
+            run['errors'][name] = abs(run[name] / ref - 1.) if run['status'] == 'okay' else np.nan
+            if not run['errors'][name] <= tolerances[name]: # also catches nan
+                run['meets_tolerances'] = False
+
+    ok = [run for run in runs if run['meets_tolerances'] and run['in_ladder']]
+    recommended = min(ok, key=lambda run: run['walltime']) if ok else None
+    default = [run for run in runs if run['variant'] == 0 and run['nz'] == default_nz][0]
+    time_saved = default['walltime'] - recommended['walltime'] if recommended else np.nan
+
+    if verbose:
+        for name in names:
+            print('{:>6s} extrapolated {} order {}'.format(name, ' '.join(['{:.8g}'.format(x) for x in extrapolated[name]]),
+                ' '.join(['{:.2f}'.format(x) for x in order[name]])))
+        if recommended:
+            print('recommend nz {} with mesh variant {}: {:.2f} s per run, saving {:.2f} s ({:.0f}%) relative to nz {}'.format(
+                recommended['nz'], recommended['variant'], recommended['walltime'], time_saved,
+                time_saved / default['walltime'] * 1e2, default_nz))
+        else:
+            print('no setting meets the tolerances')
+
+    if outfile and recommended:
+        save_config(outfile, recommended, tolerances, default['walltime'], mode)
+
+    return {'runs':runs, 'extrapolated':extrapolated, 'order':order, 'recommended':recommended, 'time_saved':time_saved}
+
+def compare_rezone(evol_params, params, nz=default_nz, rezone_interval=1, tolerances=None, verbose=True):
+    '''
+    evolve params at nz on the fixed mesh as the reference, then at nz // 2 on the same fixed mesh and with
+    the envelope rezoned every rezone_interval steps. returns a dict with a run for each of 'reference', 'fixed'
+    and 'rezoned', as in converge: status, walltime, the final model's scalars and, for the latter two, their
+    errors relative to the reference and whether they meet tolerances.
+    '''
+    if tolerances is None:
+        tolerances = dict(default_tolerances)
+    names = list(tolerances)
+    settings = {
+        'reference':(nz, {}),
+        'fixed':(nz // 2, {}),
+        'rezoned':(nz // 2, {'rezone_interval':rezone_interval})
+        }
+    runs = {}
+    for label in 'reference', 'fixed', 'rezoned':
+        this_nz, mesh_params = settings[label]
+        run = {'nz':this_nz, 'mesh_params':mesh_params, 'status':'okay', 'walltime':np.nan}
+        try:
+            run.update(run_case(dict(evol_params, nz=this_nz), mesh_params, params, 'evolve'))
+        except (ongp.EOSError, ongp.AtmError, ongp.HydroError, ongp.UnphysicalParameterError, ongp.ConvergenceError, ValueError) as e:
+            run['status'] = e
+        runs[label] = run
+
+    ref = runs['reference']
+    for label in 'fixed', 'rezoned':
+        run = runs[label]
+        ok = run['status'] == 'okay' and ref['status'] == 'okay'
+        run['errors'] = {name:abs(run[name] / ref[name] - 1.) if ok else np.nan for name in names}
+        run['meets_tolerances'] = ok and all(run['errors'][name] <= tolerances[name] for name in names)
+
+    if verbose:
+        for label in 'reference', 'fixed', 'rezoned':
+            run = runs[label]
+            print('{:>9s} nz {:>6n} status {:>6s} et_s {:>8.2f} '.format(label, run['nz'], str(run['status'])[:6], run['walltime']) + \
+                ' '.join(['{} {:.8g}'.format(name, run.get(name, np.nan)) for name in names]))
+        for label in 'fixed', 'rezoned':
+            run = runs[label]
+            print('{:>9s} relative errors '.format(label) + ' '.join(['{} {:.2e}'.format(name, run['errors'][name]) for name in names]) + \
+                ' ({})'.format('within tolerances' if run['meets_tolerances'] else 'not within tolerances'))
+
+    return runs
+
+def save_config(outfile, run, tolerances, default_walltime, mode):
+    config = {
+        'evol_params':{'nz':run['nz']},
+        'mesh_params':run['mesh_params'],
+        'mode':mode,
+        'tolerances':tolerances,
+        'errors':run['errors'],
+        'walltime':run['walltime'],
+        'default_walltime':default_walltime,
+        'time_saved':default_walltime - run['walltime']
+        }
+    with open(outfile, 'w') as f:
+        json.dump(config, f, indent=4, sort_keys=True)
+
+def load_config(infile):
+    '''
+    the (evol_params, mesh_params) saved by converge. evol_params has only the resolution settings, so update
+    the usual dict with it: e.g., ongp.evol(dict(my_evol_params, **evol_params), mesh_params).
+    '''
+    with open(infile) as f:
+        config = json.load(f)
+    return config['evol_params'], config['mesh_params']
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'rezone':
+        nz = int(sys.argv[2]) if len(sys.argv) > 2 else default_nz
+        runs = compare_rezone(default_evol_params, default_evolve_params, nz=nz)
+        sys.exit(0 if runs['rezoned']['meets_tolerances'] else 1)
+    outfile = sys.argv[1] if len(sys.argv) > 1 else 'resolution.json'
+    mesh_variants = {}, {'amplitude_surface_mesh_boost':1e4}, {'amplitude_surface_mesh_boost':1e6}
+    converge(default_evol_params, default_static_params, mesh_variants=mesh_variants, outfile=outfile)
@@ -0,0 +1,140 @@
+'''
+on-disk cache of converged static models, keyed by a hash of everything that determines the model:
+evol_params, mesh_params, the params passed to static, the contents of the eos/atm data directory,
+and the helium mass and mesh if continuing from an existing model (as in evolve, where the mesh may have
+been rezoned; see ongp.evol.rezone). models continuing from an existing
+model with helium rain aren't cached; see static_cache.usable.
+
+each model is one .npz file named for its key, holding the profiles and a json string of scalars.
+when the directory grows beyond max_mb, least recently used files are deleted.
+'''
+import numpy as np
+import hashlib
+import json
+import os
+
+# bump if the set or meaning of cached quantities changes, to orphan existing files
+version = 1
+
+# attributes restored on a cache hit: arrays (all of length nz or nz - 1) and scalars
+profile_names = 'm', 'dm', 'p', 't', 'rho', 'r', 'y', 'z', 'logp', 'logt', 'logrho', \
+    'grada', 'gradt', 'chirho', 'chit', 'chiy', 'grady', 'brunt_b', 'entropy'
+scalar_names = 'mtot', 'mcore', 'kcore', 'ktrans', 'y1', 'y2', 'z1', 'z2', 'mhe', 'teq', \
+    'k1', 'k_shell_top', 'k_gradient_top', 'k_gradient_bot', 'nz_gradient', \
+    'iters', 'iters_rain', 'rtot', 'atm_which_t', 't1', 't10', 't990', 'surface_g', 'tint', 'teff', 'lint'
+# what's stored for static(..., outputs='scalars'). these don't include the structure of the model, so a hit
+# leaves the instance's mesh and profiles as they were; the derived integrals are stored instead of recomputed.
+output_scalar_names = 'iters', 'rtot', 'atm_which_t', 't1', 't10', 'surface_g', 'tint', 'teff', 'lint', \
+    'mz_env_outer', 'mz_env_inner', 'mz_env', 'mz_core', 'mz', 'bulk_z', 'ysurf', 'envelope_mean_y', 'nmoi'
+
+def canonical(obj):
+    '''json fallback for numpy types and anything else (by repr).'''
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    else:
+        return repr(obj)
+
+class static_cache:
+    def __init__(self, path, max_mb=1e3):
+        self.path = path
+        self.max_bytes = max_mb * 1e6
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.data_versions = {}
+
+    def get_data_version(self, path_to_data):
+        '''hash of relative path, size and mtime of every file under path_to_data; computed once per path.'''
+        if not path_to_data in self.data_versions:
+            h = hashlib.sha1()
+            for root, dirs, files in sorted(os.walk(path_to_data)):
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    stat = os.stat(full)
+                    h.update('{} {} {}\n'.format(os.path.relpath(full, path_to_data), stat.st_size, int(stat.st_mtime)).encode())
+            self.data_versions[path_to_data] = h.hexdigest()
+        return self.data_versions[path_to_data]
+
+    def usable(self, e):
+        '''
+        False if e continues from an existing model with helium rain: the result then also depends on the
+        starting y profile, k1, k_shell_top and rain state of e, which aren't part of the key.
+        '''
+        return not (hasattr(e, 'mtot') and hasattr(e, 'phase'))
+
+    def get_key(self, e, params, outputs='full'):
+        state = {
+            'version':version,
+            'outputs':outputs,
+            'evol_params':e.evol_params,
+            'mesh_params':e.mesh_params,
+            'static_params':params,
+            'data':self.get_data_version(e.evol_params['path_to_data']),
+            'mhe':e.mhe if hasattr(e, 'mtot') else None, # continuing from an existing model
+            'mesh':hashlib.sha1(np.ascontiguousarray(e.m).tobytes()).hexdigest() if hasattr(e, 'mtot') else None,
+            'age_gyr':e.age_gyr if params.get('evolve_solar_luminosity') else None
+            }
+        s = json.dumps(state, sort_keys=True, default=canonical)
+        return hashlib.sha1(s.encode()).hexdigest()
+
+    def get_filename(self, key):
+        return os.path.join(self.path, '{}.npz'.format(key))
+
+    def load(self, key, e):
+        '''if key is cached, set its profiles and scalars as attributes of e and return True; else return False.'''
+        fname = self.get_filename(key)
+        if not os.path.exists(fname):
+            return False
+        try:
+            with np.load(fname) as data:
+                for name in profile_names:
+                    if name in data.files:
+                        setattr(e, name, np.array(data[name]))
+                scalars = json.loads(str(data['scalars']))
+        except (IOError, ValueError, KeyError): # partly written or corrupt; treat as a miss
+            return False
+        e.profile_version += 1
+        # ymax nodes belong to whatever model e held before; see evol.equilibrium_y_profile
+        if hasattr(e, 'ymax_nodes'):
+            del(e.ymax_nodes)
+        for name, value in scalars.items():
+            if name in e.derived_groups['integrals']:
+                e.set_derived(name, value)
+            else:
+                setattr(e, name, value)
+        os.utime(fname, None) # mark as recently used
+        return True
+
+    def save(self, key, e, profiles=True):
+        '''store the model on e under key; with profiles=False, just the output scalars.'''
+        if profiles:
+            arrays = {name:getattr(e, name) for name in profile_names if e.is_available(name) and getattr(e, name) is not None}
+            scalars = {name:getattr(e, name) for name in scalar_names if e.is_available(name)}
+        else:
+            arrays = {}
+            # the derived ones among these are the integrals, computed here if need be since they're outputs
+            scalars = {name:getattr(e, name) for name in output_scalar_names if e.is_available(name) or e.is_derived(name)}
+        arrays['scalars'] = np.array(json.dumps(scalars, default=canonical))
+        fname = self.get_filename(key)
+        tmp = fname + '.tmp.npz'
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, fname) # so that a reader never sees a partial file
+        self.evict()
+
+    def evict(self):
+        '''delete least recently used models until the cache is within max_bytes.'''
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz') and not name.endswith('.tmp.npz'):
+                stat = os.stat(os.path.join(self.path, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size